@@ -248,6 +248,9 @@ HEAT_SOURCE_OFF = 0
 HEAT_SOURCE_ON = 1
 HEAT_SOURCE_INITIALISE = 9
 
+# HEAT SOURCE KEEP ALIVE - SSR302 / SSR303 need reminding of their state within the hour
+HEAT_SOURCE_KEEP_ALIVE_SECONDS = 3300.0  # 3,300 seconds = 55 minutes :)
+
 # ADVANCED OPTIONS
 ADVANCED_OPTION_NOT_SET = 0
 ADVANCED_OPTION_NONE = 1
@@ -375,6 +378,62 @@ QUEUE_PRIORITY_DISCOVERY      = 600
 QUEUE_PRIORITY_POLLING        = 700
 QUEUE_PRIORITY_LOW            = 800
 
+# QUEUE Lanes (trvHandler) - each lane holds the priorities from its lower bound up to the next lane's lower bound
+QUEUE_LANE_CONTROL = 'Control'
+QUEUE_LANE_STATUS = 'Status'
+QUEUE_LANE_LOW = 'Low'
+QUEUE_LANES = ((QUEUE_LANE_CONTROL, QUEUE_PRIORITY_STOP_THREAD), (QUEUE_LANE_STATUS, QUEUE_PRIORITY_STATUS_HIGH), (QUEUE_LANE_LOW, QUEUE_PRIORITY_LOW))
+
+# Whole file CSV / graph refreshes that can be coalesced or shed when the Low lane is full - a later refresh rewrites the same files.
+# Standard CSV rows aren't queued: they are added straight to the CSV Writer thread, so the Low lane only holds these refreshes.
+QUEUE_SHEDDABLE_COMMANDS = (CMD_UPDATE_ALL_CSV_FILES, CMD_UPDATE_ALL_CSV_FILES_VIA_POSTGRESQL, CMD_INVOKE_DATAGRAPH_USING_POSTGRESQL_TO_CSV)
+
+QUEUE_LOW_LANE_CAPACITY_DEFAULT = 500
+QUEUE_AGING_SECONDS_DEFAULT = 60
+
+# Handler thread watchdog
+WATCHDOG_CHECK_SECONDS = 5
+WATCHDOG_QUEUE_STALL_SECONDS = 60  # Queue has entries waiting but none dequeued for this long
+WATCHDOG_HEARTBEAT_SECONDS = 60  # Interval between TRV Controller 'handlerHeartbeat' state updates
+WATCHDOG_STALL_HISTORY = 20
+WATCHDOG_STATUS_OK = 'OK'
+WATCHDOG_COMMAND_BUDGET_DEFAULT_SECONDS = 30
+WATCHDOG_COMMAND_BUDGETS_SECONDS = {CMD_UPDATE_ALL_CSV_FILES: 120,
+                                    CMD_UPDATE_ALL_CSV_FILES_VIA_POSTGRESQL: 300,
+                                    CMD_INVOKE_DATAGRAPH_USING_POSTGRESQL_TO_CSV: 300}
+WATCHDOG_RESTATE_SECONDS_PER_CONTROLLER = 10  # Restating schedules disables / enables each TRV Controller with a 7 second pause
+
+# Timer groups (in globals['timers']) keyed by TRV Controller that are cancelled when the TRV Controller is stopped - they are re-created when
+# it is started. 'raceCondition' is not included as its timer re-enables the TRV Controller after it has been stopped.
+TRV_CONTROLLER_TIMER_GROUPS = ('heatingSchedules', 'command', 'SpiritPolling', 'SpiritValveCommands', 'advanceCancel', 'boost', 'temperatureBroadcastRemote', 'temperatureBroadcastRadiator')
+
+SHUTDOWN_JOIN_TIMEOUT_SECONDS = 10.0  # Longest time shutdown waits for the handler threads and timers to end
+
+# Longest time TRV Controller state changes are buffered by the TRV Handler before being written to Indigo
+STATE_WRITE_BEHIND_SECONDS = 0.5
+
+# TRV Controller states recorded in the time-series store
+TIME_SERIES_STATES = ('setpointHeat', 'temperatureTrv', 'setpointHeatTrv', 'valvePercentageOpen', 'temperatureRemote', 'setpointHeatRemote', 'temperatureRadiator')
+TIME_SERIES_FOLDER_NAME = 'TimeSeries'
+DATAGRAPH_POINT_BUDGET_DEFAULT = 1000  # Most rows in a bucketed DataGraph CSV file
+
+TIME_SERIES_AVERAGED_STATES = ('temperatureTrv', 'temperatureRemote', 'temperatureRadiator')  # Exported from rollups as the bucket mean - other states as the last value
+
+# Standard CSV files written by the CSV Writer thread
+CSV_FLUSH_SECONDS_DEFAULT = 5  # Interval between writes of the CSV files with new rows - the rows added in the interval are written together
+
+# Fleet-wide export job
+EXPORT_JOB_CHECK_SECONDS = 1  # How often the export job thread checks for a requested, scheduled or notified run
+EXPORT_JOB_INTERVAL_MINUTES_DEFAULT = 0  # Minutes between scheduled runs - 0 = only when requested from the menu
+EXPORT_JOB_WORKERS_DEFAULT = 4  # TRV Controllers exported in parallel, each worker with its own history database connection
+EXPORT_JOB_WORKERS_MAXIMUM = 16
+
+# Export listener - exports driven by PostgreSQL NOTIFY from triggers on the SQL Logger's 'device_history_{id}' tables
+EXPORT_NOTIFY_DEBOUNCE_SECONDS_DEFAULT = 30  # A TRV Controller is exported this long after the first new history row since its last export
+EXPORT_NOTIFY_IDLE_SECONDS = 1  # Longest wait for a notification before checking for due exports
+EXPORT_NOTIFY_SYNC_SECONDS = 60  # How often the triggers are matched to the started TRV Controllers e.g. for a table SQL Logger has just created
+EXPORT_NOTIFY_RETRY_SECONDS = 60  # Wait before reconnecting after the listening connection fails
+
 K_LOG_LEVEL_NOT_SET = 0
 K_LOG_LEVEL_DETAILED_DEBUGGING = 5
 K_LOG_LEVEL_DEBUGGING = 10
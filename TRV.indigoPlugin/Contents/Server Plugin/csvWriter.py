@@ -0,0 +1,162 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# CSV Writer © Autolog 2022
+#
+
+try:
+    # noinspection PyUnresolvedReferences
+    import indigo
+except ImportError:
+    pass
+
+import collections
+import datetime
+import os
+import threading
+
+from constants import *
+
+CSV_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'  # e.g. 2017-04-09 17:26:13.956000
+CSV_TIMESTAMP_LENGTH = 26
+
+
+# noinspection PyPep8Naming
+class CsvFileRows:
+
+    # The retained rows of a Standard CSV file, as written to the file (without the header), oldest first
+
+    def __init__(self, trvCtlrDevId, stateName):
+        self.trvCtlrDevId = trvCtlrDevId
+        self.stateName = stateName
+        self.retentionHours = 0
+        self.rows = None  # collections.deque once loaded from the file on its first write
+        self.pendingRows = list()  # Rows added since the last write
+
+
+# noinspection PyUnresolvedReferences, PyPep8Naming
+class ThreadCsvWriter(threading.Thread):
+
+    # Owns the Standard CSV files. A state change adds a row to the file's pending rows (called directly from Indigo's callbacks, rather
+    # than being queued to the TRV Handler, so a storm of state changes can't grow its queue) and every 'csvFlushSeconds' this thread
+    # writes each file with pending rows once, however many rows were added. Each file's rows for its retention period are held in a
+    # deque, so a file is only read once - when it is first written after the plugin starts - and never re-read. Rows older than the
+    # retention period are dropped from the front, the latest dropped row being re-timed to the start of the period as before. A file is
+    # written to a temporary file which replaces it, so a reader never sees a partly written file; with 'csvFsyncEnabled' the temporary
+    # file is also flushed to disk before the rename.
+
+    def __init__(self, pluginGlobals, event):
+
+        threading.Thread.__init__(self, name='TRV_CsvWriter')
+
+        self.globals = pluginGlobals
+
+        self.csvWriterLogger = logging.getLogger("Plugin.CsvWriter")
+
+        self.threadStop = event
+
+        self.lock = threading.Lock()  # Serialises access to self.files and the pending rows
+        self.writeLock = threading.Lock()  # Serialises writes, which are made from this thread and (on a TRV Controller stopping) deviceStopComm
+        self.files = dict()  # csvFilename -> CsvFileRows
+
+        self.updates = 0
+        self.writes = 0
+        self.bytesWritten = 0
+
+    def run(self):
+
+        self.csvWriterLogger.debug('CSV Writer Thread initialised')
+
+        while not self.threadStop.wait(self.globals['config']['csvFlushSeconds']):
+            self.flush()
+        self.flush()  # Pending rows written on plugin shutdown
+
+        self.csvWriterLogger.debug('CSV Writer Thread ended.')
+
+    def addRow(self, trvCtlrDevId, stateName, value):
+        # Add the state's new value to its Standard CSV file - the file is written by this thread
+        if not self.globals['config']['csvStandardEnabled'] or self.globals['trvc'][trvCtlrDevId]['csvCreationMethod'] != 1:  # Standard CSV Output
+            return
+
+        csvFilename = f'{self.globals["config"]["csvPath"]}/{self.globals["config"]["csvPrefix"]}_{self.globals["trvc"][trvCtlrDevId]["csvShortName"]}_{stateName}.csv'
+        row = f'{datetime.datetime.now().strftime(CSV_TIMESTAMP_FORMAT)},{value}'
+        with self.lock:
+            csvFile = self.files.get(csvFilename, None)
+            if csvFile is None:
+                csvFile = self.files[csvFilename] = CsvFileRows(trvCtlrDevId, stateName)
+            csvFile.retentionHours = self.globals['trvc'][trvCtlrDevId]['csvRetentionPeriodHours']
+            csvFile.pendingRows.append(row)
+            self.updates += 1
+
+    def flush(self, trvCtlrDevId=None):
+        # Write every file (of trvCtlrDevId, if given) that has pending rows
+        with self.writeLock:
+            with self.lock:
+                pendingFiles = list()
+                for csvFilename, csvFile in self.files.items():
+                    if csvFile.pendingRows and (trvCtlrDevId is None or csvFile.trvCtlrDevId == trvCtlrDevId):
+                        pendingFiles.append((csvFilename, csvFile, csvFile.pendingRows, csvFile.retentionHours))
+                        csvFile.pendingRows = list()
+
+            for csvFilename, csvFile, pendingRows, retentionHours in pendingFiles:
+                try:
+                    self.writeFile(csvFilename, csvFile, pendingRows, retentionHours)
+                except Exception as exception_error:
+                    self.csvWriterLogger.error(f'CSV file \'{csvFilename}\' not written: {exception_error}')
+
+    def close(self, trvCtlrDevId):
+        # Write and forget a stopped TRV Controller's files - they are re-read if it is started again
+        self.flush(trvCtlrDevId)
+        with self.lock:
+            for csvFilename in [csvFilename for csvFilename, csvFile in self.files.items() if csvFile.trvCtlrDevId == trvCtlrDevId]:
+                del self.files[csvFilename]
+
+    def statistics(self):
+        with self.lock:
+            return {'files': len(self.files), 'updates': self.updates, 'writes': self.writes, 'bytes': self.bytesWritten,
+                    'pending': sum([len(csvFile.pendingRows) for csvFile in self.files.values()])}
+
+    # Following methods are called with self.writeLock held
+
+    def writeFile(self, csvFilename, csvFile, pendingRows, retentionHours):
+        if csvFile.rows is None:
+            csvFile.rows = self.loadRows(csvFilename, pendingRows[0][0:CSV_TIMESTAMP_LENGTH])
+        rows = csvFile.rows
+        rows.extend(pendingRows)
+
+        checkTimeStr = (datetime.datetime.now() - datetime.timedelta(hours=retentionHours)).strftime(CSV_TIMESTAMP_FORMAT)
+        droppedRow = ''
+        while rows and rows[0][0:CSV_TIMESTAMP_LENGTH] < checkTimeStr:
+            droppedRow = rows.popleft()
+        if rows and rows[0][0:CSV_TIMESTAMP_LENGTH] > checkTimeStr:
+            rows.appendleft(checkTimeStr + (droppedRow if droppedRow != '' else rows[0])[CSV_TIMESTAMP_LENGTH:])  # The value in force at the start of the retention period
+
+        self.csvWriterLogger.debug(f'CSV FILE NAME = \'{csvFilename}\', Time = \'{checkTimeStr}\', State = \'{csvFile.stateName}\', Rows Added = {len(pendingRows)}')
+
+        headerName = f'{indigo.devices[csvFile.trvCtlrDevId].name} - {csvFile.stateName}'.replace(',', '_')  # Replace any commas with underscore to avoid CSV file problems
+        data = (f'Timestamp,{headerName}\n' + ''.join([f'{row}\n' for row in rows])).encode('utf-8')
+        temporaryFilename = f'{csvFilename}.tmp'
+        with open(temporaryFilename, 'wb') as csvFileOut:
+            csvFileOut.write(data)
+            if self.globals['config']['csvFsyncEnabled']:
+                csvFileOut.flush()
+                os.fsync(csvFileOut.fileno())
+        os.replace(temporaryFilename, csvFilename)
+
+        with self.lock:
+            self.writes += 1
+            self.bytesWritten += len(data)
+
+    def loadRows(self, csvFilename, firstPendingTimeStr):
+        # The file's own rows before the first pending row, exactly as written
+        rows = collections.deque()
+        try:
+            with open(csvFilename) as csvFileIn:
+                next(csvFileIn, None)  # Skip header
+                for line in csvFileIn:
+                    line = line.strip()
+                    if line != '' and line[0:CSV_TIMESTAMP_LENGTH] < firstPendingTimeStr:
+                        rows.append(line)
+        except IOError:
+            pass  # IO Error can validly occur if file hasn't yet been created
+        return rows
@@ -0,0 +1,104 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# DataGraph Render Cache © Autolog 2022
+#
+
+import datetime
+import hashlib
+import json
+import os
+import threading
+
+DATAGRAPH_RENDER_CACHE_FILE_NAME = 'datagraphRenders.json'
+DATAGRAPH_RENDER_WINDOW_MINUTES = 15  # An unchanged graph is still re-rendered when its period has moved on into the next window
+
+
+# noinspection PyPep8Naming
+def datagraphRenderWindow(rowTimeStr):
+    # The DATAGRAPH_RENDER_WINDOW_MINUTES window a DataGraph CSV timestamp (e.g. 2022-03-04 17:26:13) falls in, or the timestamp itself if it can't be read
+    try:
+        return int(datetime.datetime.strptime(rowTimeStr.strip(), '%Y-%m-%d %H:%M:%S').timestamp() // (DATAGRAPH_RENDER_WINDOW_MINUTES * 60))
+    except ValueError:
+        return rowTimeStr
+
+
+# noinspection PyPep8Naming
+def datagraphInputDigest(csvFilename, renderArguments):
+    # SHA-256 of what a DataGraph render depends on: the render arguments (CLI, template, output image and title) and the CSV file. The
+    # first and last rows of a DataGraph CSV file are the start of the period and now, so their timestamps differ on every export - they are
+    # left out, leaving a digest that changes when a state changed or a change left the period. So that the graph's time axis still moves
+    # on while nothing changes, the start of the period is included rounded down to DATAGRAPH_RENDER_WINDOW_MINUTES.
+
+    digest = hashlib.sha256()
+    for argument in renderArguments:
+        digest.update(f'{argument}\n'.encode('utf-8'))
+
+    with open(csvFilename, 'rb') as csvFileIn:
+        digest.update(csvFileIn.readline())  # Header
+        previousLine = None  # Each row is hashed once the next is read, so the last row can be told apart
+        previousIsFirstRow = False
+        for line in csvFileIn:
+            if previousLine is not None:
+                digest.update(previousLine)
+                previousLine, previousIsFirstRow = line, False
+            else:
+                firstRowTime, separator, previousLine = line.partition(b',')  # First row without its timestamp
+                previousIsFirstRow = True
+                digest.update(f'{datagraphRenderWindow(firstRowTime.decode("utf-8"))}\n'.encode('utf-8'))
+        if previousLine is not None:
+            digest.update(previousLine if previousIsFirstRow else previousLine.split(b',', 1)[-1])  # Last row without its timestamp
+
+    return digest.hexdigest()
+
+
+# noinspection PyPep8Naming
+class DatagraphRenderCache:
+
+    # The input digest of each TRV Controller's latest successful DataGraph render, persisted so a render is skipped after a plugin restart
+    # too. A render is skipped when the digest is unchanged and the output image still exists. Shared by the TRV Handler and export job
+    # workers, serialised by self.lock.
+
+    def __init__(self, cachePath):
+        self.lock = threading.Lock()
+        self.cachePath = cachePath
+        self.digests = dict()  # str(trvCtlrDevId) -> hex digest (str keys as stored in JSON)
+        self.renders = 0
+        self.rendersSkipped = 0
+        try:
+            with open(self.cachePath) as cacheFile:
+                self.digests = dict(json.load(cacheFile))
+        except (IOError, ValueError, TypeError):
+            pass  # No cache yet (or unreadable) - every TRV Controller is rendered once
+
+    def unchanged(self, trvCtlrDevId, digest, outputImagePath):
+        # True (counted as a skipped render) if the TRV Controller was last rendered from the same input and the image is still there
+        with self.lock:
+            if self.digests.get(str(trvCtlrDevId), None) == digest and os.path.exists(outputImagePath):
+                self.rendersSkipped += 1
+                return True
+            return False
+
+    def rendered(self, trvCtlrDevId, digest):
+        with self.lock:
+            self.renders += 1
+            self.digests[str(trvCtlrDevId)] = digest
+            self.save()
+
+    def delete(self, trvCtlrDevId):
+        with self.lock:
+            if self.digests.pop(str(trvCtlrDevId), None) is not None:
+                self.save()
+
+    def statistics(self):
+        with self.lock:
+            return {'renders': self.renders, 'skipped': self.rendersSkipped}
+
+    # Following method is called with self.lock held
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.cachePath), exist_ok=True)
+        temporaryPath = f'{self.cachePath}.tmp'
+        with open(temporaryPath, 'w') as cacheFile:
+            json.dump(self.digests, cacheFile)
+        os.replace(temporaryPath, self.cachePath)
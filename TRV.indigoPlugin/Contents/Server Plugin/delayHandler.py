@@ -54,6 +54,8 @@ class ThreadDelayHandler(threading.Thread):
 
             while not self.threadStop.is_set():
                 try:
+                    self.globals['profiler'].checkpoint('delayHandler')  # Starts / stops cProfile for this thread when profiling is requested
+
                     delayQueuedEntry = self.globals['queues']['delayHandler'].get(True, 5)
 
                     # delayQueuedEntry format:
@@ -75,14 +77,20 @@ class ThreadDelayHandler(threading.Thread):
                     if trvCommand != CMD_ACTION_POLL:
                         continue
 
-                    self.globals['queues']['trvHandler'].put([QUEUE_PRIORITY_STATUS_MEDIUM, 0, CMD_ACTION_POLL, trvCommandDevId, []])
+                    executeStartTime = time.time()
+                    self.globals['watchdog']['delayHandler'].commandStarted(trvCommand, trvCommandDevId)
+                    try:
+                        self.globals['queues']['trvHandler'].put([QUEUE_PRIORITY_STATUS_MEDIUM, 0, CMD_ACTION_POLL, trvCommandDevId, []])
 
-                    delay_time = self.globals['config']['delayQueueSeconds']
-                    self.delayHandlerLogger.debug(
-                        f'DELAY QUEUE ENTRY RETRIEVED FOR DEVICE: {indigo.devices[trvCommandDevId].name}, Command is \'{CMD_TRANSLATION[CMD_ACTION_POLL]}\'.\nDELAYING FOR {delay_time} SECONDS. Remaining queue size is {self.globals["queues"]["delayHandler"].qsize()}')
+                        delay_time = self.globals['config']['delayQueueSeconds']
+                        self.delayHandlerLogger.debug(
+                            f'DELAY QUEUE ENTRY RETRIEVED FOR DEVICE: {indigo.devices[trvCommandDevId].name}, Command is \'{CMD_TRANSLATION[CMD_ACTION_POLL]}\'.\nDELAYING FOR {delay_time} SECONDS. Remaining queue size is {self.globals["queues"]["delayHandler"].qsize()}')
 
-                    time.sleep(delay_time)
-                    self.delayHandlerLogger.debug(f'DELAY COMPLETED AFTER {delay_time} SECONDS.\nRemaining queue size is {self.globals["queues"]["delayHandler"].qsize()}')
+                        self.threadStop.wait(delay_time)  # Woken immediately at shutdown
+                        self.delayHandlerLogger.debug(f'DELAY COMPLETED AFTER {delay_time} SECONDS.\nRemaining queue size is {self.globals["queues"]["delayHandler"].qsize()}')
+                    finally:
+                        self.globals['watchdog']['delayHandler'].commandFinished()
+                        self.globals['queues']['delayHandler'].metrics.executed(trvCommand, time.time() - executeStartTime)
 
                 except queue.Empty:
                     pass
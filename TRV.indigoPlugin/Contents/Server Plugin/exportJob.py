@@ -0,0 +1,192 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Export Job © Autolog 2022
+#
+
+try:
+    # noinspection PyUnresolvedReferences
+    import indigo
+except ImportError:
+    pass
+
+import concurrent.futures
+import queue
+import threading
+import time
+
+from constants import *
+
+
+# noinspection PyUnresolvedReferences, PyPep8Naming
+class ThreadExportJob(threading.Thread):
+
+    # Exports every started TRV Controller that has 'PostgreSQL CSV' or 'DataGraph CSV' enabled in one run, rather than an action per
+    # TRV Controller each opening its own connection and queueing behind the others on the TRV Handler. A run is requested from the menu
+    # or made every 'exportJobIntervalMinutes' (0 = menu only).
+    #
+    # A run opens one history database connection per worker (up to 'exportJobWorkers') and shares them between the TRV Controllers: a
+    # worker takes a connection for a TRV Controller's queries and CSV files, and returns it before rendering the graph, so DataGraph
+    # renders run alongside other TRV Controllers' queries. With the SQLite history database there is a single (lock serialised) database
+    # shared by the plugin, so the workers' queries run one at a time - only their DataGraph renders run in parallel. The TRV Handler's
+    # exporters do the work - the export job only schedules it. As the TRV Handler can export the same TRV Controller at the same time (a
+    # queued action), the exporters write each file to a temporary file that replaces it. At the end of a run a summary of each TRV
+    # Controller's query and render durations and the run's total duration is logged.
+    #
+    # The export listener (see exportListener.py) requests runs of just the TRV Controllers whose history has changed - their summaries are
+    # logged at debug level.
+
+    def __init__(self, pluginGlobals, event, trvHandler):
+
+        threading.Thread.__init__(self, name='TRV_ExportJob')
+
+        self.globals = pluginGlobals
+
+        self.exportJobLogger = logging.getLogger("Plugin.ExportJob")
+
+        self.threadStop = event
+        self.trvHandler = trvHandler
+
+        self.runRequested = threading.Event()
+        self.lastRunTime = time.time()  # The first scheduled run is an interval after the plugin starts
+
+        self.devicesLock = threading.Lock()
+        self.requestedDevIds = set()  # TRV Controllers to export at the next check, requested by the export listener
+
+    def requestRun(self):
+        self.runRequested.set()
+
+    def requestDevices(self, trvCtlrDevIds):
+        with self.devicesLock:
+            self.requestedDevIds.update(trvCtlrDevIds)
+
+    def run(self):
+
+        self.exportJobLogger.debug('Export Job Thread initialised')
+
+        while not self.threadStop.wait(EXPORT_JOB_CHECK_SECONDS):
+            try:
+                intervalMinutes = self.globals['config']['exportJobIntervalMinutes']
+                if self.runRequested.is_set():
+                    self.exportAll('Requested')
+                elif intervalMinutes > 0 and time.time() - self.lastRunTime >= intervalMinutes * 60:
+                    self.exportAll('Scheduled')
+                else:
+                    with self.devicesLock:
+                        trvCtlrDevIds = self.requestedDevIds
+                        self.requestedDevIds = set()
+                    if trvCtlrDevIds:
+                        self.exportAll('Notified', trvCtlrDevIds)
+            except Exception as exception_error:
+                self.exportJobLogger.error(f'Export job failed: {exception_error}')
+
+        self.exportJobLogger.debug('Export Job Thread ended.')
+
+    def exportControllers(self, trvCtlrDevIds=None):
+        # [(trvCtlrDevId, export CSV files, export DataGraph), ...] of the started TRV Controllers (of trvCtlrDevIds, if given) with something to export
+        datagraphConfigured = (self.globals['config']['datagraphCliPath'] != '' and self.globals['config']['datagraphGraphTemplatesPath'] != ''
+                               and self.globals['config']['datagraphImagesPath'] != '')
+        controllers = list()
+        for trvCtlrDevId, trvc in list(self.globals['trvc'].items()):
+            if not trvc.get('deviceStarted', False) or (trvCtlrDevIds is not None and trvCtlrDevId not in trvCtlrDevIds):
+                continue
+            exportCsv = trvc.get('updateAllCsvFilesViaPostgreSQL', False)
+            exportDatagraph = trvc.get('updateDatagraphCsvFileViaPostgreSQL', False) and datagraphConfigured
+            if exportCsv or exportDatagraph:
+                controllers.append((trvCtlrDevId, exportCsv, exportDatagraph))
+        return controllers
+
+    def exportAll(self, reason, trvCtlrDevIds=None):
+        if trvCtlrDevIds is None:
+            self.runRequested.clear()
+            self.lastRunTime = time.time()
+
+        if not self.globals['config']['csvPostgresqlEnabled']:
+            if reason == 'Requested':
+                self.exportJobLogger.error('Export of all TRV Controllers ignored as option \'Enable PostgreSQL CSV\' not enabled in the plugin config.')
+            return
+
+        controllers = self.exportControllers(trvCtlrDevIds)
+        if not controllers:
+            if trvCtlrDevIds is None:
+                self.exportJobLogger.info(f'{reason} export of all TRV Controllers: no started TRV Controllers have PostgreSQL CSV or DataGraph CSV enabled')
+            return
+
+        runStartTime = time.perf_counter()
+        workers = min(self.globals['config']['exportJobWorkers'], len(controllers))
+
+        databases = queue.Queue()
+        openedDatabases = list()
+        for worker in range(workers):
+            database = self.trvHandler.openHistoryDatabase()
+            if database is None:
+                break  # Already logged by openHistoryDatabase
+            if database in openedDatabases:
+                break  # The shared SQLite history database - one is all there is
+            openedDatabases.append(database)
+            databases.put(database)
+        if not openedDatabases:
+            self.exportJobLogger.error(f'{reason} export of all TRV Controllers abandoned as the history database could not be opened')
+            return
+
+        results = list()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='TRV_Export') as executor:
+                futures = [executor.submit(self.exportController, trvCtlrDevId, exportCsv, exportDatagraph, databases) for trvCtlrDevId, exportCsv, exportDatagraph in controllers]
+                for future in futures:
+                    result = future.result()
+                    if result is not None:
+                        results.append(result)
+        finally:
+            for database in openedDatabases:
+                if database is not self.globals['historyDatabase']:
+                    database.close()
+
+        self.logSummary(reason, results, workers, time.perf_counter() - runStartTime, trvCtlrDevIds is None)
+
+    def exportController(self, trvCtlrDevId, exportCsv, exportDatagraph, databases):
+        # Runs in a worker: the TRV Controller's CSV files and DataGraph CSV file from a shared connection, then its graph
+        if self.threadStop.is_set():
+            return None  # Plugin shutting down
+
+        deviceStartTime = time.perf_counter()
+        csvFilesWritten = 0
+        datagraphCsvFilename = None
+        database = databases.get()
+        try:
+            if exportCsv:
+                csvFilesWritten = self.trvHandler.updateAllCsvFilesViaPostgreSQL(trvCtlrDevId, 0, '', database=database)
+            if exportDatagraph:
+                datagraphCsvFilename = self.trvHandler.updateDatagraphCsvFileViaPostgreSQL(trvCtlrDevId, 0, '', database=database, render=False)
+        finally:
+            databases.put(database)
+        queryEndTime = time.perf_counter()
+
+        graphUi = 'Not enabled'
+        if exportDatagraph:
+            if datagraphCsvFilename is None:
+                graphUi = 'CSV Failed'
+            elif self.trvHandler.renderDatagraph(trvCtlrDevId, datagraphCsvFilename):
+                graphUi = 'OK'
+            else:
+                graphUi = 'Render Failed'
+        renderEndTime = time.perf_counter()
+
+        return {'name': indigo.devices[trvCtlrDevId].name if trvCtlrDevId in indigo.devices else str(trvCtlrDevId),
+                'csvFiles': csvFilesWritten,
+                'graph': graphUi,
+                'querySeconds': queryEndTime - deviceStartTime,
+                'renderSeconds': renderEndTime - queryEndTime,
+                'seconds': renderEndTime - deviceStartTime}
+
+    def logSummary(self, reason, results, workers, runSeconds, allTrvControllers):
+        deviceSeconds = sum([result['seconds'] for result in results])
+        summary = f'{reason} export of {"all " if allTrvControllers else ""}TRV Controllers: {len(results)} TRV Controllers in {runSeconds:.2f} s with {workers} worker(s)'
+        summary += f' [{deviceSeconds:.2f} s if run one after another]'
+        for result in sorted(results, key=lambda result: result['name']):
+            summary += (f'\n    {result["name"]}: {result["seconds"]:.2f} s [query {result["querySeconds"]:.2f} s, render {result["renderSeconds"]:.2f} s],'
+                        f' CSV files: {result["csvFiles"]}, DataGraph: {result["graph"]}')
+        if allTrvControllers:
+            self.exportJobLogger.info(summary)
+        else:
+            self.exportJobLogger.debug(summary)
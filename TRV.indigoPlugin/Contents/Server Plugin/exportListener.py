@@ -0,0 +1,158 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Export Listener © Autolog 2022
+#
+
+try:
+    # noinspection PyUnresolvedReferences
+    import indigo
+except ImportError:
+    pass
+
+import threading
+import time
+
+from postgresql.notifyman import NotificationManager
+
+from constants import *
+from historyQuery import PostgresqlHistory
+
+EXPORT_NOTIFY_CHANNEL = 'trv_controller_history'
+EXPORT_NOTIFY_TRIGGER = 'trv_controller_history_notify'  # Name of both the trigger on each table and the trigger function
+
+EXPORT_NOTIFY_FUNCTION_SQL = (f"CREATE OR REPLACE FUNCTION {EXPORT_NOTIFY_TRIGGER}() RETURNS trigger LANGUAGE plpgsql AS $$"
+                              f" BEGIN PERFORM pg_notify('{EXPORT_NOTIFY_CHANNEL}', TG_ARGV[0]); RETURN NULL; END $$")
+
+
+# noinspection PyUnresolvedReferences, PyPep8Naming
+class ThreadExportListener(threading.Thread):
+
+    # Exports a TRV Controller's PostgreSQL CSV / DataGraph files when SQL Logger writes new history for it, rather than on request or
+    # schedule. While 'exportOnNotifyEnabled' is set (and the history database is the SQL Logger's), a statement trigger on the
+    # 'device_history_{id}' table of each started TRV Controller with exports enabled sends a NOTIFY on EXPORT_NOTIFY_CHANNEL with the
+    # device id. This thread LISTENs on its own connection, waiting in select() through a NotificationManager so nothing is polled.
+    #
+    # Exports are debounced per TRV Controller: 'exportNotifyDebounceSeconds' after the first notification since its last export, the TRV
+    # Controller is handed to the export job, which exports it with its workers. Triggers are matched to the started TRV Controllers every
+    # EXPORT_NOTIFY_SYNC_SECONDS (SQL Logger creates a table when it first logs a device) and dropped when the listener stops.
+
+    def __init__(self, pluginGlobals, event, trvHandler, exportJob):
+
+        threading.Thread.__init__(self, name='TRV_ExportListener')
+
+        self.globals = pluginGlobals
+
+        self.exportListenerLogger = logging.getLogger("Plugin.ExportListener")
+
+        self.threadStop = event
+        self.trvHandler = trvHandler
+        self.exportJob = exportJob
+
+        self.triggerDevIds = set()  # TRV Controllers whose table has the trigger installed by this thread
+        self.failedDevIds = set()  # TRV Controllers whose trigger couldn't be installed - reported once
+        self.notifications = 0
+        self.exportsRequested = 0
+
+    def run(self):
+
+        self.exportListenerLogger.debug('Export Listener Thread initialised')
+
+        while not self.threadStop.is_set():
+            if not self.listenEnabled():
+                self.threadStop.wait(EXPORT_JOB_CHECK_SECONDS)
+                continue
+            try:
+                self.listen()
+            except Exception as exception_error:
+                self.exportListenerLogger.warning(f'Export listener connection failed, retrying in {EXPORT_NOTIFY_RETRY_SECONDS} seconds: {exception_error}')
+                self.threadStop.wait(EXPORT_NOTIFY_RETRY_SECONDS)
+
+        self.exportListenerLogger.debug('Export Listener Thread ended.')
+
+    def listenEnabled(self):
+        return (self.globals['config']['exportOnNotifyEnabled'] and self.globals['config']['csvPostgresqlEnabled']
+                and self.globals['config']['csvDatabase'] == 'postgresql')
+
+    def listen(self):
+        database = self.trvHandler.openHistoryDatabase()
+        if not isinstance(database, PostgresqlHistory):
+            self.threadStop.wait(EXPORT_NOTIFY_RETRY_SECONDS)  # Already logged by openHistoryDatabase
+            return
+        connection = database.connection
+
+        try:
+            connection.execute(EXPORT_NOTIFY_FUNCTION_SQL)
+            connection.listen(EXPORT_NOTIFY_CHANNEL)
+            self.exportListenerLogger.info(f'Export listener listening for new TRV Controller history on channel \'{EXPORT_NOTIFY_CHANNEL}\'')
+
+            pendingDevIds = dict()  # trvCtlrDevId -> time of the first notification since its last export
+            lastSyncTime = 0.0
+            manager = NotificationManager(connection, timeout=EXPORT_NOTIFY_IDLE_SECONDS)
+            for notification in manager:
+                if self.threadStop.is_set() or not self.listenEnabled():
+                    break
+                if manager.garbage:
+                    raise ConnectionError('listening connection closed')
+
+                now = time.time()
+                if notification is not None:  # None is an idle event
+                    for channel, payload, pid in notification[1]:
+                        self.notifications += 1
+                        try:
+                            trvCtlrDevId = int(payload)
+                        except ValueError:
+                            continue
+                        if trvCtlrDevId in self.triggerDevIds and trvCtlrDevId not in pendingDevIds:
+                            pendingDevIds[trvCtlrDevId] = now
+
+                if now - lastSyncTime >= EXPORT_NOTIFY_SYNC_SECONDS:
+                    lastSyncTime = now
+                    self.syncTriggers(connection)
+
+                debounceSeconds = self.globals['config']['exportNotifyDebounceSeconds']
+                dueDevIds = [trvCtlrDevId for trvCtlrDevId, notifiedTime in pendingDevIds.items() if now - notifiedTime >= debounceSeconds]
+                if dueDevIds:
+                    for trvCtlrDevId in dueDevIds:
+                        del pendingDevIds[trvCtlrDevId]
+                    self.exportsRequested += len(dueDevIds)
+                    self.exportJob.requestDevices(dueDevIds)
+
+        finally:
+            try:
+                if not connection.closed:
+                    self.dropTriggers(connection, set(self.triggerDevIds))
+            finally:
+                self.triggerDevIds = set()
+                database.close()
+                self.exportListenerLogger.info('Export listener stopped listening for new TRV Controller history')
+
+    def syncTriggers(self, connection):
+        # Install the trigger on the tables of TRV Controllers that are started with exports enabled, and drop it from any others
+        wantedDevIds = set([trvCtlrDevId for trvCtlrDevId, exportCsv, exportDatagraph in self.exportJob.exportControllers()])
+        self.dropTriggers(connection, self.triggerDevIds - wantedDevIds)
+
+        tableExists = connection.prepare('SELECT to_regclass($1) IS NOT NULL')
+        for trvCtlrDevId in wantedDevIds - self.triggerDevIds:
+            table = f'device_history_{trvCtlrDevId}'
+            if not tableExists.first(table):
+                continue  # Not yet logged by SQL Logger
+            try:
+                with connection.xact():
+                    connection.execute(f'DROP TRIGGER IF EXISTS {EXPORT_NOTIFY_TRIGGER} ON {table}')
+                    connection.execute(f"CREATE TRIGGER {EXPORT_NOTIFY_TRIGGER} AFTER INSERT ON {table} FOR EACH STATEMENT EXECUTE PROCEDURE {EXPORT_NOTIFY_TRIGGER}('{trvCtlrDevId}')")
+                self.triggerDevIds.add(trvCtlrDevId)
+                self.failedDevIds.discard(trvCtlrDevId)
+            except Exception as exception_error:
+                if trvCtlrDevId not in self.failedDevIds:
+                    self.failedDevIds.add(trvCtlrDevId)
+                    self.exportListenerLogger.error(f'Export listener unable to install trigger on \'{table}\' for \'{indigo.devices[trvCtlrDevId].name}\''
+                                                    f' - check the PostgreSQL user owns the table: {exception_error}')
+
+    def dropTriggers(self, connection, trvCtlrDevIds):
+        for trvCtlrDevId in trvCtlrDevIds:
+            connection.execute(f'DROP TRIGGER IF EXISTS {EXPORT_NOTIFY_TRIGGER} ON device_history_{trvCtlrDevId}')
+            self.triggerDevIds.discard(trvCtlrDevId)
+
+    def statistics(self):
+        return {'listening': len(self.triggerDevIds), 'notifications': self.notifications, 'exportsRequested': self.exportsRequested}
@@ -0,0 +1,178 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Handler Queue © Autolog 2022
+#
+
+import collections
+import heapq
+import itertools
+import queue
+import time
+
+from queueMetrics import InstrumentedQueueMixin
+
+# Heap entry layout
+HEAP_PRIORITY = 0
+HEAP_SEQUENCE = 1
+HEAP_INSERTION = 2
+HEAP_ENQUEUE_TIME = 3
+HEAP_ITEM = 4
+
+
+# noinspection PyPep8Naming
+class LanedQueue(queue.Queue):
+
+    # Priority queue split into lanes by priority band. Within a lane entries are run in [priority, sequence] order, first in first out for
+    # equal values. Lanes are normally served highest first, but the head of a lower lane that has waited longer than the aging time is
+    # run ahead of higher lanes (other than the first lane, which is never overtaken) so that low priority work can't starve.
+    #
+    # Lanes can be given a capacity. When full, a sheddable entry (the oldest) is dropped to make room - non-sheddable entries are always
+    # accepted, so a lane is only bounded if (as with the Low lane) every command queued to it is sheddable. Each lane keeps its sheddable
+    # entries in insertion order, so the oldest is found without scanning the lane; a shed entry is left in the heap and skipped when it
+    # reaches the head. With coalescing, a sheddable entry arriving at a full lane is first matched against those queued: an identical entry
+    # (same command, device and package) already queued makes the new one redundant, so it is dropped rather than shedding another entry.
+    # Commands whose every entry carries data of its own (e.g. a CSV row) must not be made sheddable.
+    #
+    # Entries are lists: [priority, sequence, command, device id, package]. put() never blocks.
+
+    def __init__(self, lanes, sheddableCommands=()):
+        self.lanes = lanes  # ((laneName, lowestPriority), ...) in priority order
+        self.sheddableCommands = set(sheddableCommands)
+        self.laneCapacities = dict()
+        self.agingSeconds = 0.0
+        self.coalesce = False
+        queue.Queue.__init__(self)
+
+    def configure(self, laneCapacities=None, agingSeconds=0.0, coalesce=False):
+        # Can be called at any time e.g. when the plugin config is changed
+        with self.mutex:
+            self.laneCapacities = dict(laneCapacities) if laneCapacities is not None else dict()
+            self.agingSeconds = float(agingSeconds)
+            self.coalesce = bool(coalesce)
+
+    def laneStatistics(self):
+        with self.mutex:
+            return [{'lane': laneName,
+                     'depth': self.laneDepths[laneIndex],
+                     'capacity': self.laneCapacities.get(laneName, 0),
+                     'promoted': self.lanePromotions[laneIndex],
+                     'shed': self.laneSheds[laneIndex],
+                     'coalesced': self.laneCoalesces[laneIndex]} for laneIndex, (laneName, lowestPriority) in enumerate(self.lanes)]
+
+    def laneIndex(self, priority):
+        for laneIndex in range(len(self.lanes) - 1, 0, -1):
+            if priority >= self.lanes[laneIndex][1]:
+                return laneIndex
+        return 0
+
+    @staticmethod
+    def coalesceKey(item):
+        package = item[4]
+        return item[2], item[3], tuple(package) if isinstance(package, list) else package
+
+    def discardEntry(self, item, reason):
+        pass  # Overridden by the metrics mixin
+
+    # Following methods are called by queue.Queue with self.mutex held
+
+    def _init(self, maxsize):
+        self.laneHeaps = [list() for _ in self.lanes]
+        self.laneDepths = [0] * len(self.lanes)  # Queued entries per lane - a lane heap also holds shed entries until they reach its head
+        self.laneSheddable = [collections.OrderedDict() for _ in self.lanes]  # insertion -> heap entry, for sheddable commands, oldest first
+        self.lanePromotions = [0] * len(self.lanes)
+        self.laneSheds = [0] * len(self.lanes)
+        self.laneCoalesces = [0] * len(self.lanes)
+        self.queuedSheddable = dict()  # coalesceKey -> queued item, for sheddable commands
+        self.insertionCounter = itertools.count()
+
+    def _qsize(self):
+        return sum(self.laneDepths)
+
+    def _put(self, item):
+        laneIndex = self.laneIndex(item[0])
+        sheddable = item[2] in self.sheddableCommands
+
+        capacity = self.laneCapacities.get(self.lanes[laneIndex][0], 0)
+        if 0 < capacity <= self.laneDepths[laneIndex]:
+            if sheddable and self.coalesce and self.coalesceKey(item) in self.queuedSheddable:
+                self.laneCoalesces[laneIndex] += 1  # The same work is already queued
+                self.discardEntry(item, 'coalesced')
+                self.taskDiscarded()  # Offsets the count put() adds for this entry once _put returns
+                return
+
+            if self.laneSheddable[laneIndex]:
+                _, shedEntry = self.laneSheddable[laneIndex].popitem(last=False)
+                shedItem = shedEntry[HEAP_ITEM]
+                shedEntry[HEAP_ITEM] = None  # Left in the heap, and skipped, until it reaches the head
+                self.laneDepths[laneIndex] -= 1
+                self.forgetSheddable(shedItem)
+                self.laneSheds[laneIndex] += 1
+                self.discardEntry(shedItem, 'shed')
+                self.taskDiscarded()
+                self.compactLane(laneIndex)
+
+        heapEntry = [item[0], item[1], next(self.insertionCounter), time.time(), item]
+        heapq.heappush(self.laneHeaps[laneIndex], heapEntry)
+        self.laneDepths[laneIndex] += 1
+        if sheddable:
+            self.queuedSheddable[self.coalesceKey(item)] = item
+            self.laneSheddable[laneIndex][heapEntry[HEAP_INSERTION]] = heapEntry
+
+    def _get(self):
+        laneIndex = next(index for index, laneDepth in enumerate(self.laneDepths) if laneDepth > 0)  # _get is only called when the queue isn't empty
+        if self.agingSeconds > 0.0 and laneIndex > 0:
+            now = time.time()
+            oldestEnqueueTime = now - self.agingSeconds
+            agedLaneIndex = None
+            for lowerLaneIndex in range(laneIndex + 1, len(self.laneHeaps)):
+                headEntry = self.laneHead(lowerLaneIndex)
+                if headEntry is not None and headEntry[HEAP_ENQUEUE_TIME] <= oldestEnqueueTime:
+                    oldestEnqueueTime = headEntry[HEAP_ENQUEUE_TIME]
+                    agedLaneIndex = lowerLaneIndex
+            if agedLaneIndex is not None:
+                self.lanePromotions[agedLaneIndex] += 1
+                laneIndex = agedLaneIndex
+
+        self.laneHead(laneIndex)
+        heapEntry = heapq.heappop(self.laneHeaps[laneIndex])
+        self.laneDepths[laneIndex] -= 1
+        item = heapEntry[HEAP_ITEM]
+        if item[2] in self.sheddableCommands:
+            self.laneSheddable[laneIndex].pop(heapEntry[HEAP_INSERTION], None)
+            self.forgetSheddable(item)
+        return item
+
+    def laneHead(self, laneIndex):
+        # The lane's first queued heap entry (None if the lane is empty), first discarding any shed entries ahead of it
+        laneHeap = self.laneHeaps[laneIndex]
+        while laneHeap and laneHeap[0][HEAP_ITEM] is None:
+            heapq.heappop(laneHeap)
+        return laneHeap[0] if laneHeap else None
+
+    def compactLane(self, laneIndex):
+        # Rebuild a lane heap once shed entries outnumber those queued, so that shedding stays cheap and the heap can't grow without limit
+        laneHeap = self.laneHeaps[laneIndex]
+        if len(laneHeap) > 2 * self.laneDepths[laneIndex]:
+            laneHeap[:] = [heapEntry for heapEntry in laneHeap if heapEntry[HEAP_ITEM] is not None]
+            heapq.heapify(laneHeap)
+
+    def taskDiscarded(self):
+        # An entry dropped without being got is done - as task_done(), so that unfinished_tasks doesn't grow and join() can return
+        unfinishedTasks = self.unfinished_tasks - 1
+        if unfinishedTasks <= 0:
+            self.all_tasks_done.notify_all()
+        self.unfinished_tasks = unfinishedTasks
+
+    def forgetSheddable(self, item):
+        key = self.coalesceKey(item)
+        if self.queuedSheddable.get(key, None) is item:
+            del self.queuedSheddable[key]
+
+
+# noinspection PyPep8Naming
+class InstrumentedLanedQueue(InstrumentedQueueMixin, LanedQueue):
+
+    def __init__(self, queueName, commandIndex, lanes, sheddableCommands=(), priorityIndex=0):
+        LanedQueue.__init__(self, lanes, sheddableCommands)
+        self.initialiseMetrics(queueName, commandIndex, priorityIndex)
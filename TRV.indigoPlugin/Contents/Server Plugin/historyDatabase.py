@@ -0,0 +1,167 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# History Database © Autolog 2022
+#
+
+import datetime
+import os
+import sqlite3
+import threading
+import time
+
+from historyQuery import databaseStateRows
+
+HISTORY_DATABASE_FILE_NAME = 'history.sqlite'
+HISTORY_DATABASE_BATCH_ROWS = 200  # Pending rows that trigger an insert
+HISTORY_DATABASE_FLUSH_SECONDS = 5.0  # Longest time a row is held before being inserted
+HISTORY_DATABASE_FETCH_ROWS = 1000  # Rows read per query when streaming a state's rows
+HISTORY_DATABASE_RETENTION_DAYS = 400
+HISTORY_DATABASE_PURGE_SECONDS = 3600.0  # How often rows older than the retention period are deleted
+
+HISTORY_DATABASE_SCHEMA = ('CREATE TABLE IF NOT EXISTS history (device INTEGER NOT NULL, state TEXT NOT NULL, ts REAL NOT NULL, value REAL NOT NULL)',
+                           'CREATE INDEX IF NOT EXISTS history_device_state_ts ON history (device, state, ts)')
+
+
+# noinspection PyPep8Naming
+def localTimestamp(localSeconds):
+    # The timestamp of a local time given as seconds since 1970-01-01 00:00 local time (the form SQLite's 'localtime' modifier produces)
+    return (datetime.datetime(1970, 1, 1) + datetime.timedelta(seconds=localSeconds)).timestamp()
+
+
+# noinspection PyPep8Naming
+class SqliteHistory:
+
+    # TRV Controller state history written by the plugin to a SQLite database - the alternative to reading the SQL Logger's PostgreSQL
+    # 'device_history_{id}' tables. Rows are (device, state, ts, value) with an index on (device, state, ts), so the rows of a state in a time
+    # range are an index range scan. The database is in WAL mode so queries from an export don't block inserts.
+    #
+    # Rows are buffered and inserted in one transaction when HISTORY_DATABASE_BATCH_ROWS are pending, HISTORY_DATABASE_FLUSH_SECONDS have
+    # passed, before a query and on close. A single connection is shared by the plugin's threads, serialised by self.lock.
+
+    def __init__(self, databasePath, stateNames):
+        self.lock = threading.Lock()
+        self.databasePath = databasePath
+        self.stateNames = frozenset(stateNames)
+        self.enabled = False
+        self.connection = None
+        self.pendingRows = list()
+        self.lastFlushTime = time.time()
+        self.lastPurgeTime = 0.0
+        self.rowsInserted = 0
+        self.batches = 0
+
+    def recordStates(self, trvCtlrDevId, keyValueList, timestamp=None):
+        # Buffer the values of the recorded states in an Indigo key / value list e.g. as written by updateStatesOnServer
+        if not self.enabled:
+            return
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock:
+            for keyValue in keyValueList:
+                if keyValue['key'] in self.stateNames:
+                    try:
+                        self.pendingRows.append((trvCtlrDevId, keyValue['key'], timestamp, float(keyValue['value'])))
+                    except (TypeError, ValueError):
+                        pass  # Not a number e.g. a state not yet set
+            if len(self.pendingRows) >= HISTORY_DATABASE_BATCH_ROWS or timestamp - self.lastFlushTime >= HISTORY_DATABASE_FLUSH_SECONDS:
+                self.flushRows()
+
+    def flush(self):
+        with self.lock:
+            self.flushRows()
+
+    def rows(self, trvCtlrDevId, stateName, startTime, endTime=None):
+        # Yields (timestamp, value) of a state from startTime up to endTime (seconds since the epoch), oldest first. Rows are read
+        # HISTORY_DATABASE_FETCH_ROWS at a time, each read continuing after the (ts, rowid) of the last, so the lock is only held while reading.
+        endTime = time.time() if endTime is None else endTime
+        lastTimestamp, lastRowId = startTime, -1
+        while True:
+            with self.lock:
+                self.flushRows()
+                cursor = self.open().execute('SELECT ts, value, rowid FROM history WHERE device = ? AND state = ? AND (ts > ? OR (ts = ? AND rowid > ?)) AND ts <= ?'
+                                             ' ORDER BY ts, rowid LIMIT ?', (trvCtlrDevId, stateName, lastTimestamp, lastTimestamp, lastRowId, endTime, HISTORY_DATABASE_FETCH_ROWS))
+                fetchedRows = cursor.fetchall()
+            for timestamp, value, rowId in fetchedRows:
+                yield timestamp, value
+            if len(fetchedRows) < HISTORY_DATABASE_FETCH_ROWS:
+                return
+            lastTimestamp, lastRowId = fetchedRows[-1][0], fetchedRows[-1][2]
+
+    def previousRow(self, trvCtlrDevId, stateName, startTime):
+        # [(timestamp, value)] of the latest row of a state before startTime, or [] if there isn't one
+        with self.lock:
+            self.flushRows()
+            cursor = self.open().execute('SELECT ts, value FROM history WHERE device = ? AND state = ? AND ts < ? ORDER BY ts DESC LIMIT 1',
+                                         (trvCtlrDevId, stateName, startTime))
+            return cursor.fetchall()
+
+    def rowCount(self, trvCtlrDevId, stateName, startTime, endTime):
+        # The number of rows of a state from startTime up to endTime - an index range count
+        with self.lock:
+            self.flushRows()
+            cursor = self.open().execute('SELECT count(*) FROM history WHERE device = ? AND state = ? AND ts >= ? AND ts <= ?', (trvCtlrDevId, stateName, startTime, endTime))
+            return cursor.fetchone()[0]
+
+    def buckets(self, trvCtlrDevId, stateName, startTime, endTime, bucketSeconds):
+        # [(bucket start, (minimum, maximum, mean, last)), ...] of a state from startTime up to endTime, oldest first. Buckets are whole
+        # multiples of bucketSeconds in local time, as PostgresqlHistory.buckets are: each row's ts is moved by its local UTC offset (so a
+        # change to / from daylight saving time is followed) before being bucketed, and the local bucket start is converted back to a timestamp.
+        with self.lock:
+            self.flushRows()
+            cursor = self.open().execute('SELECT bucket, min(value), max(value), avg(value), last FROM ('
+                                         ' SELECT CAST(localTs / :seconds AS INTEGER) * :seconds AS bucket, value,'
+                                         ' last_value(value) OVER (PARTITION BY CAST(localTs / :seconds AS INTEGER) ORDER BY ts ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) AS last'
+                                         ' FROM (SELECT ts, value, ts + CAST(strftime(\'%s\', ts, \'unixepoch\', \'localtime\') AS INTEGER) - CAST(ts AS INTEGER) AS localTs'
+                                         ' FROM history WHERE device = :device AND state = :state AND ts >= :start AND ts <= :end))'
+                                         ' GROUP BY bucket ORDER BY bucket',
+                                         {'seconds': int(bucketSeconds), 'device': trvCtlrDevId, 'state': stateName, 'start': startTime, 'end': endTime})
+            return [(localTimestamp(bucket), (minimum, maximum, mean, last)) for bucket, minimum, maximum, mean, last in cursor]
+
+    def stateRows(self, trvCtlrDevId, stateName, startTime, endTime):
+        return databaseStateRows(self, trvCtlrDevId, stateName, startTime, endTime)
+
+    def delete(self, trvCtlrDevId):
+        with self.lock:
+            self.pendingRows = [row for row in self.pendingRows if row[0] != trvCtlrDevId]
+            if self.connection is not None or os.path.exists(self.databasePath):
+                with self.open():
+                    self.connection.execute('DELETE FROM history WHERE device = ?', (trvCtlrDevId, ))
+
+    def close(self):
+        with self.lock:
+            self.flushRows()
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def statistics(self):
+        with self.lock:
+            return {'pending': len(self.pendingRows), 'inserted': self.rowsInserted, 'batches': self.batches,
+                    'bytes': os.path.getsize(self.databasePath) if os.path.exists(self.databasePath) else 0}
+
+    # Following methods are called with self.lock held
+
+    def open(self):
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.databasePath), exist_ok=True)
+            self.connection = sqlite3.connect(self.databasePath, check_same_thread=False)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')  # Safe in WAL mode: a power cut can lose the latest batch but not corrupt the database
+            with self.connection:
+                for statement in HISTORY_DATABASE_SCHEMA:
+                    self.connection.execute(statement)
+        return self.connection
+
+    def flushRows(self):
+        self.lastFlushTime = time.time()
+        if not self.pendingRows:
+            return
+        pendingRows = self.pendingRows
+        self.pendingRows = list()
+        with self.open():
+            self.connection.executemany('INSERT INTO history (device, state, ts, value) VALUES (?, ?, ?, ?)', pendingRows)
+            if self.lastFlushTime - self.lastPurgeTime >= HISTORY_DATABASE_PURGE_SECONDS:
+                self.lastPurgeTime = self.lastFlushTime
+                self.connection.execute('DELETE FROM history WHERE ts < ?', (self.lastFlushTime - HISTORY_DATABASE_RETENTION_DAYS * 86400.0, ))
+        self.rowsInserted += len(pendingRows)
+        self.batches += 1
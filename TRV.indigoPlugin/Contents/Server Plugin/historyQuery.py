@@ -0,0 +1,217 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# History Query © Autolog 2022
+#
+
+import datetime
+import heapq
+
+from postgresql import copyman
+
+HISTORY_FILL_PREVIOUS = 'previous'  # A state without a change at a row's time has the value in force at that time
+HISTORY_FILL_NONE = None  # ... or None
+
+HISTORY_BUCKET_SECONDS = (60, 120, 300, 600, 900, 1800, 3600, 7200, 10800, 21600, 43200, 86400)  # Bucket sizes for bucketed history, smallest first
+
+# Bucket values
+BUCKET_MINIMUM = 0
+BUCKET_MAXIMUM = 1
+BUCKET_MEAN = 2
+BUCKET_LAST = 3
+
+HISTORY_COPY_BUFFER_BYTES = 1024 * 1024  # Output file buffer for CSV files written by COPY
+HISTORY_COPY_TIMESTAMP_FORMAT = 'YYYY-MM-DD HH24:MI:SS.US'  # PostgreSQL to_char format giving the Standard CSV timestamp e.g. 2022-04-09 17:26:13.956000
+
+
+# noinspection PyPep8Naming
+def history(backend, trvCtlrDevId, stateNames, startTime, endTime, step=None, fill=HISTORY_FILL_PREVIOUS):
+    # Yields (timestamp, [value of each of stateNames]) rows of a TRV Controller's state history from startTime to endTime (seconds since
+    # the epoch), oldest first. The backend is any object with a stateRows method (see below) e.g. the TimeSeriesStore, SqliteHistory or a
+    # PostgresqlHistory.
+    #
+    #   - step None: a row at startTime with the values in force then, a row at each time any of the states changed and a row at endTime
+    #   - step seconds: a row at startTime, every step seconds after and at endTime, each with the values in force at that time
+    #
+    # States are step functions: a value holds until the next change. With fill None, a state is None in a row unless it changed at that
+    # time (step None) or since the previous row (step seconds) - the first and last rows are always filled. A state with no value yet is
+    # None. The states' rows are merged in one pass so only the latest value of each state is held, however long the period.
+
+    if fill not in (HISTORY_FILL_PREVIOUS, HISTORY_FILL_NONE):
+        raise ValueError(f'History fill must be \'{HISTORY_FILL_PREVIOUS}\' or None, not \'{fill}\'')
+    if step is not None and step <= 0:
+        raise ValueError(f'History step must be greater than zero, not \'{step}\'')
+
+    changes = heapq.merge(*[taggedRows(backend.stateRows(trvCtlrDevId, stateName, startTime, endTime), index) for index, stateName in enumerate(stateNames)])
+    if step is None:
+        return changeRows(changes, len(stateNames), startTime, endTime, fill)
+    return steppedRows(changes, len(stateNames), startTime, endTime, step, fill)
+
+
+# noinspection PyPep8Naming
+def taggedRows(stateRows, index):
+    for timestamp, value in stateRows:
+        yield timestamp, index, value
+
+
+# noinspection PyPep8Naming
+def changeRows(changes, stateCount, startTime, endTime, fill):
+    values = [None] * stateCount
+    rowTime = None
+    rowValues = None
+    for timestamp, index, value in changes:
+        if timestamp > endTime:
+            break
+        if timestamp <= startTime:
+            values[index] = value  # In force at startTime
+            continue
+        if rowTime is None:
+            yield startTime, list(values)
+        elif timestamp != rowTime:
+            yield rowTime, rowValues
+            rowValues = None
+        rowTime = timestamp
+        values[index] = value
+        if rowValues is None:
+            rowValues = list(values) if fill == HISTORY_FILL_PREVIOUS else [None] * stateCount
+        rowValues[index] = value
+
+    if rowTime is None:
+        yield startTime, list(values)
+    else:
+        yield rowTime, rowValues
+    if rowTime != endTime:
+        yield endTime, list(values)
+
+
+# noinspection PyPep8Naming
+def steppedRows(changes, stateCount, startTime, endTime, step, fill):
+    values = [None] * stateCount
+    changed = [False] * stateCount
+    rowTime = startTime
+    for timestamp, index, value in changes:
+        if timestamp > endTime:
+            break
+        while timestamp > rowTime:
+            yield rowTime, stepValues(values, changed, fill, rowTime == startTime)
+            rowTime += step
+        values[index] = value
+        changed[index] = True
+
+    while rowTime < endTime:
+        yield rowTime, stepValues(values, changed, fill, rowTime == startTime)
+        rowTime += step
+    yield endTime, list(values)
+
+
+# noinspection PyPep8Naming
+def stepValues(values, changed, fill, firstRow):
+    if fill == HISTORY_FILL_PREVIOUS or firstRow:
+        rowValues = list(values)
+    else:
+        rowValues = [value if stateChanged else None for value, stateChanged in zip(values, changed)]
+    for index in range(len(changed)):
+        changed[index] = False
+    return rowValues
+
+
+# noinspection PyPep8Naming
+def historyBucketSeconds(periodSeconds, pointBudget):
+    # The smallest bucket size that covers the period in no more than pointBudget buckets - whole days beyond the largest bucket size
+    for bucketSeconds in HISTORY_BUCKET_SECONDS:
+        if periodSeconds / bucketSeconds <= pointBudget:
+            return bucketSeconds
+    return HISTORY_BUCKET_SECONDS[-1] * -(-periodSeconds // (HISTORY_BUCKET_SECONDS[-1] * pointBudget))
+
+
+# noinspection PyPep8Naming
+class BucketedHistory:
+
+    # A backend for history() whose rows are buckets: (bucket start, (minimum, maximum, mean, last)) of the samples in each bucketSeconds
+    # bucket, reduced by the database. The value in force at the start of the period is the bucket (value, value, value, value).
+
+    def __init__(self, database, bucketSeconds):
+        self.database = database
+        self.bucketSeconds = bucketSeconds
+
+    def stateRows(self, trvCtlrDevId, stateName, startTime, endTime):
+        previousRows = [(timestamp, (value, value, value, value)) for timestamp, value in self.database.previousRow(trvCtlrDevId, stateName, startTime)]
+        return previousRows + self.database.buckets(trvCtlrDevId, stateName, startTime, endTime, self.bucketSeconds)
+
+
+# noinspection PyPep8Naming
+def databaseStateRows(database, trvCtlrDevId, stateName, startTime, endTime):
+    # stateRows for a database with rows / previousRow methods: yields the latest row before startTime then every row from startTime, as
+    # the database streams them. No row is dropped - fewer points are asked for with history()'s step or a BucketedHistory.
+
+    yield from database.previousRow(trvCtlrDevId, stateName, startTime)
+    yield from database.rows(trvCtlrDevId, stateName, startTime, endTime)
+
+
+# noinspection PyPep8Naming
+class PostgresqlHistory:
+
+    # History from the SQL Logger's 'device_history_{id}' tables, which have a column per state, through an open 'postgresql' connection.
+    # SQL Logger timestamps are local times, as are the datetimes passed as query parameters.
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def rows(self, trvCtlrDevId, stateName, startTime, endTime):
+        # Yields (timestamp, value) of a state from startTime up to endTime, oldest first, read through a cursor rather than fetched as a whole
+        ps = self.connection.prepare(f"SELECT ts, {stateName} FROM device_history_{trvCtlrDevId} WHERE ( ts >= $1 AND ts <= $2 AND {stateName} IS NOT NULL) ORDER BY ts")  # noqa [suppress no data sources help message]
+        for row in ps.rows(datetime.datetime.fromtimestamp(startTime), datetime.datetime.fromtimestamp(endTime)):
+            yield row[0].timestamp(), row[1]
+
+    def previousRow(self, trvCtlrDevId, stateName, startTime):
+        # [(timestamp, value)] of the latest row of a state before startTime, or [] if there isn't one
+        ps = self.connection.prepare(f"SELECT ts, {stateName} FROM device_history_{trvCtlrDevId} WHERE ( ts < $1 AND {stateName} IS NOT NULL) ORDER BY ts DESC LIMIT 1")  # noqa [suppress no data sources help message]
+        return [(row[0].timestamp(), row[1]) for row in ps(datetime.datetime.fromtimestamp(startTime))]
+
+    def stateRows(self, trvCtlrDevId, stateName, startTime, endTime):
+        return databaseStateRows(self, trvCtlrDevId, stateName, startTime, endTime)
+
+    def rowCount(self, trvCtlrDevId, stateName, startTime, endTime):
+        # The number of rows of a state from startTime up to endTime, counted by the server
+        ps = self.connection.prepare(f"SELECT count(*) FROM device_history_{trvCtlrDevId} WHERE ( ts >= $1 AND ts <= $2 AND {stateName} IS NOT NULL)")  # noqa [suppress no data sources help message]
+        return ps.first(datetime.datetime.fromtimestamp(startTime), datetime.datetime.fromtimestamp(endTime))
+
+    def buckets(self, trvCtlrDevId, stateName, startTime, endTime, bucketSeconds):
+        # [(bucket start, (minimum, maximum, mean, last)), ...] of a state from startTime up to endTime, oldest first. Buckets are whole
+        # multiples of bucketSeconds in local time, as SQL Logger timestamps are.
+        ps = self.connection.prepare(
+            f"SELECT to_timestamp(floor(extract(epoch FROM ts)::double precision / $3::integer) * $3::integer) AT TIME ZONE 'UTC' AS bucket,"
+            f" min({stateName}), max({stateName}), avg({stateName}), (array_agg({stateName} ORDER BY ts DESC))[1]"
+            f" FROM device_history_{trvCtlrDevId} WHERE ( ts >= $1 AND ts <= $2 AND {stateName} IS NOT NULL) GROUP BY bucket ORDER BY bucket")  # noqa [suppress no data sources help message]
+        return [(row[0].timestamp(), (float(row[1]), float(row[2]), float(row[3]), float(row[4])))
+                for row in ps(datetime.datetime.fromtimestamp(startTime), datetime.datetime.fromtimestamp(endTime), int(bucketSeconds))]
+
+    def copyStateCsv(self, trvCtlrDevId, stateName, startTime, endTime, csvFile):
+        # Write 'timestamp,value' CSV lines of a state to csvFile (opened in binary mode) with the same boundary rows as the history()
+        # rows of a CSV export: the value in force at startTime (if there is one), each change after startTime up to endTime (one per
+        # timestamp) and the value at endTime unless the last change is at endTime. The lines are produced by the server with COPY ... TO
+        # STDOUT and streamed to the file in the chunks received, so rows never become Python objects. Returns (lines, bytes) written.
+        #
+        # COPY doesn't take parameters, so the times are written into the statement as local time literals.
+
+        startLiteral = datetime.datetime.fromtimestamp(startTime).strftime("'%Y-%m-%d %H:%M:%S.%f'::timestamp")
+        endLiteral = datetime.datetime.fromtimestamp(endTime).strftime("'%Y-%m-%d %H:%M:%S.%f'::timestamp")
+        table = f'device_history_{trvCtlrDevId}'
+        copyStatement = self.connection.prepare(
+            f"COPY (SELECT to_char(ts, '{HISTORY_COPY_TIMESTAMP_FORMAT}'), value FROM ("
+            f"(SELECT {startLiteral} AS ts, {stateName} AS value FROM {table} WHERE ts <= {startLiteral} AND {stateName} IS NOT NULL ORDER BY {table}.ts DESC LIMIT 1)"
+            f" UNION ALL (SELECT DISTINCT ON (ts) ts, {stateName} FROM {table} WHERE ts > {startLiteral} AND ts <= {endLiteral} AND {stateName} IS NOT NULL ORDER BY ts)"
+            f" UNION ALL (SELECT {endLiteral}, value FROM (SELECT ts, {stateName} AS value FROM {table} WHERE ts <= {endLiteral} AND {stateName} IS NOT NULL"
+            f" ORDER BY ts DESC LIMIT 1) AS latest WHERE latest.ts < {endLiteral})"
+            f") AS history ORDER BY ts) TO STDOUT WITH CSV")  # noqa [suppress no data sources help message]
+
+        copiedLines = copiedBytes = 0
+        with self.connection.xact():
+            with copyman.CopyManager(copyman.StatementProducer(copyStatement), copyman.CallReceiver(csvFile.writelines)) as copy:
+                for messageCount, byteCount in copy:
+                    copiedLines += messageCount
+                    copiedBytes += byteCount
+        return copiedLines, copiedBytes
+
+    def close(self):
+        self.connection.close()
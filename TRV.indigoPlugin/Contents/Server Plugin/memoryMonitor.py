@@ -0,0 +1,144 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Memory Monitor © Autolog 2022
+#
+
+import collections
+import sys
+import threading
+import tracemalloc
+import types
+
+MEMORY_TRACE_FRAMES = 10
+MEMORY_DIFF_TOP_ENTRIES = 25
+
+# Objects that are counted but not followed when sizing a structure: following them would size the whole plugin (bound methods,
+# threads and queues reference their owners) or parts of the Python runtime
+NOT_FOLLOWED_TYPES = (type, types.ModuleType, types.FunctionType, types.MethodType, types.BuiltinFunctionType, threading.Thread)
+
+
+# noinspection PyPep8Naming
+def deepSizeOf(structure):
+    # Approximate bytes held by a structure: containers are followed, other objects are counted at their own (shallow) size.
+    # Timers are counted with their arguments, as these are what a finished timer keeps alive.
+
+    seen = set()
+    pending = [structure]
+    totalBytes = 0
+    while pending:
+        item = pending.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        totalBytes += sys.getsizeof(item)
+
+        if isinstance(item, threading.Timer):
+            pending.extend([item.args, item.kwargs])
+        elif isinstance(item, NOT_FOLLOWED_TYPES):
+            continue
+        elif isinstance(item, dict):
+            pending.extend(item.keys())
+            pending.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, collections.deque)):
+            pending.extend(item)
+    return totalBytes
+
+
+# noinspection PyPep8Naming
+def timerCounts(timers):
+    # {group: (live, dead)} for the timer groups held in globals['timers'] - a timer is dead once it has run or been cancelled
+
+    counts = dict()
+    for groupName, group in timers.items():
+        groupTimers = group.values() if isinstance(group, dict) else [group]
+        live = dead = 0
+        for timer in groupTimers:
+            if not isinstance(timer, threading.Timer):
+                continue
+            if timerDead(timer):
+                dead += 1
+            else:
+                live += 1
+        counts[groupName] = (live, dead)
+    return counts
+
+
+# noinspection PyPep8Naming
+def timerDead(timer):
+    return timer.ident is not None and not timer.is_alive()  # ident is only set once started, so a timer still being set-up is not dead
+
+
+# noinspection PyPep8Naming
+def pruneTimers(timers, deviceExists):
+    # Dead timers have their arguments released (e.g. the Spirit valve command sequences) and, if their device no longer exists, are
+    # removed. Entries for existing devices are left in place as other threads may be replacing them - cancel() on a dead timer is harmless.
+
+    released = removed = 0
+    for groupName, group in timers.items():
+        if not isinstance(group, dict):
+            continue
+        for key, timer in list(group.items()):
+            if not isinstance(timer, threading.Timer) or not timerDead(timer):
+                continue
+            if timer.args or timer.kwargs:
+                timer.args = list()
+                timer.kwargs = dict()
+                released += 1
+            if not deviceExists(key) and group.get(key, None) is timer:
+                del group[key]
+                removed += 1
+    return released, removed
+
+
+# noinspection PyPep8Naming
+class MemoryTracer:
+
+    # tracemalloc snapshots: the first snapshot starts tracing and becomes the baseline, later snapshots are compared with it.
+    # Tracing slows allocation so is only on between the first snapshot and stop().
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.baselineSnapshot = None
+        self.snapshotCount = 0
+
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def snapshot(self):
+        # Returns None when tracing has just been started, otherwise the growth since the baseline as a list of report lines
+
+        with self.lock:
+            if not tracemalloc.is_tracing() or self.baselineSnapshot is None:
+                tracemalloc.start(MEMORY_TRACE_FRAMES)
+                self.baselineSnapshot = self.filteredSnapshot()
+                self.snapshotCount = 1
+                return None
+
+            currentSnapshot = self.filteredSnapshot()
+            self.snapshotCount += 1
+            differences = currentSnapshot.compare_to(self.baselineSnapshot, 'traceback')
+
+            currentBytes, peakBytes = tracemalloc.get_traced_memory()
+            reportLines = [f'Traced memory: {currentBytes:,} bytes (peak {peakBytes:,} bytes)',
+                           f'Snapshot {self.snapshotCount} growth: {sum([difference.size_diff for difference in differences]):,} bytes']
+            for difference in differences[:MEMORY_DIFF_TOP_ENTRIES]:
+                if difference.size_diff == 0:
+                    break
+                frame = difference.traceback[-1]  # Most recent frame i.e. where the allocation was made
+                reportLines.append(f'{difference.size_diff:>+12,} bytes {difference.count_diff:>+8} blocks  {frame.filename.split("/")[-1]}:{frame.lineno}')
+                for tracebackFrame in list(difference.traceback)[-2::-1][:3]:  # Callers, most recent first
+                    reportLines.append(f'{"":>36}<- {tracebackFrame.filename.split("/")[-1]}:{tracebackFrame.lineno}')
+            return reportLines
+
+    def stop(self):
+        with self.lock:
+            self.baselineSnapshot = None
+            self.snapshotCount = 0
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+    @staticmethod
+    def filteredSnapshot():
+        return tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                                                          tracemalloc.Filter(False, '<unknown>')))
@@ -13,18 +13,32 @@ except ImportError:
 
 import collections
 import datetime
+import json
 import logging
+import os
 import platform
-import queue
 import operator
 import sys
 import threading
+import time
 import traceback
 import xml.etree.ElementTree as eTree
 
 from constants import *
 from trvHandler import ThreadTrvHandler
+from watchdog import HandlerActivity, ThreadWatchdog
+from exportJob import ThreadExportJob
+from exportListener import ThreadExportListener
+from csvWriter import ThreadCsvWriter
 from delayHandler import ThreadDelayHandler
+from handlerQueue import InstrumentedLanedQueue
+from memoryMonitor import deepSizeOf, MemoryTracer, pruneTimers, timerCounts
+from profiler import HandlerProfiler, PROFILE_MODE_CPROFILE, PROFILE_MODE_SAMPLER
+from queueMetrics import InstrumentedQueue
+from historyDatabase import SqliteHistory, HISTORY_DATABASE_FILE_NAME
+from datagraphRenderCache import DatagraphRenderCache, DATAGRAPH_RENDER_CACHE_FILE_NAME
+from timeSeriesStore import TimeSeriesStore
+from zwaveCapture import ZwaveFrameCapture, ZWAVE_CAPTURE_FILE_MEGABYTES_DEFAULT, ZWAVE_CAPTURE_FILE_NAME, ZWAVE_CAPTURE_FILES_DEFAULT
 from zwave_interpreter.zwave_interpreter import *
 from zwave_interpreter.zwave_command_class_wake_up import *
 from zwave_interpreter.zwave_command_class_switch_multilevel import *
@@ -64,6 +78,17 @@ def calculateSecondsUntilSchedulesRestated():
     return secondsUntilSchedulesRestated
 
 
+# noinspection PyPep8Naming
+def configInteger(valuesDict, key, default, minimum, maximum=None):
+    # The integer in valuesDict[key] limited to minimum .. maximum, or default if it isn't an integer (the plugin config is also read
+    # at startup, before validatePrefsConfigUi has had a chance to reject it)
+    try:
+        value = max(int(valuesDict.get(key, default)), minimum)
+    except (ValueError, TypeError):
+        return default
+    return value if maximum is None else min(value, maximum)
+
+
 # noinspection PyPep8Naming
 class Plugin(indigo.PluginBase):
 
@@ -78,6 +103,7 @@ class Plugin(indigo.PluginBase):
         self.globals['zwave']['addressToDevice'] = dict()
         self.globals['zwave']['WatchList'] = set()  # TRVs, Valves and Remotes associated with a TRV Controllers will get added to this SET on TRV Controller device start
         self.globals['zwave']['node_to_device_name'] = dict()
+        self.globals['zwave']['capture'] = None  # ZwaveFrameCapture when Z-Wave frame capture is enabled
 
         # # Initialise Indigo plugin info
         # self.globals[PLUGIN_INFO] = {}
@@ -154,6 +180,16 @@ class Plugin(indigo.PluginBase):
         self.globals['queues']['delay'] = dict()
         self.globals['queues']['initialised'] = False
 
+        # Initialise counts of TRV Controller state writes made by the TRV Handler (requested = calls before write-behind buffering, roundTrips = updateStatesOnServer calls made)
+        self.globals['stateWrites'] = dict()
+        self.globals['stateWrites']['requested'] = 0
+        self.globals['stateWrites']['keysRequested'] = 0
+        self.globals['stateWrites']['roundTrips'] = 0
+        self.globals['stateWrites']['keysWritten'] = 0
+        self.globals['stateWrites']['keysUnchanged'] = 0
+
+        self.globals['queueMetricsVariableIds'] = dict()  # Queue metrics variable name -> id of the variable in the TRV variable folder
+
         # Initialise dictionary to store heating schedules
         self.globals['schedules'] = dict()
 
@@ -164,6 +200,7 @@ class Plugin(indigo.PluginBase):
         # Initialise dictionary to store timers
         self.globals['timers'] = dict()
         self.globals['timers']['heaters'] = dict()
+        self.globals['timers']['heatSourceDwell'] = dict()
         self.globals['timers']['heatingSchedules'] = dict()
         self.globals['timers']['command'] = dict()
         self.globals['timers']['SpiritPolling'] = dict()
@@ -172,17 +209,41 @@ class Plugin(indigo.PluginBase):
         self.globals['timers']['boost'] = dict()
         self.globals['timers']['raceCondition'] = dict()
         self.globals['timers']['zwaveWakeupCheck'] = dict()
+        self.globals['timers']['temperatureBroadcastRemote'] = dict()  # Deferred processing of a suppressed Remote temperature broadcast
+        self.globals['timers']['temperatureBroadcastRadiator'] = dict()  # Deferred processing of a suppressed Radiator temperature broadcast
+        self.globals['timers']['queueMetrics'] = None
 
         # Initialise dictionary to store threads
         self.globals['threads'] = dict()
         self.globals['threads']['polling'] = dict()  # There is only one 'polling' thread for all TRV devices
         self.globals['threads']['trvHandler'] = dict()  # There is only one 'trvHandler' thread for all TRV devices
         self.globals['threads']['delayHandler'] = dict()  # There is only one 'delayHandler' thread for all TRV devices
+        self.globals['threads']['watchdog'] = dict()  # Watches the 'trvHandler' and 'delayHandler' threads
+        self.globals['threads']['csvWriter'] = dict()  # Writes the Standard CSV files updated by the 'trvHandler' thread
+        self.globals['threads']['exportJob'] = dict()  # Exports all TRV Controllers' PostgreSQL CSV / DataGraph files on request or schedule
+        self.globals['threads']['exportListener'] = dict()  # Requests exports from the 'exportJob' thread when SQL Logger writes new history
 
         self.globals['threads']['runConcurrentActive'] = False
 
-        self.globals['lock'] = threading.Lock()
-        
+        # Initialise handler thread activity (updated by the handler threads, checked by the watchdog thread) and the watchdog's stall history
+        self.globals['watchdog'] = dict()
+        self.globals['watchdog']['trvHandler'] = HandlerActivity()
+        self.globals['watchdog']['delayHandler'] = HandlerActivity()
+        self.globals['watchdog']['stalls'] = collections.deque(maxlen=WATCHDOG_STALL_HISTORY)
+
+        # Initialise on demand profiler of the trvHandler and delayHandler threads
+        self.globals['profiler'] = HandlerProfiler()
+
+        # Initialise tracemalloc snapshots for the memory report (tracing is only started by the 'Show Memory Report' menu item)
+        self.globals['memoryTracer'] = MemoryTracer()
+
+        # Initialise the store of TRV Controller state history (ring files are only opened when a state is first recorded)
+        self.globals['timeSeries'] = TimeSeriesStore(f'{self.globals["pluginInfo"]["path"]}/Preferences/Plugins/{pluginId}/{TIME_SERIES_FOLDER_NAME}', TIME_SERIES_STATES, TIME_SERIES_AVERAGED_STATES)
+
+        # Initialise the plugin's own SQLite history database - an alternative to the SQL Logger's PostgreSQL database for CSV exports
+        self.globals['historyDatabase'] = SqliteHistory(f'{self.globals["pluginInfo"]["path"]}/Preferences/Plugins/{pluginId}/{HISTORY_DATABASE_FILE_NAME}', TIME_SERIES_STATES)
+        self.globals['datagraphRenders'] = DatagraphRenderCache(f'{self.globals["pluginInfo"]["path"]}/Preferences/Plugins/{pluginId}/{DATAGRAPH_RENDER_CACHE_FILE_NAME}')
+
         self.globals['devicesToTrvControllerTable'] = dict()
 
         # Initialise dictionary for constants
@@ -360,17 +421,52 @@ class Plugin(indigo.PluginBase):
 
             self.globals['config']['disableHeatSourceDeviceListFilter'] = valuesDict.get('disableHeatSourceDeviceListFilter', False)
 
+            # Heat Source minimum on / off dwell times (zero = no minimum)
+            self.globals['config']['heatSourceMinimumOnMinutes'] = int(valuesDict.get("heatSourceMinimumOnMinutes", 0))
+            self.globals['config']['heatSourceMinimumOffMinutes'] = int(valuesDict.get("heatSourceMinimumOffMinutes", 0))
+
             # Delay Queue Options
             self.globals['config']['delayQueueSeconds'] = int(valuesDict.get("delayQueueSeconds", 0))
 
+            # Queue Metrics Options (zero = don't publish)
+            self.globals['config']['queueMetricsPublishMinutes'] = int(valuesDict.get("queueMetricsPublishMinutes", 0))
+            self.globals['config']['queueMetricsFileEnabled'] = bool(valuesDict.get("queueMetricsFileEnabled", False))
+
+            # Queue Limits (zero = Low lane unbounded / no aging)
+            self.globals['config']['queueLowLaneCapacity'] = int(valuesDict.get("queueLowLaneCapacity", QUEUE_LOW_LANE_CAPACITY_DEFAULT))
+            self.globals['config']['queueAgingSeconds'] = int(valuesDict.get("queueAgingSeconds", QUEUE_AGING_SECONDS_DEFAULT))
+            self.globals['config']['queueCoalesceCsvUpdates'] = bool(valuesDict.get("queueCoalesceCsvUpdates", True))
+            if self.globals['queues']['initialised']:
+                self.configureTrvHandlerQueue()
+
+            # Z-Wave Frame Capture
+            self.globals['config']['zwaveCaptureEnabled'] = bool(valuesDict.get("zwaveCaptureEnabled", False))
+            self.globals['config']['zwaveCaptureFileMegabytes'] = int(valuesDict.get("zwaveCaptureFileMegabytes", ZWAVE_CAPTURE_FILE_MEGABYTES_DEFAULT))
+            self.globals['config']['zwaveCaptureFiles'] = int(valuesDict.get("zwaveCaptureFiles", ZWAVE_CAPTURE_FILES_DEFAULT))
+            self.configureZwaveCapture()
+
+            # Time-Series Store
+            self.globals['config']['timeSeriesEnabled'] = bool(valuesDict.get("timeSeriesEnabled", True))
+            self.globals['timeSeries'].enabled = self.globals['config']['timeSeriesEnabled']
+
             # CSV File Handling (for e.g. Matplotlib plugin)
             self.globals['config']['csvStandardEnabled'] = valuesDict.get("csvStandardEnabled", False)
+            self.globals['config']['csvFlushSeconds'] = configInteger(valuesDict, "csvFlushSeconds", CSV_FLUSH_SECONDS_DEFAULT, 1)
+            self.globals['config']['csvFsyncEnabled'] = bool(valuesDict.get("csvFsyncEnabled", False))
             self.globals['config']['csvPostgresqlEnabled'] = valuesDict.get("csvPostgresqlEnabled", False)
+            self.globals['config']['csvDatabase'] = valuesDict.get("csvDatabase", 'postgresql')
+            self.globals['historyDatabase'].enabled = bool(self.globals['config']['csvPostgresqlEnabled']) and self.globals['config']['csvDatabase'] == 'sqlite'
             self.globals['config']['postgresqlUser'] = valuesDict.get("postgresqlUser", '')
             self.globals['config']['postgresqlPassword'] = valuesDict.get("postgresqlPassword", '')
             self.globals['config']['datagraphCliPath'] = valuesDict.get("datagraphCliPath", '')
             self.globals['config']['datagraphGraphTemplatesPath'] = valuesDict.get("datagraphGraphTemplatesPath", '')
             self.globals['config']['datagraphImagesPath'] = valuesDict.get("datagraphImagesPath", '')
+            self.globals['config']['datagraphBucketingEnabled'] = bool(valuesDict.get("datagraphBucketingEnabled", False))
+            self.globals['config']['datagraphPointBudget'] = configInteger(valuesDict, "datagraphPointBudget", DATAGRAPH_POINT_BUDGET_DEFAULT, 1)
+            self.globals['config']['exportJobIntervalMinutes'] = max(int(valuesDict.get("exportJobIntervalMinutes", EXPORT_JOB_INTERVAL_MINUTES_DEFAULT)), 0)
+            self.globals['config']['exportJobWorkers'] = configInteger(valuesDict, "exportJobWorkers", EXPORT_JOB_WORKERS_DEFAULT, 1, EXPORT_JOB_WORKERS_MAXIMUM)
+            self.globals['config']['exportOnNotifyEnabled'] = bool(valuesDict.get("exportOnNotifyEnabled", False))
+            self.globals['config']['exportNotifyDebounceSeconds'] = configInteger(valuesDict, "exportNotifyDebounceSeconds", EXPORT_NOTIFY_DEBOUNCE_SECONDS_DEFAULT, 0)
             self.globals['config']['csvPath'] = valuesDict.get("csvPath", '')
             self.globals['config']['csvPrefix'] = valuesDict.get("csvPrefix", 'TRV_Plugin')
 
@@ -403,6 +499,35 @@ class Plugin(indigo.PluginBase):
         except Exception as exception_error:
             self.exception_handler(exception_error, True)  # Log error and display failing statement
 
+    def deviceCreated(self, dev):
+        try:
+            if ZWI in self.globals:
+                self.globals[ZWI][ZWI_INSTANCE].device_created(dev)  # Keep the Z-Wave node map up to date
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+
+        finally:
+
+            indigo.PluginBase.deviceCreated(self, dev)
+
+    def deviceDeleted(self, dev):
+        try:
+            if ZWI in self.globals:
+                self.globals[ZWI][ZWI_INSTANCE].device_deleted(dev)  # Keep the Z-Wave node map up to date
+
+            if dev.deviceTypeId == 'trvController':
+                self.globals['timeSeries'].delete(dev.id)  # Remove the TRV Controller's state history
+                self.globals['historyDatabase'].delete(dev.id)
+                self.globals['datagraphRenders'].delete(dev.id)
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+
+        finally:
+
+            indigo.PluginBase.deviceDeleted(self, dev)
+
     def deviceStartComm(self, trvcDev):
 
         try:
@@ -458,6 +583,16 @@ class Plugin(indigo.PluginBase):
 
             self.globals['trvc'][trvCtlrDevId]['hideTempBroadcast'] = bool(trvcDev.pluginProps.get('hideTempBroadcast', False))  # Hide Temperature Broadcast in Event Log Flag
 
+            self.globals['trvc'][trvCtlrDevId]['temperatureBroadcastDeadband'] = float(trvcDev.pluginProps.get('temperatureBroadcastDeadband', 0.0))
+            self.globals['trvc'][trvCtlrDevId]['temperatureBroadcastMinimumInterval'] = float(trvcDev.pluginProps.get('temperatureBroadcastMinimumInterval', 0))
+            for temperatureSource in ('Remote', 'Radiator'):
+                self.globals['trvc'][trvCtlrDevId][f'temperatureBroadcastLastProcessed{temperatureSource}'] = None  # Temperature of the last processed broadcast
+                self.globals['trvc'][trvCtlrDevId][f'temperatureBroadcastLastProcessedTime{temperatureSource}'] = 0.0
+                self.globals['trvc'][trvCtlrDevId][f'temperatureBroadcastsProcessed{temperatureSource}'] = 0
+                self.globals['trvc'][trvCtlrDevId][f'temperatureBroadcastsSuppressed{temperatureSource}'] = 0
+                self.globals['trvc'][trvCtlrDevId][f'temperatureBroadcastsDeferred{temperatureSource}'] = 0
+                self.globals['trvc'][trvCtlrDevId][f'temperatureBroadcastPending{temperatureSource}'] = None  # (temperature, update value) of a broadcast suppressed by the minimum interval
+
             self.globals['trvc'][trvCtlrDevId]['trvDevId'] = int(trvcDev.pluginProps.get('trvDevId', 0))  # ID of TRV device
             # self.globals['trvc'][trvCtlrDevId]['trvDeltaMax'] = float(trvcDev.pluginProps.get('trvDeltaMax', 0.0))
 
@@ -487,6 +622,7 @@ class Plugin(indigo.PluginBase):
                     self.globals['trvc'][trvCtlrDevId]['postgresqlPassword'] = self.globals['config']['postgresqlPassword']
             self.globals['trvc'][trvCtlrDevId]['csvShortName'] = trvcDev.pluginProps.get('csvShortName', '')
             self.globals['trvc'][trvCtlrDevId]['csvRetentionPeriodHours'] = int(trvcDev.pluginProps.get('csvRetentionPeriodHours', 24))
+            self.globals['timeSeries'].configure(trvCtlrDevId, self.globals['trvc'][trvCtlrDevId]['csvRetentionPeriodHours'])  # State history is kept for the CSV retention period
 
             self.globals['trvc'][trvCtlrDevId]['pollingScheduleActive'] = float(int(trvcDev.pluginProps.get('pollingScheduleActive', 5)) * 60.0)
             self.globals['trvc'][trvCtlrDevId]['pollingScheduleInactive'] = float(int(trvcDev.pluginProps.get('pollingScheduleInactive', 20)) * 60.0)
@@ -592,6 +728,12 @@ class Plugin(indigo.PluginBase):
                 self.globals['heaterDevices'][self.globals['trvc'][trvCtlrDevId]['heatingId']] = dict()
                 self.globals['heaterDevices'][self.globals['trvc'][trvCtlrDevId]['heatingId']][
                     'thermostatsCallingForHeat'] = set()  # A set of TRVs calling for heat from this heat source [None at the moment]
+                self.globals['heaterDevices'][self.globals['trvc'][trvCtlrDevId]['heatingId']]['demandTransitions'] = 0
+                self.globals['heaterDevices'][self.globals['trvc'][trvCtlrDevId]['heatingId']]['onStateChangedTime'] = 0.0  # Used to enforce the minimum on / off dwell times
+                self.globals['heaterDevices'][self.globals['trvc'][trvCtlrDevId]['heatingId']]['lastCommandTime'] = 0.0
+                self.globals['heaterDevices'][self.globals['trvc'][trvCtlrDevId]['heatingId']]['commandsIssued'] = 0
+                self.globals['heaterDevices'][self.globals['trvc'][trvCtlrDevId]['heatingId']]['commandsSuppressed'] = 0
+                self.globals['heaterDevices'][self.globals['trvc'][trvCtlrDevId]['heatingId']]['keepAlivesSkipped'] = 0  # Keep alive reminders not needed as a command was recently sent
 
                 self.globals['heaterDevices'][self.globals['trvc'][trvCtlrDevId]['heatingId']]['heaterControlType'] = HEAT_SOURCE_NOT_FOUND  # Default to No Heating Source
 
@@ -614,7 +756,13 @@ class Plugin(indigo.PluginBase):
                 self.globals['heaterVariables'][self.globals['trvc'][trvCtlrDevId]['heatingVarId']] = dict()
                 self.globals['heaterVariables'][self.globals['trvc'][trvCtlrDevId]['heatingVarId']][
                     'thermostatsCallingForHeat'] = set()  # A set of TRVs calling for heat from this heat source [None at the moment]
+                self.globals['heaterVariables'][self.globals['trvc'][trvCtlrDevId]['heatingVarId']]['demandTransitions'] = 0
+                self.globals['heaterVariables'][self.globals['trvc'][trvCtlrDevId]['heatingVarId']]['onStateChangedTime'] = 0.0  # Used to enforce the minimum on / off dwell times
+                self.globals['heaterVariables'][self.globals['trvc'][trvCtlrDevId]['heatingVarId']]['lastCommandTime'] = 0.0
+                self.globals['heaterVariables'][self.globals['trvc'][trvCtlrDevId]['heatingVarId']]['commandsIssued'] = 0
+                self.globals['heaterVariables'][self.globals['trvc'][trvCtlrDevId]['heatingVarId']]['commandsSuppressed'] = 0
                 indigo.variable.updateValue(self.globals['trvc'][trvCtlrDevId]['heatingVarId'], value="false")  # Variable indicator to show that heating is NOT being requested
+                self.globals['heaterVariables'][self.globals['trvc'][trvCtlrDevId]['heatingVarId']]['onState'] = HEAT_SOURCE_OFF
 
             # Battery level setup
             self.globals['trvc'][trvCtlrDevId]['batteryLevel'] = 0
@@ -945,6 +1093,10 @@ class Plugin(indigo.PluginBase):
             self.globals['trvc'][trvCtlrDevId]['zwavePendingRemoteSetpointSequence'] = 0
             self.globals['trvc'][trvCtlrDevId]['zwavePendingRemoteSetpointValue'] = 0.0
 
+            self.globals['trvc'][trvCtlrDevId]['controlInputsFingerprint'] = None  # Control inputs at the last controlTrv evaluation - evaluation is skipped if unchanged
+            self.globals['trvc'][trvCtlrDevId]['controlEvaluations'] = 0
+            self.globals['trvc'][trvCtlrDevId]['controlSkips'] = 0
+
             self.globals['trvc'][trvCtlrDevId]['deltaIncreaseHeatSetpoint'] = 0.0
             self.globals['trvc'][trvCtlrDevId]['deltaIDecreaseHeatSetpoint'] = 0.0
 
@@ -1042,26 +1194,35 @@ class Plugin(indigo.PluginBase):
 
             trvcDev.updateStateImageOnServer(indigo.kStateImageSel.HvacAutoMode)  # HvacOff - HvacHeatMode - HvacHeating - HvacAutoMode
 
+            # Record the starting values in the state history - only for the devices the TRV Controller has
+            timeSeriesStates = ['setpointHeat', 'temperatureTrv', 'setpointHeatTrv']
+            if self.globals['trvc'][trvCtlrDevId]['valveDevId'] != 0:
+                timeSeriesStates.append('valvePercentageOpen')
+            if self.globals['trvc'][trvCtlrDevId]['remoteDevId'] != 0:
+                timeSeriesStates.append('temperatureRemote')
+                if self.globals['trvc'][trvCtlrDevId]['remoteSetpointHeatControl']:
+                    timeSeriesStates.append('setpointHeatRemote')
+            if self.globals['trvc'][trvCtlrDevId]['radiatorDevId'] != 0:
+                timeSeriesStates.append('temperatureRadiator')
+            timeSeriesKeyValueList = [{'key': stateName, 'value': self.globals['trvc'][trvCtlrDevId][stateName]} for stateName in timeSeriesStates]
+            self.globals['timeSeries'].recordStates(trvCtlrDevId, timeSeriesKeyValueList)
+            self.globals['historyDatabase'].recordStates(trvCtlrDevId, timeSeriesKeyValueList)
+
             # Check if CSV Files need initialising
 
             if self.globals['trvc'][trvCtlrDevId]['updateCsvFile']:
                 if self.globals['trvc'][trvCtlrDevId]['updateAllCsvFiles']:
                     self.globals['queues']['trvHandler'].put([QUEUE_PRIORITY_LOW, 0, CMD_UPDATE_ALL_CSV_FILES, trvCtlrDevId, None])
                 else:
-                    self.globals['queues']['trvHandler'].put([QUEUE_PRIORITY_LOW, 0, CMD_UPDATE_CSV_FILE, trvCtlrDevId, ['setpointHeat', float(self.globals['trvc'][trvCtlrDevId]['setpointHeat'])]])
-                    self.globals['queues']['trvHandler'].put(
-                        [QUEUE_PRIORITY_LOW, 0, CMD_UPDATE_CSV_FILE, trvCtlrDevId, ['temperatureTrv', float(self.globals['trvc'][trvCtlrDevId]['temperatureTrv'])]])
-                    self.globals['queues']['trvHandler'].put(
-                        [QUEUE_PRIORITY_LOW, 0, CMD_UPDATE_CSV_FILE, trvCtlrDevId, ['setpointHeatTrv', float(self.globals['trvc'][trvCtlrDevId]['setpointHeatTrv'])]])
+                    self.globals['threads']['csvWriter']['thread'].addRow(trvCtlrDevId, 'setpointHeat', float(self.globals['trvc'][trvCtlrDevId]['setpointHeat']))
+                    self.globals['threads']['csvWriter']['thread'].addRow(trvCtlrDevId, 'temperatureTrv', float(self.globals['trvc'][trvCtlrDevId]['temperatureTrv']))
+                    self.globals['threads']['csvWriter']['thread'].addRow(trvCtlrDevId, 'setpointHeatTrv', float(self.globals['trvc'][trvCtlrDevId]['setpointHeatTrv']))
                     if self.globals['trvc'][trvCtlrDevId]['valveDevId'] != 0:
-                        self.globals['queues']['trvHandler'].put(
-                            [QUEUE_PRIORITY_LOW, 0, CMD_UPDATE_CSV_FILE, trvCtlrDevId, ['valvePercentageOpen', int(self.globals['trvc'][trvCtlrDevId]['valvePercentageOpen'])]])
+                        self.globals['threads']['csvWriter']['thread'].addRow(trvCtlrDevId, 'valvePercentageOpen', int(self.globals['trvc'][trvCtlrDevId]['valvePercentageOpen']))
                     if self.globals['trvc'][trvCtlrDevId]['remoteDevId'] != 0:
-                        self.globals['queues']['trvHandler'].put(
-                            [QUEUE_PRIORITY_LOW, 0, CMD_UPDATE_CSV_FILE, trvCtlrDevId, ['temperatureRemote', float(self.globals['trvc'][trvCtlrDevId]['temperatureRemote'])]])
+                        self.globals['threads']['csvWriter']['thread'].addRow(trvCtlrDevId, 'temperatureRemote', float(self.globals['trvc'][trvCtlrDevId]['temperatureRemote']))
                         if self.globals['trvc'][trvCtlrDevId]['remoteSetpointHeatControl']:
-                            self.globals['queues']['trvHandler'].put(
-                                [QUEUE_PRIORITY_LOW, 0, CMD_UPDATE_CSV_FILE, trvCtlrDevId, ['setpointHeatRemote', float(self.globals['trvc'][trvCtlrDevId]['setpointHeatRemote'])]])
+                            self.globals['threads']['csvWriter']['thread'].addRow(trvCtlrDevId, 'setpointHeatRemote', float(self.globals['trvc'][trvCtlrDevId]['setpointHeatRemote']))
 
             # Set-up schedules
             scheduleSetpointOff = float(self.globals['trvc'][trvCtlrDevId]['setpointHeatMinimum'])
@@ -1174,6 +1335,12 @@ class Plugin(indigo.PluginBase):
 
             self.globals['trvc'][trvCtlrDevId]['deviceStarted'] = False
 
+            # Cancel the TRV Controller's schedule, boost, advance, delayed command and Spirit timers so they don't fire while it is stopped
+            self.cancelTimers([self.globals['timers'][timerGroup][trvCtlrDevId] for timerGroup in TRV_CONTROLLER_TIMER_GROUPS if trvCtlrDevId in self.globals['timers'][timerGroup]])
+
+            self.globals['timeSeries'].close(trvCtlrDevId)
+            self.globals['threads']['csvWriter']['thread'].close(trvCtlrDevId)
+
             if 'trvDevId' in self.globals['trvc'][trvCtlrDevId] and self.globals['trvc'][trvCtlrDevId]['trvDevId'] != 0:
                 self.globals['zwave']['WatchList'].discard(int(indigo.devices[self.globals['trvc'][trvCtlrDevId]['trvDevId']].address))
             if 'remoteDevId' in self.globals['trvc'][trvCtlrDevId] and self.globals['trvc'][trvCtlrDevId]['remoteDevId'] != 0:
@@ -1223,6 +1390,9 @@ class Plugin(indigo.PluginBase):
 
                 return race_condition  # Note if True then the 'finally:' statement at the end of deviceUpdated method will return the correct values to Indigo
 
+            if ZWI in self.globals:
+                self.globals[ZWI][ZWI_INSTANCE].device_updated(origDev, newDev)  # Keep the Z-Wave node map up to date
+
             device_updated_prefix = f"{u'':={u'^'}22}> "  # 22 equal signs as first part of prefix
 
             if (newDev.deviceTypeId == 'trvController' and newDev.configured and newDev.id in self.globals['trvc']
@@ -1269,7 +1439,7 @@ class Plugin(indigo.PluginBase):
                         if self.globals['trvc'][trvCtlrDevId]['updateAllCsvFiles']:
                             self.globals['queues']['trvHandler'].put([QUEUE_PRIORITY_LOW, 0, CMD_UPDATE_ALL_CSV_FILES, trvCtlrDevId, None])
                         else:
-                            self.globals['queues']['trvHandler'].put([QUEUE_PRIORITY_LOW, 0, CMD_UPDATE_CSV_FILE, trvCtlrDevId, ['setpointHeat', self.globals['trvc'][trvCtlrDevId]['setpointHeat']]])
+                            self.globals['threads']['csvWriter']['thread'].addRow(trvCtlrDevId, 'setpointHeat', self.globals['trvc'][trvCtlrDevId]['setpointHeat'])
 
                 if len(updateLogItems) > 0:
                     device_updated_report = (
@@ -1362,7 +1532,7 @@ class Plugin(indigo.PluginBase):
                                         if self.globals['trvc'][trvCtlrDevId]['updateAllCsvFiles']:
                                             self.globals['queues']['trvHandler'].put([QUEUE_PRIORITY_LOW, 0, CMD_UPDATE_ALL_CSV_FILES, trvCtlrDevId, None])
                                         else:
-                                            self.globals['queues']['trvHandler'].put([QUEUE_PRIORITY_LOW, 0, CMD_UPDATE_CSV_FILE, trvCtlrDevId, ['temperatureTrv', newTemp]])
+                                            self.globals['threads']['csvWriter']['thread'].addRow(trvCtlrDevId, 'temperatureTrv', newTemp)
 
                             if (int(origDev.hvacMode) != int(newDev.hvacMode)) or (int(self.globals['trvc'][trvCtlrDevId]['hvacOperationModeTrv']) != int(newDev.hvacMode)):
 
@@ -1420,7 +1590,7 @@ class Plugin(indigo.PluginBase):
                                     if self.globals['trvc'][trvCtlrDevId]['updateAllCsvFiles']:
                                         self.globals['queues']['trvHandler'].put([QUEUE_PRIORITY_LOW, 0, CMD_UPDATE_ALL_CSV_FILES, trvCtlrDevId, None])
                                     else:
-                                        self.globals['queues']['trvHandler'].put([QUEUE_PRIORITY_LOW, 0, CMD_UPDATE_CSV_FILE, trvCtlrDevId, ['setpointHeatTrv', newDev.heatSetpoint]])
+                                        self.globals['threads']['csvWriter']['thread'].addRow(trvCtlrDevId, 'setpointHeatTrv', newDev.heatSetpoint)
 
                         # elif newDev.globalProps['com.perceptiveautomation.indigoplugin.zwave']['zwDevSubIndex'] == 1:  # Valve ?
                         elif self.globals['devicesToTrvControllerTable'][newDev.id]['type'] == VALVE:
@@ -1434,7 +1604,7 @@ class Plugin(indigo.PluginBase):
                                         if self.globals['trvc'][trvCtlrDevId]['updateAllCsvFiles']:
                                             self.globals['queues']['trvHandler'].put([QUEUE_PRIORITY_LOW, 0, CMD_UPDATE_ALL_CSV_FILES, trvCtlrDevId, None])
                                         else:
-                                            self.globals['queues']['trvHandler'].put([QUEUE_PRIORITY_LOW, 0, CMD_UPDATE_CSV_FILE, trvCtlrDevId, ['valvePercentageOpen', int(newDev.brightness)]])
+                                            self.globals['threads']['csvWriter']['thread'].addRow(trvCtlrDevId, 'valvePercentageOpen', int(newDev.brightness))
 
                     elif self.globals['devicesToTrvControllerTable'][newDev.id]['type'] == REMOTE:
 
@@ -1490,7 +1660,12 @@ class Plugin(indigo.PluginBase):
                             # origTemp should already have had the offset applied - just need to add it to newTemp to ensure comparison is valid
 
                             newTempPlusOffset = newTemp + float(self.globals['trvc'][trvCtlrDevId]['remoteTempOffset'])
-                            if origTemp != newTempPlusOffset:
+                            if origTemp != newTempPlusOffset and not self.temperatureBroadcastRequiresProcessing(trvCtlrDevId, 'Remote', newTempPlusOffset, newTemp):
+                                # Within deadband / minimum interval - just update the stored temperature
+                                self.globals['trvc'][trvCtlrDevId]['temperatureRemotePreOffset'] = float(newTemp)
+                                self.globals['trvc'][trvCtlrDevId]['temperatureRemote'] = float(newTempPlusOffset)
+                                self.globals['trvc'][trvCtlrDevId]['temperature'] = float(newTempPlusOffset)
+                            elif origTemp != newTempPlusOffset:
                                 updateRequested = True
                                 updateList[UPDATE_REMOTE_TEMPERATURE] = newTemp  # Send through the original (non-offset) temperature
                                 updateLogItems[UPDATE_REMOTE_TEMPERATURE] = (
@@ -1499,8 +1674,7 @@ class Plugin(indigo.PluginBase):
                                     if self.globals['trvc'][trvCtlrDevId]['updateAllCsvFiles']:
                                         self.globals['queues']['trvHandler'].put([QUEUE_PRIORITY_LOW, 0, CMD_UPDATE_ALL_CSV_FILES, trvCtlrDevId, None])
                                     else:
-                                        self.globals['queues']['trvHandler'].put(
-                                            [QUEUE_PRIORITY_LOW, 0, CMD_UPDATE_CSV_FILE, trvCtlrDevId, ['temperatureRemote', newTempPlusOffset]])  # The offset temperature for the CSV file
+                                        self.globals['threads']['csvWriter']['thread'].addRow(trvCtlrDevId, 'temperatureRemote', newTempPlusOffset)  # The offset temperature for the CSV file
 
                             if self.globals['trvc'][trvCtlrDevId]['remoteSetpointHeatControl']:
                                 if float(newDev.heatSetpoint) != float(origDev.heatSetpoint):
@@ -1512,7 +1686,7 @@ class Plugin(indigo.PluginBase):
                                         if self.globals['trvc'][trvCtlrDevId]['updateAllCsvFiles']:
                                             self.globals['queues']['trvHandler'].put([QUEUE_PRIORITY_LOW, 0, CMD_UPDATE_ALL_CSV_FILES, trvCtlrDevId, None])
                                         else:
-                                            self.globals['queues']['trvHandler'].put([QUEUE_PRIORITY_LOW, 0, CMD_UPDATE_CSV_FILE, trvCtlrDevId, ['setpointHeatRemote', float(newDev.heatSetpoint)]])
+                                            self.globals['threads']['csvWriter']['thread'].addRow(trvCtlrDevId, 'setpointHeatRemote', float(newDev.heatSetpoint))
 
                             if newDev.protocol == indigo.kProtocol.ZWave:
                                 # Check if Z-Wave Event has been received
@@ -1590,7 +1764,10 @@ class Plugin(indigo.PluginBase):
 
                             # origTemp should already have had the offset applied - just need to add it to newTemp to ensure comparison is valid
 
-                            if origTemp != newTemp:
+                            if origTemp != newTemp and not self.temperatureBroadcastRequiresProcessing(trvCtlrDevId, 'Radiator', newTemp, newTemp):
+                                # Within deadband / minimum interval - just update the stored temperature
+                                self.globals['trvc'][trvCtlrDevId]['temperatureRadiator'] = float(newTemp)
+                            elif origTemp != newTemp:
                                 updateRequested = True
                                 updateList[UPDATE_RADIATOR_TEMPERATURE] = newTemp  # Send through the original (non-offset) temperature
                                 updateLogItems[UPDATE_RADIATOR_TEMPERATURE] = (
@@ -1599,8 +1776,7 @@ class Plugin(indigo.PluginBase):
                                     if self.globals['trvc'][trvCtlrDevId]['updateAllCsvFiles']:
                                         self.globals['queues']['trvHandler'].put([QUEUE_PRIORITY_LOW, 0, CMD_UPDATE_ALL_CSV_FILES, trvCtlrDevId, None])
                                     else:
-                                        self.globals['queues']['trvHandler'].put(
-                                            [QUEUE_PRIORITY_LOW, 0, CMD_UPDATE_CSV_FILE, trvCtlrDevId, ['temperatureradiator', newTemp]])  # The offset temperature for the CSV file
+                                        self.globals['threads']['csvWriter']['thread'].addRow(trvCtlrDevId, 'temperatureradiator', newTemp)  # The offset temperature for the CSV file
 
                             # if newDev.protocol == indigo.kProtocol.ZWave:
                             #     # Check if Z-Wave Event has been received
@@ -1733,13 +1909,112 @@ class Plugin(indigo.PluginBase):
             prefsConfigUiValues["disableHeatSourceDeviceListFilter"] = False
         if "delayQueueSeconds" not in prefsConfigUiValues:
             prefsConfigUiValues["delayQueueSeconds"] = 0
+        if "queueMetricsPublishMinutes" not in prefsConfigUiValues:
+            prefsConfigUiValues["queueMetricsPublishMinutes"] = 0
+        if "queueMetricsFileEnabled" not in prefsConfigUiValues:
+            prefsConfigUiValues["queueMetricsFileEnabled"] = False
+        if "queueLowLaneCapacity" not in prefsConfigUiValues:
+            prefsConfigUiValues["queueLowLaneCapacity"] = QUEUE_LOW_LANE_CAPACITY_DEFAULT
+        if "queueAgingSeconds" not in prefsConfigUiValues:
+            prefsConfigUiValues["queueAgingSeconds"] = QUEUE_AGING_SECONDS_DEFAULT
+        if "queueCoalesceCsvUpdates" not in prefsConfigUiValues:
+            prefsConfigUiValues["queueCoalesceCsvUpdates"] = True
+        if "timeSeriesEnabled" not in prefsConfigUiValues:
+            prefsConfigUiValues["timeSeriesEnabled"] = True
+        if "csvFlushSeconds" not in prefsConfigUiValues:
+            prefsConfigUiValues["csvFlushSeconds"] = CSV_FLUSH_SECONDS_DEFAULT
+        if "csvFsyncEnabled" not in prefsConfigUiValues:
+            prefsConfigUiValues["csvFsyncEnabled"] = False
+        if "csvDatabase" not in prefsConfigUiValues:
+            prefsConfigUiValues["csvDatabase"] = 'postgresql'
+        if "datagraphBucketingEnabled" not in prefsConfigUiValues:
+            prefsConfigUiValues["datagraphBucketingEnabled"] = False
+        if "datagraphPointBudget" not in prefsConfigUiValues:
+            prefsConfigUiValues["datagraphPointBudget"] = DATAGRAPH_POINT_BUDGET_DEFAULT
+        if "exportJobIntervalMinutes" not in prefsConfigUiValues:
+            prefsConfigUiValues["exportJobIntervalMinutes"] = EXPORT_JOB_INTERVAL_MINUTES_DEFAULT
+        if "exportJobWorkers" not in prefsConfigUiValues:
+            prefsConfigUiValues["exportJobWorkers"] = EXPORT_JOB_WORKERS_DEFAULT
+        if "exportOnNotifyEnabled" not in prefsConfigUiValues:
+            prefsConfigUiValues["exportOnNotifyEnabled"] = False
+        if "exportNotifyDebounceSeconds" not in prefsConfigUiValues:
+            prefsConfigUiValues["exportNotifyDebounceSeconds"] = EXPORT_NOTIFY_DEBOUNCE_SECONDS_DEFAULT
+        if "zwaveCaptureEnabled" not in prefsConfigUiValues:
+            prefsConfigUiValues["zwaveCaptureEnabled"] = False
+        if "zwaveCaptureFileMegabytes" not in prefsConfigUiValues:
+            prefsConfigUiValues["zwaveCaptureFileMegabytes"] = ZWAVE_CAPTURE_FILE_MEGABYTES_DEFAULT
+        if "zwaveCaptureFiles" not in prefsConfigUiValues:
+            prefsConfigUiValues["zwaveCaptureFiles"] = ZWAVE_CAPTURE_FILES_DEFAULT
+        if "heatSourceMinimumOnMinutes" not in prefsConfigUiValues:
+            prefsConfigUiValues["heatSourceMinimumOnMinutes"] = 0
+        if "heatSourceMinimumOffMinutes" not in prefsConfigUiValues:
+            prefsConfigUiValues["heatSourceMinimumOffMinutes"] = 0
 
         return prefsConfigUiValues
 
     def shutdown(self):
         self.logger.debug('Shutdown called')
 
-        self.logger.info('\'TRV Controller\' Plugin shutdown complete')
+        shutdownStartTime = time.time()
+        timersCancelled = 0
+        threadsNotStopped = list()
+
+        try:
+            # Wake the worker threads immediately rather than at their next queue timeout: set their stop events and queue a stop command
+            for threadName in ('trvHandler', 'delayHandler', 'watchdog', 'csvWriter', 'exportJob', 'exportListener'):
+                if 'event' in self.globals['threads'][threadName]:
+                    self.globals['threads'][threadName]['event'].set()
+            if self.globals['queues']['initialised']:
+                self.globals['queues']['trvHandler'].put([QUEUE_PRIORITY_STOP_THREAD, 0, CMD_STOP_THREAD, None, None])
+                self.globals['queues']['delayHandler'].put([CMD_STOP_THREAD, None])
+
+            # Stop the threads before the timers, as the TRV Handler creates timers while finishing its current command
+            shutdownDeadline = shutdownStartTime + SHUTDOWN_JOIN_TIMEOUT_SECONDS
+            for threadName in ('trvHandler', 'delayHandler', 'watchdog', 'csvWriter', 'exportJob', 'exportListener'):
+                thread = self.globals['threads'][threadName].get('thread', None)
+                if thread is not None and thread.ident is not None:
+                    thread.join(max(shutdownDeadline - time.time(), 0.0))
+                    if thread.is_alive():
+                        threadsNotStopped.append(threadName)
+
+            timersCancelled = self.cancelTimers(self.allTimers(), shutdownDeadline)
+
+            if self.globals['zwave']['capture'] is not None:
+                self.globals['zwave']['capture'].close()
+
+            self.globals['timeSeries'].close()
+            self.globals['historyDatabase'].close()
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+
+        if threadsNotStopped:
+            self.logger.warning(f'Thread(s) {", ".join(threadsNotStopped)} still running at the end of shutdown')
+        self.logger.info(f'\'TRV Controller\' Plugin shutdown complete in {(time.time() - shutdownStartTime) * 1000:.0f} ms [{timersCancelled} timers cancelled]')
+
+    def allTimers(self):
+        timers = list()
+        for group in list(self.globals['timers'].values()):
+            if isinstance(group, dict):
+                timers.extend(list(group.values()))
+            elif group is not None:
+                timers.append(group)
+        return timers
+
+    def cancelTimers(self, timers, joinDeadline=None):  # noqa - Method is not declared static
+
+        # Cancel timers, optionally waiting (until the deadline) for them to end - returns the number cancelled before they had run
+
+        timersCancelled = 0
+        for timer in timers:
+            if isinstance(timer, threading.Timer) and not timer.finished.is_set():
+                timer.cancel()
+                timersCancelled += 1
+        if joinDeadline is not None:
+            for timer in timers:
+                if isinstance(timer, threading.Timer) and timer.ident is not None and timer is not threading.current_thread():  # Only a started timer can be joined
+                    timer.join(max(joinDeadline - time.time(), 0.0))
+        return timersCancelled
 
     def startup(self):
         indigo.devices.subscribeToChanges()
@@ -1751,17 +2026,24 @@ class Plugin(indigo.PluginBase):
         indigo.zwave.subscribeToOutgoing()
 
         # Initialise dictionary to store internal details about the Z-wave Interpreter
+        zwiStartTime = time.time()
         self.globals[ZWI] = dict()
-        self.globals[ZWI][ZWI_INSTANCE] = ZwaveInterpreter(self.exception_handler, self.logger, indigo.devices)  # Instantiate and initialise Z-Wave Interpreter Object for this device
+        self.globals[ZWI][ZWI_INSTANCE] = ZwaveInterpreter(self.exception_handler, self.logger, indigo.devices, indigo.device.getGroupList)  # Instantiate and initialise Z-Wave Interpreter Object for this device
+        self.logger.info(f'Z-Wave Interpreter initialised in {(time.time() - zwiStartTime) * 1000:.1f} ms [Z-Wave node map is resolved on demand]')
 
         # TODO: remove this - 18-March-2022
         # ZwaveInterpreter(self.exception_handler, self.logger, indigo.devices)  # noqa [Defined outside __init__] Instantiate and initialise Z-Wave Interpreter Object
 
         # Create trvHandler process queue
-        self.globals['queues']['trvHandler'] = queue.PriorityQueue()  # Used to queue trvHandler commands
-        self.globals['queues']['delayHandler'] = queue.Queue()
+        self.globals['queues']['trvHandler'] = InstrumentedLanedQueue('trvHandler', commandIndex=2, lanes=QUEUE_LANES, sheddableCommands=QUEUE_SHEDDABLE_COMMANDS)  # Used to queue trvHandler commands: [Priority, Sequence, Command, Device, Data]
+        self.globals['queues']['delayHandler'] = InstrumentedQueue('delayHandler', commandIndex=0)  # [Command, Device]
+        self.configureTrvHandlerQueue()
         self.globals['queues']['initialised'] = True
 
+        self.globals['threads']['csvWriter']['event'] = threading.Event()
+        self.globals['threads']['csvWriter']['thread'] = ThreadCsvWriter(self.globals, self.globals['threads']['csvWriter']['event'])
+        self.globals['threads']['csvWriter']['thread'].start()
+
         self.globals['threads']['trvHandler']['event'] = threading.Event()
         self.globals['threads']['trvHandler']['thread'] = ThreadTrvHandler(self.globals, self.globals['threads']['trvHandler']['event'])
         # self.globals['threads']['trvHandler']['thread'].daemon = True
@@ -1772,6 +2054,22 @@ class Plugin(indigo.PluginBase):
         # self.globals['threads']['delayHandler']['thread'].daemon = True
         self.globals['threads']['delayHandler']['thread'].start()
 
+        self.globals['threads']['watchdog']['event'] = threading.Event()
+        self.globals['threads']['watchdog']['thread'] = ThreadWatchdog(self.globals, self.globals['threads']['watchdog']['event'])
+        self.globals['threads']['watchdog']['thread'].daemon = True
+        self.globals['threads']['watchdog']['thread'].start()
+
+        self.globals['threads']['exportJob']['event'] = threading.Event()
+        self.globals['threads']['exportJob']['thread'] = ThreadExportJob(self.globals, self.globals['threads']['exportJob']['event'], self.globals['threads']['trvHandler']['thread'])
+        self.globals['threads']['exportJob']['thread'].daemon = True  # A DataGraph render in progress doesn't hold up shutdown
+        self.globals['threads']['exportJob']['thread'].start()
+
+        self.globals['threads']['exportListener']['event'] = threading.Event()
+        self.globals['threads']['exportListener']['thread'] = ThreadExportListener(self.globals, self.globals['threads']['exportListener']['event'],
+                                                                                   self.globals['threads']['trvHandler']['thread'], self.globals['threads']['exportJob']['thread'])
+        self.globals['threads']['exportListener']['thread'].daemon = True
+        self.globals['threads']['exportListener']['thread'].start()
+
         try:
             secondsUntilSchedulesRestated = calculateSecondsUntilSchedulesRestated()
             self.globals['timers']['reStateSchedules'] = threading.Timer(float(secondsUntilSchedulesRestated), self.restateSchedulesTriggered, [secondsUntilSchedulesRestated])
@@ -1783,6 +2081,8 @@ class Plugin(indigo.PluginBase):
         except Exception as exception_error:
             self.exception_handler(exception_error, True)  # Log error and display failing statement
 
+        self.queueMetricsPublishTriggered(publish=False)  # Start the queue metrics publishing timer
+
         self.logger.info('\'TRV Controller\' initialization complete')
 
     def stopConcurrentThread(self):
@@ -2442,6 +2742,30 @@ class Plugin(indigo.PluginBase):
 
     def validatePrefsConfigUi(self, values_dict):   # noqa - Method is not declared static
 
+        # Integer text fields: (id, label, minimum, maximum or None)
+        integerFields = [('csvFlushSeconds', 'CSV Write Interval (seconds)', 1, None),
+                         ('datagraphPointBudget', 'DataGraph Point Budget', 1, None),
+                         ('exportJobWorkers', 'Export Workers', 1, EXPORT_JOB_WORKERS_MAXIMUM),
+                         ('exportNotifyDebounceSeconds', 'Export Delay (seconds)', 0, None)]
+
+        errorDict = indigo.Dict()
+        errorMessages = list()
+        for fieldId, fieldLabel, minimum, maximum in integerFields:
+            try:
+                value = int(values_dict.get(fieldId, minimum))
+                valid = value >= minimum and (maximum is None or value <= maximum)
+            except ValueError:
+                valid = False
+            if not valid:
+                if maximum is None:
+                    errorDict[fieldId] = f'{fieldLabel} must be an integer of at least {minimum}.'
+                else:
+                    errorDict[fieldId] = f'{fieldLabel} must be an integer between {minimum} and {maximum} (inclusive).'
+                errorMessages.append(errorDict[fieldId])
+        if errorMessages:
+            errorDict['showAlertText'] = '\n'.join(errorMessages)
+            return False, values_dict, errorDict
+
         return True, values_dict
 
     # noinspection PyUnusedLocal
@@ -2451,6 +2775,8 @@ class Plugin(indigo.PluginBase):
 
     def zwaveCommandReceived(self, zwave_command):
         try:
+            self.zwaveCaptureFrame(True, zwave_command)  # Before interpretation, which alters the command
+
             zwave_report_prefix = f"{u'':-{u'^'}22}> Z-WAVE "  # 22 dashes as first part of prefix
 
             now_time = indigo.server.getTime()
@@ -2576,6 +2902,8 @@ class Plugin(indigo.PluginBase):
     def zwaveCommandSent(self, zwave_command):
 
         try:
+            self.zwaveCaptureFrame(False, zwave_command)
+
             zwave_report_prefix = f"{u'':-{u'^'}22}> Z-WAVE "  # 22 dashes as first part of prefix
 
             now_time = indigo.server.getTime()
@@ -3059,6 +3387,267 @@ class Plugin(indigo.PluginBase):
         for dev in self.globals['devicesToTrvControllerTable'].items():
             self.logger.info(f"Device: {dev}")
 
+    # noinspection PyUnusedLocal
+    def processShowControlStatistics(self, valuesDict=None, typeId=''):
+
+        try:
+            reportLineLength = 80
+            report = f'\n{"=" * reportLineLength}'
+            report = report + self.boxLine('TRV Controller Plugin - Control Evaluation Statistics', reportLineLength, u'==')
+            report = report + self.boxLine(' ', reportLineLength, u'==')
+
+            totalEvaluations = 0
+            totalSkips = 0
+            for dev in indigo.devices.iter("self"):
+                if dev.id not in self.globals['trvc'] or 'controlEvaluations' not in self.globals['trvc'][dev.id]:
+                    continue
+                evaluations = self.globals['trvc'][dev.id]['controlEvaluations']
+                skips = self.globals['trvc'][dev.id]['controlSkips']
+                totalEvaluations += evaluations
+                totalSkips += skips
+                skipRate = (skips * 100.0 / evaluations) if evaluations > 0 else 0.0
+                report = report + self.boxLine(f'{dev.name}: {evaluations} requests, {skips} skipped [{skipRate:.1f}%]', reportLineLength, u'==')
+                for temperatureSource, sourceDevId in (('Remote', self.globals['trvc'][dev.id]['remoteDevId']), ('Radiator', self.globals['trvc'][dev.id]['radiatorDevId'])):
+                    if sourceDevId != 0:
+                        report = report + self.boxLine(f'  {temperatureSource} temperature broadcasts: {self.globals["trvc"][dev.id][f"temperatureBroadcastsProcessed{temperatureSource}"]} processed, '
+                                                       f'{self.globals["trvc"][dev.id][f"temperatureBroadcastsSuppressed{temperatureSource}"]} suppressed', reportLineLength, u'==')
+
+            totalSkipRate = (totalSkips * 100.0 / totalEvaluations) if totalEvaluations > 0 else 0.0
+            report = report + self.boxLine(' ', reportLineLength, u'==')
+            report = report + self.boxLine(f'Total: {totalEvaluations} requests, {totalSkips} skipped [{totalSkipRate:.1f}%]', reportLineLength, u'==')
+            report = report + self.boxLine(' ', reportLineLength, u'==')
+            report = report + f'\n{"=" * reportLineLength}\n'
+
+            self.logger.info(report)
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+
+    # noinspection PyUnusedLocal
+    def processShowHeatSources(self, valuesDict=None, typeId=''):
+
+        try:
+            reportLineLength = 80
+            report = f'\n{"=" * reportLineLength}'
+            report = report + self.boxLine('TRV Controller Plugin - Heat Sources', reportLineLength, u'==')
+            report = report + self.boxLine(' ', reportLineLength, u'==')
+            report = report + self.boxLine(f'Minimum On: {self.globals["config"]["heatSourceMinimumOnMinutes"]} minutes, Minimum Off: {self.globals["config"]["heatSourceMinimumOffMinutes"]} minutes', reportLineLength, u'==')
+
+            for heatSourceType, heatSources, heatSourceCollection in (('Device', self.globals['heaterDevices'], indigo.devices), ('Variable', self.globals['heaterVariables'], indigo.variables)):
+                for heatSourceId, heatSource in heatSources.items():
+                    onStateUi = 'ON' if heatSource.get('onState', HEAT_SOURCE_INITIALISE) == HEAT_SOURCE_ON else 'OFF' if heatSource.get('onState', HEAT_SOURCE_INITIALISE) == HEAT_SOURCE_OFF else 'Initialising'
+                    report = report + self.boxLine(' ', reportLineLength, u'==')
+                    report = report + self.boxLine(f'{heatSourceType}: {heatSourceCollection[heatSourceId].name}', reportLineLength, u'==')
+                    report = report + self.boxLine(f'  State: {onStateUi}, Thermostats calling for heat: {len(heatSource["thermostatsCallingForHeat"])}', reportLineLength, u'==')
+                    report = report + self.boxLine(f'  Demand transitions: {heatSource["demandTransitions"]}', reportLineLength, u'==')
+                    report = report + self.boxLine(f'  Commands issued: {heatSource["commandsIssued"]}, Commands suppressed: {heatSource["commandsSuppressed"]}', reportLineLength, u'==')
+                    if 'keepAlivesSkipped' in heatSource:
+                        report = report + self.boxLine(f'  Keep alive reminders skipped: {heatSource["keepAlivesSkipped"]}', reportLineLength, u'==')
+
+            report = report + self.boxLine(' ', reportLineLength, u'==')
+            report = report + f'\n{"=" * reportLineLength}\n'
+
+            self.logger.info(report)
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+
+    # noinspection PyUnusedLocal
+    def processShowQueueMetrics(self, valuesDict=None, typeId=''):
+
+        try:
+            reportLineLength = 80
+            report = f'\n{"=" * reportLineLength}'
+            report = report + self.boxLine('TRV Controller Plugin - Queue Metrics', reportLineLength, u'==')
+
+            for queueName in ('trvHandler', 'delayHandler'):
+                metrics = self.globals['queues'][queueName].metrics.snapshot(CMD_TRANSLATION)
+                report = report + self.boxLine(' ', reportLineLength, u'==')
+                report = report + self.boxLine(f'Queue: {queueName}', reportLineLength, u'==')
+                report = report + self.boxLine(f'  Enqueued: {metrics["enqueued"]}, Completed: {metrics["completed"]}, Throughput: {metrics["throughputPerMinute"]:.2f} per minute', reportLineLength, u'==')
+                depthByPriorityUi = ', '.join([f'{priority}: {depth}' for priority, depth in metrics['depthByPriority'].items()]) if metrics['depthByPriority'] else 'Empty'
+                report = report + self.boxLine(f'  Current depth: {metrics["depth"]} [{depthByPriorityUi}]', reportLineLength, u'==')
+                if metrics['discarded'] > 0:
+                    for reason, counts in sorted(metrics['discardedByReason'].items()):
+                        countsUi = ', '.join([f'{commandName}: {count}' for commandName, count in sorted(counts.items())])
+                        report = report + self.boxLine(f'  Discarded ({reason}): {sum(counts.values())} [{countsUi}]', reportLineLength, u'==')
+                if queueName == 'trvHandler':
+                    for lane in self.globals['queues'][queueName].laneStatistics():
+                        capacityUi = lane['capacity'] if lane['capacity'] > 0 else 'Unbounded'
+                        report = report + self.boxLine(f'  {lane["lane"]} lane: depth={lane["depth"]}, capacity={capacityUi}, aged={lane["promoted"]}, shed={lane["shed"]}, coalesced={lane["coalesced"]}',
+                                                       reportLineLength, u'==')
+                for commandName in sorted(set(metrics['wait'].keys()) | set(metrics['execute'].keys())):
+                    wait = metrics['wait'].get(commandName, None)
+                    execute = metrics['execute'].get(commandName, None)
+                    report = report + self.boxLine(f'  {commandName}:', reportLineLength, u'==')
+                    if wait is not None:
+                        report = report + self.boxLine(f'    Wait ms:    n={wait["count"]}, mean={wait["meanMs"]:.1f}, p95<={wait["p95Ms"]:.0f}, max={wait["maxMs"]:.1f}', reportLineLength, u'==')
+                    if execute is not None:
+                        report = report + self.boxLine(f'    Execute ms: n={execute["count"]}, mean={execute["meanMs"]:.1f}, p95<={execute["p95Ms"]:.0f}, max={execute["maxMs"]:.1f}', reportLineLength, u'==')
+
+            report = report + self.boxLine(' ', reportLineLength, u'==')
+            report = report + self.boxLine(f'Watchdog stalls (latest {WATCHDOG_STALL_HISTORY}):', reportLineLength, u'==')
+            if len(self.globals['watchdog']['stalls']) == 0:
+                report = report + self.boxLine('  None', reportLineLength, u'==')
+            for stall in self.globals['watchdog']['stalls']:
+                stallUi = CMD_TRANSLATION.get(stall['command'], str(stall['command'])) if stall['command'] is not None else 'Queue not serviced / thread ended'
+                report = report + self.boxLine(f'  {stall["time"]} {stall["thread"]}: {stallUi} [{stall["elapsedSeconds"]:.0f}s]', reportLineLength, u'==')
+
+            stateWrites = self.globals['stateWrites']
+            report = report + self.boxLine(' ', reportLineLength, u'==')
+            report = report + self.boxLine('TRV Controller state writes (TRV Handler):', reportLineLength, u'==')
+            report = report + self.boxLine(f'  Requested: {stateWrites["requested"]} [{stateWrites["keysRequested"]} states], Server round trips: {stateWrites["roundTrips"]} [{stateWrites["keysWritten"]} states]',
+                                           reportLineLength, u'==')
+            report = report + self.boxLine(f'  Unchanged states not written: {stateWrites["keysUnchanged"]}', reportLineLength, u'==')
+
+            timeSeriesStatistics = self.globals['timeSeries'].statistics()
+            report = report + self.boxLine(' ', reportLineLength, u'==')
+            report = report + self.boxLine('Time-series store:', reportLineLength, u'==')
+            report = report + self.boxLine(f'  Open rings: {timeSeriesStatistics["rings"]} [{timeSeriesStatistics["records"]} records, {timeSeriesStatistics["bytes"]:,} bytes mapped]',
+                                           reportLineLength, u'==')
+            report = report + self.boxLine(f'  Records appended: {timeSeriesStatistics["appends"]}', reportLineLength, u'==')
+
+            if self.globals['historyDatabase'].enabled:
+                historyStatistics = self.globals['historyDatabase'].statistics()
+                report = report + self.boxLine(' ', reportLineLength, u'==')
+                report = report + self.boxLine('SQLite history database:', reportLineLength, u'==')
+                report = report + self.boxLine(f'  Rows inserted: {historyStatistics["inserted"]} in {historyStatistics["batches"]} batches [{historyStatistics["pending"]} pending]',
+                                               reportLineLength, u'==')
+                report = report + self.boxLine(f'  Database size: {historyStatistics["bytes"]:,} bytes', reportLineLength, u'==')
+
+            if self.globals['config']['csvStandardEnabled']:
+                csvWriterStatistics = self.globals['threads']['csvWriter']['thread'].statistics()
+                report = report + self.boxLine(' ', reportLineLength, u'==')
+                report = report + self.boxLine('Standard CSV writer:', reportLineLength, u'==')
+                report = report + self.boxLine(f'  Files: {csvWriterStatistics["files"]}, Rows added: {csvWriterStatistics["updates"]} [{csvWriterStatistics["pending"]} pending]',
+                                               reportLineLength, u'==')
+                report = report + self.boxLine(f'  File writes: {csvWriterStatistics["writes"]}, Bytes written: {csvWriterStatistics["bytes"]:,}', reportLineLength, u'==')
+
+            if self.globals['config']['csvPostgresqlEnabled']:
+                renderStatistics = self.globals['datagraphRenders'].statistics()
+                report = report + self.boxLine(' ', reportLineLength, u'==')
+                report = report + self.boxLine(f'DataGraph renders: {renderStatistics["renders"]}, Skipped as unchanged: {renderStatistics["skipped"]}', reportLineLength, u'==')
+
+            if self.globals['config']['exportOnNotifyEnabled']:
+                listenerStatistics = self.globals['threads']['exportListener']['thread'].statistics()
+                report = report + self.boxLine(' ', reportLineLength, u'==')
+                report = report + self.boxLine('Export listener (PostgreSQL NOTIFY):', reportLineLength, u'==')
+                report = report + self.boxLine(f'  Tables with trigger: {listenerStatistics["listening"]}', reportLineLength, u'==')
+                report = report + self.boxLine(f'  Notifications: {listenerStatistics["notifications"]}, Exports requested: {listenerStatistics["exportsRequested"]}',
+                                               reportLineLength, u'==')
+
+            report = report + self.boxLine(' ', reportLineLength, u'==')
+            report = report + f'\n{"=" * reportLineLength}\n'
+
+            self.logger.info(report)
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+
+    # noinspection PyUnusedLocal
+    def processProfileHandlerThreads(self, valuesDict=None, typeId=''):
+
+        try:
+            profileSeconds = int(valuesDict.get('profileSeconds', 60))
+            profileMode = valuesDict.get('profileMode', PROFILE_MODE_SAMPLER)
+
+            threads = {threadName: self.globals['threads'][threadName].get('thread', None) for threadName in ('trvHandler', 'delayHandler')}
+            outputFolder = indigo.server.getLogsFolderPath(pluginId=self.globals['pluginInfo']['pluginId'])
+
+            if self.globals['profiler'].start(threads, profileSeconds, profileMode, outputFolder):
+                profileModeUi = 'cProfile and stack sampling' if profileMode == PROFILE_MODE_CPROFILE else 'stack sampling'
+                self.logger.info(f'Profiling TRV Handler and Delay Handler threads ({profileModeUi}) for {profileSeconds} seconds')
+            else:
+                self.logger.warning('Profiling of the handler threads is already in progress')
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+
+        return True
+
+    # noinspection PyUnusedLocal
+    def processShowMemoryReport(self, valuesDict=None, typeId=''):
+
+        try:
+            reportLineLength = 80
+            report = f'\n{"=" * reportLineLength}'
+            report = report + self.boxLine('TRV Controller Plugin - Memory Report', reportLineLength, u'==')
+            report = report + self.boxLine(' ', reportLineLength, u'==')
+
+            report = report + self.boxLine('Timers [live / dead]:', reportLineLength, u'==')
+            for groupName, (live, dead) in sorted(timerCounts(self.globals['timers']).items()):
+                report = report + self.boxLine(f'  {groupName}: {live} / {dead}', reportLineLength, u'==')
+            timersReleased, timersRemoved = pruneTimers(self.globals['timers'], lambda devId: devId in indigo.devices)
+            report = report + self.boxLine(f'  Dead timers pruned: {timersReleased} arguments released, {timersRemoved} for deleted devices removed', reportLineLength, u'==')
+
+            report = report + self.boxLine(' ', reportLineLength, u'==')
+            report = report + self.boxLine('Structure sizes (approximate):', reportLineLength, u'==')
+            for structureName in ('trvc', 'schedules', 'timers', 'heaterDevices', 'heaterVariables', 'zwave', 'devicesToTrvControllerTable'):
+                report = report + self.boxLine(f'  {structureName}: {len(self.globals[structureName])} entries, {deepSizeOf(self.globals[structureName]):,} bytes', reportLineLength, u'==')
+            for queueName in ('trvHandler', 'delayHandler'):
+                handlerQueue = self.globals['queues'][queueName]
+                with handlerQueue.mutex:
+                    queueBytes = deepSizeOf(handlerQueue.laneHeaps if queueName == 'trvHandler' else handlerQueue.queue)
+                    queueDepth = handlerQueue._qsize()  # noqa [Access to a protected member] - mutex already held
+                    queueStamps = len(handlerQueue.enqueueTimes)
+                report = report + self.boxLine(f'  {queueName} queue: {queueDepth} entries, {queueBytes:,} bytes [{queueStamps} metric stamps]', reportLineLength, u'==')
+            nodeMapReport = self.globals[ZWI][ZWI_INSTANCE].node_map_report()
+            report = report + self.boxLine(f'  Z-Wave node map: {nodeMapReport["cached_nodes"]} nodes, {nodeMapReport["node_map_bytes"]:,} bytes', reportLineLength, u'==')
+            report = report + self.boxLine(f'  Z-Wave address index: {nodeMapReport["indexed_nodes"]} nodes, {nodeMapReport["address_index_bytes"]:,} bytes', reportLineLength, u'==')
+
+            report = report + self.boxLine(' ', reportLineLength, u'==')
+            memoryGrowth = self.globals['memoryTracer'].snapshot()
+            if memoryGrowth is None:
+                report = report + self.boxLine('Memory tracing (tracemalloc) started and baseline taken.', reportLineLength, u'==')
+                report = report + self.boxLine('Show the Memory Report again later to see growth since the baseline.', reportLineLength, u'==')
+            else:
+                report = report + self.boxLine('Growth since baseline (tracemalloc):', reportLineLength, u'==')
+                for memoryGrowthLine in memoryGrowth:
+                    report = report + self.boxLine(f'  {memoryGrowthLine}', reportLineLength, u'==')
+
+            report = report + self.boxLine(' ', reportLineLength, u'==')
+            report = report + f'\n{"=" * reportLineLength}\n'
+
+            self.logger.info(report)
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+
+    # noinspection PyUnusedLocal
+    def processStopMemoryTracing(self, valuesDict=None, typeId=''):
+
+        try:
+            self.globals['memoryTracer'].stop()
+            self.logger.info('Memory tracing (tracemalloc) stopped and baseline discarded')
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+
+    # noinspection PyUnusedLocal
+    def processShowZwaveNodeMap(self, valuesDict=None, typeId=''):
+
+        try:
+            nodeMapReport = self.globals[ZWI][ZWI_INSTANCE].node_map_report()
+
+            reportLineLength = 80
+            report = f'\n{"=" * reportLineLength}'
+            report = report + self.boxLine('TRV Controller Plugin - Z-Wave Node Map', reportLineLength, u'==')
+            report = report + self.boxLine(' ', reportLineLength, u'==')
+            report = report + self.boxLine(f'Z-Wave nodes indexed: {nodeMapReport["indexed_nodes"]} [{nodeMapReport["indexed_devices"]} devices]', reportLineLength, u'==')
+            report = report + self.boxLine(f'Z-Wave nodes resolved and cached: {nodeMapReport["cached_nodes"]}', reportLineLength, u'==')
+            report = report + self.boxLine(f'Node resolutions: {nodeMapReport["nodes_resolved"]}, Invalidations: {nodeMapReport["nodes_invalidated"]}', reportLineLength, u'==')
+            report = report + self.boxLine(f'Index build time: {nodeMapReport["index_build_seconds"] * 1000:.1f} ms', reportLineLength, u'==')
+            report = report + self.boxLine(f'Total node resolve time: {nodeMapReport["resolve_seconds"] * 1000:.1f} ms', reportLineLength, u'==')
+            report = report + self.boxLine(f'Node map memory: {nodeMapReport["node_map_bytes"]:,} bytes', reportLineLength, u'==')
+            report = report + self.boxLine(f'Address index memory: {nodeMapReport["address_index_bytes"]:,} bytes', reportLineLength, u'==')
+            report = report + self.boxLine(' ', reportLineLength, u'==')
+            report = report + f'\n{"=" * reportLineLength}\n'
+
+            self.logger.info(report)
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+
     # noinspection PyUnusedLocal
     def processShowZwaveWakeupInterval(self, pluginAction):
 
@@ -3125,6 +3714,24 @@ class Plugin(indigo.PluginBase):
         except Exception as exception_error:
             self.exception_handler(exception_error, True)  # Log error and display failing statement
 
+    def processExportAllTrvControllers(self, valuesDict=None, typeId=''):
+
+        try:
+            if not self.globals['config']['csvPostgresqlEnabled']:
+                self.logger.error('Request to export all TRV Controllers ignored as option \'Enable PostgreSQL CSV\' not enabled in the plugin config.')
+                return
+
+            exportJobThread = self.globals['threads']['exportJob'].get('thread', None)
+            if exportJobThread is None or not exportJobThread.is_alive():
+                self.logger.error('Request to export all TRV Controllers ignored as the export job is not running.')
+                return
+
+            exportJobThread.requestRun()
+            self.logger.info('Export of all TRV Controllers requested - a summary is logged when it completes')
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+
     def processInvokeDatagraphUsingPostgresqlToCsv(self, pluginAction, trvCtlrDev):
 
         trvCtlrDevId = trvCtlrDev.id
@@ -3290,6 +3897,107 @@ class Plugin(indigo.PluginBase):
 
         self.globals['queues']['trvHandler'].put([QUEUE_PRIORITY_STATUS_MEDIUM, 0, CMD_DELAY_COMMAND, devId, [CMD_PROCESS_HEATING_SCHEDULE, 2.0, None]])
 
+    def queueMetricsPublishTriggered(self, publish=True):
+
+        # Publish the handler queue metrics to Indigo variables (in the TRV variable folder) and optionally to a metrics file in the plugin log folder
+
+        try:
+            publishMinutes = self.globals['config'].get('queueMetricsPublishMinutes', 0)
+
+            if publish and publishMinutes > 0:
+                snapshots = dict()
+                for queueName in ('trvHandler', 'delayHandler'):
+                    metrics = self.globals['queues'][queueName].metrics.snapshot(CMD_TRANSLATION)
+                    snapshots[queueName] = metrics
+
+                    if self.globals['config']['trvVariableFolderId'] != 0:
+                        waitCount = sum([wait['count'] for wait in metrics['wait'].values()])
+                        waitMeanMs = (sum([wait['count'] * wait['meanMs'] for wait in metrics['wait'].values()]) / waitCount) if waitCount > 0 else 0.0
+                        waitMaxMs = max([wait['maxMs'] for wait in metrics['wait'].values()], default=0.0)
+                        self.updateQueueMetricsVariable(f'{queueName}QueueDepth', metrics['depth'])
+                        self.updateQueueMetricsVariable(f'{queueName}QueueThroughput', f'{metrics["throughputPerMinute"]:.2f}')
+                        self.updateQueueMetricsVariable(f'{queueName}QueueWaitMeanMs', f'{waitMeanMs:.1f}')
+                        self.updateQueueMetricsVariable(f'{queueName}QueueWaitMaxMs', f'{waitMaxMs:.1f}')
+                        self.updateQueueMetricsVariable(f'{queueName}QueueShed', sum(metrics['discardedByReason'].get('shed', dict()).values()))
+
+                if self.globals['config'].get('queueMetricsFileEnabled', False):
+                    metricsFilePath = f'{indigo.server.getLogsFolderPath(pluginId=self.globals["pluginInfo"]["pluginId"])}/queueMetrics.json'
+                    with open(f'{metricsFilePath}.tmp', 'w') as metricsFile:
+                        json.dump(snapshots, metricsFile, indent=2)
+                    os.replace(f'{metricsFilePath}.tmp', metricsFilePath)  # Replace in one step so a reader never sees a partial file
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+
+        finally:
+            if not self.globals['threads']['trvHandler']['event'].is_set():  # Not re-armed once shutdown has started
+                publishSeconds = float(max(self.globals['config'].get('queueMetricsPublishMinutes', 0), 1) * 60)  # When not publishing, re-check the config every minute
+                self.globals['timers']['queueMetrics'] = threading.Timer(publishSeconds, self.queueMetricsPublishTriggered)
+                self.globals['timers']['queueMetrics'].daemon = True
+                self.globals['timers']['queueMetrics'].start()
+
+    def configureTrvHandlerQueue(self):
+
+        # Only the Low lane (CSV / graph work) is bounded - control and status commands are never dropped
+
+        self.globals['queues']['trvHandler'].configure(laneCapacities={QUEUE_LANE_LOW: self.globals['config'].get('queueLowLaneCapacity', QUEUE_LOW_LANE_CAPACITY_DEFAULT)},
+                                                       agingSeconds=self.globals['config'].get('queueAgingSeconds', QUEUE_AGING_SECONDS_DEFAULT),
+                                                       coalesce=self.globals['config'].get('queueCoalesceCsvUpdates', True))
+
+    def configureZwaveCapture(self):
+
+        # Start, restart (if the file limits have changed) or stop the capture of raw Z-Wave frames to the plugin log folder
+
+        zwaveCapture = self.globals['zwave']['capture']
+        maximumBytes = self.globals['config']['zwaveCaptureFileMegabytes'] * 1024 * 1024
+        fileCount = self.globals['config']['zwaveCaptureFiles']
+
+        if zwaveCapture is not None:
+            if self.globals['config']['zwaveCaptureEnabled'] and zwaveCapture.maximumBytes == maximumBytes and zwaveCapture.fileCount == fileCount:
+                return
+            self.globals['zwave']['capture'] = None
+            zwaveCapture.close()
+            self.logger.info(f'Z-Wave frame capture stopped: {zwaveCapture.framesCaptured} frames, {zwaveCapture.bytesWritten:,} bytes written [{zwaveCapture.rotations} file rotations]')
+
+        if self.globals['config']['zwaveCaptureEnabled']:
+            captureFilePath = f'{indigo.server.getLogsFolderPath(pluginId=self.globals["pluginInfo"]["pluginId"])}/{ZWAVE_CAPTURE_FILE_NAME}'
+            self.globals['zwave']['capture'] = ZwaveFrameCapture(captureFilePath, maximumBytes, fileCount)
+            self.logger.info(f'Z-Wave frame capture started: \'{captureFilePath}\' [{fileCount} files of up to {self.globals["config"]["zwaveCaptureFileMegabytes"]} MB]')
+
+    def zwaveCaptureFrame(self, received, zwave_command):
+
+        # Capture a raw Z-Wave frame (if enabled). A frame that can't be written (e.g. disk full) stops the capture, logged once, rather
+        # than failing every following frame's interpretation
+
+        zwaveCapture = self.globals['zwave']['capture']
+        if zwaveCapture is None:
+            return
+        try:
+            zwaveCapture.capture(received, zwave_command)
+        except Exception as exception_error:
+            if self.globals['zwave']['capture'] is zwaveCapture:
+                self.globals['zwave']['capture'] = None
+            try:
+                closedNow = zwaveCapture.close()
+            except Exception:  # noqa - the file couldn't be flushed either, but it is closed
+                closedNow = True
+            if closedNow:
+                self.logger.error(f'Z-Wave frame capture stopped as a frame could not be written: {exception_error}')
+
+    def updateQueueMetricsVariable(self, variableName, value):
+
+        # Update the named variable in the TRV variable folder - a variable of the same name in another folder is left alone
+
+        folderId = self.globals['config']['trvVariableFolderId']
+        variableId = self.globals['queueMetricsVariableIds'].get(variableName, 0)
+        if variableId not in indigo.variables or indigo.variables[variableId].folderId != folderId:
+            variableId = next((var.id for var in indigo.variables.iter() if var.folderId == folderId and var.name == variableName), 0)
+        if variableId != 0:
+            indigo.variable.updateValue(variableId, value=str(value))
+        else:
+            variableId = indigo.variable.create(variableName, value=str(value), folder=folderId).id
+        self.globals['queueMetricsVariableIds'][variableName] = variableId
+
     def remoteThermostatDevices(self, indigo_filter="", valuesDict=None, typeId="", targetId=0):   # noqa - Method is not declared static + unused local symbols
 
         array = []
@@ -3341,6 +4049,9 @@ class Plugin(indigo.PluginBase):
         try:
             self.globals['queues']['trvHandler'].put([QUEUE_PRIORITY_STATUS_HIGH, 0, CMD_RESTATE_SCHEDULES, None, None])
 
+            timersReleased, timersRemoved = pruneTimers(self.globals['timers'], lambda devId: devId in indigo.devices)  # Daily housekeeping of dead timer handles
+            self.logger.debug(f'Dead timers pruned: {timersReleased} had their arguments released, {timersRemoved} for deleted devices removed')
+
             secondsUntilSchedulesRestated = calculateSecondsUntilSchedulesRestated()
             self.globals['timers']['reStateSchedules'] = threading.Timer(float(secondsUntilSchedulesRestated), self.restateSchedulesTriggered, [secondsUntilSchedulesRestated])
             self.globals['timers']['reStateSchedules'].daemon = True
@@ -3351,6 +4062,82 @@ class Plugin(indigo.PluginBase):
         except Exception as exception_error:
             self.exception_handler(exception_error, True)  # Log error and display failing statement
 
+    def temperatureBroadcastRequiresProcessing(self, trvCtlrDevId, temperatureSource, temperature, updateValue):
+
+        # Decide whether a Remote / Radiator temperature broadcast should be processed in full (state update, CSV update and TRV control)
+        # or is within the TRV Controller's deadband / minimum interval of the last processed broadcast and so should only be stored.
+        # A broadcast outside the deadband that is suppressed by the minimum interval isn't lost: the latest such broadcast is processed
+        # when the interval ends (trailing edge), unless a later broadcast has been processed or has come back within the deadband.
+
+        try:
+            lastTemperature = self.globals['trvc'][trvCtlrDevId][f'temperatureBroadcastLastProcessed{temperatureSource}']
+            lastTime = self.globals['trvc'][trvCtlrDevId][f'temperatureBroadcastLastProcessedTime{temperatureSource}']
+            now = time.time()
+
+            if lastTemperature is not None:
+                withinDeadband = abs(float(temperature) - lastTemperature) < self.globals['trvc'][trvCtlrDevId]['temperatureBroadcastDeadband']
+                if withinDeadband or (now - lastTime) < self.globals['trvc'][trvCtlrDevId]['temperatureBroadcastMinimumInterval']:
+                    self.globals['trvc'][trvCtlrDevId][f'temperatureBroadcastsSuppressed{temperatureSource}'] += 1
+                    if withinDeadband:
+                        self.globals['trvc'][trvCtlrDevId][f'temperatureBroadcastPending{temperatureSource}'] = None
+                    else:
+                        self.globals['trvc'][trvCtlrDevId][f'temperatureBroadcastPending{temperatureSource}'] = (float(temperature), updateValue)
+                        timers = self.globals['timers'][f'temperatureBroadcast{temperatureSource}']
+                        if trvCtlrDevId not in timers or timers[trvCtlrDevId].finished.is_set():
+                            deferSeconds = lastTime + self.globals['trvc'][trvCtlrDevId]['temperatureBroadcastMinimumInterval'] - now
+                            timers[trvCtlrDevId] = threading.Timer(deferSeconds, self.temperatureBroadcastDeferredTriggered, [trvCtlrDevId, temperatureSource])
+                            timers[trvCtlrDevId].daemon = True
+                            timers[trvCtlrDevId].start()
+                    return False
+
+            self.globals['trvc'][trvCtlrDevId][f'temperatureBroadcastPending{temperatureSource}'] = None
+            self.globals['trvc'][trvCtlrDevId][f'temperatureBroadcastLastProcessed{temperatureSource}'] = float(temperature)
+            self.globals['trvc'][trvCtlrDevId][f'temperatureBroadcastLastProcessedTime{temperatureSource}'] = now
+            self.globals['trvc'][trvCtlrDevId][f'temperatureBroadcastsProcessed{temperatureSource}'] += 1
+            return True
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+            return True
+
+    def temperatureBroadcastDeferredTriggered(self, trvCtlrDevId, temperatureSource):
+
+        # The minimum interval since the last processed broadcast has ended - process the latest broadcast it suppressed, as deviceUpdated would have
+
+        try:
+            if trvCtlrDevId not in self.globals['trvc'] or not self.globals['trvc'][trvCtlrDevId].get('deviceStarted', False):
+                return
+            pending = self.globals['trvc'][trvCtlrDevId][f'temperatureBroadcastPending{temperatureSource}']
+            if pending is None:
+                return  # Superseded by a processed broadcast, or back within the deadband
+            temperature, updateValue = pending
+
+            self.globals['trvc'][trvCtlrDevId][f'temperatureBroadcastPending{temperatureSource}'] = None
+            self.globals['trvc'][trvCtlrDevId][f'temperatureBroadcastLastProcessed{temperatureSource}'] = temperature
+            self.globals['trvc'][trvCtlrDevId][f'temperatureBroadcastLastProcessedTime{temperatureSource}'] = time.time()
+            self.globals['trvc'][trvCtlrDevId][f'temperatureBroadcastsProcessed{temperatureSource}'] += 1
+            self.globals['trvc'][trvCtlrDevId][f'temperatureBroadcastsDeferred{temperatureSource}'] += 1
+
+            updateList = dict()
+            if temperatureSource == 'Remote':
+                queuedCommand = CMD_UPDATE_REMOTE_STATES
+                updateList[UPDATE_REMOTE_TEMPERATURE] = updateValue  # The original (non-offset) temperature
+                csvStateName = 'temperatureRemote'
+            else:
+                queuedCommand = CMD_UPDATE_RADIATOR_STATES
+                updateList[UPDATE_RADIATOR_TEMPERATURE] = updateValue
+                csvStateName = 'temperatureradiator'  # As deviceUpdated names the Radiator CSV file
+            self.globals['queues']['trvHandler'].put([QUEUE_PRIORITY_STATUS_MEDIUM, self.globals['deviceUpdatedSequenceCount'], queuedCommand, trvCtlrDevId, [updateList, ]])
+
+            if self.globals['trvc'][trvCtlrDevId]['updateCsvFile']:
+                if self.globals['trvc'][trvCtlrDevId]['updateAllCsvFiles']:
+                    self.globals['queues']['trvHandler'].put([QUEUE_PRIORITY_LOW, 0, CMD_UPDATE_ALL_CSV_FILES, trvCtlrDevId, None])
+                else:
+                    self.globals['threads']['csvWriter']['thread'].addRow(trvCtlrDevId, csvStateName, temperature)
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+
     # noinspection PyUnusedLocal
     def trvControlledDevices(self, indigo_filter="", valuesDict=None, typeId="", targetId=0): # noqa
         array = []
@@ -0,0 +1,192 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Profiler © Autolog 2022
+#
+
+import collections
+import cProfile
+import datetime
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+
+PROFILE_MODE_SAMPLER = 'sampler'
+PROFILE_MODE_CPROFILE = 'cprofile'
+
+PROFILE_SAMPLE_INTERVAL_SECONDS = 0.01
+PROFILE_CPROFILE_STOP_TIMEOUT_SECONDS = 30.0  # Handler threads only stop their cProfile at their next checkpoint (at most one queue timeout)
+PROFILE_TOP_FUNCTIONS = 40
+
+
+# noinspection PyPep8Naming
+class HandlerProfiler:
+
+    # On demand profiling of the handler threads for a fixed period.
+    #
+    # A sampler thread records the stack of each handler thread every PROFILE_SAMPLE_INTERVAL_SECONDS, which is written as a collapsed
+    # stack file (one 'frame;frame;frame count' line per distinct stack - the input format for flame graph tools) plus a summary of the
+    # functions seen most often. In cProfile mode each handler thread also runs cProfile on itself: cProfile can only profile the thread
+    # that enables it, so the handler threads call checkpoint() once per loop to start and stop it. The combined pstats are dumped and
+    # written sorted by cumulative time.
+    #
+    # When not profiling, the only cost is the attribute test at the start of checkpoint().
+
+    def __init__(self):
+        self.logger = logging.getLogger("Plugin.Profiler")
+        self.lock = threading.Lock()
+        self.active = False
+        self.profiling = False  # True while handler threads are to run (or are running) cProfile
+        self.endTime = 0.0
+        self.threadProfiles = dict()  # threadName -> cProfile.Profile being run by that thread
+        self.completedProfiles = dict()  # threadName -> cProfile.Profile that has been stopped
+
+    def checkpoint(self, threadName):
+        # Called by each handler thread at the start of its processing loop
+
+        if not self.profiling:
+            return
+
+        with self.lock:
+            if time.time() < self.endTime:
+                if threadName not in self.threadProfiles and threadName not in self.completedProfiles:
+                    threadProfile = cProfile.Profile()
+                    self.threadProfiles[threadName] = threadProfile
+                    threadProfile.enable()
+            elif threadName in self.threadProfiles:
+                threadProfile = self.threadProfiles.pop(threadName)
+                threadProfile.disable()
+                self.completedProfiles[threadName] = threadProfile
+
+    def start(self, threads, durationSeconds, mode, outputFolder):
+        # threads: {threadName: threading.Thread} - returns False if a profile is already running
+
+        with self.lock:
+            if self.active:
+                return False
+            self.active = True
+            self.endTime = time.time() + durationSeconds
+            self.threadProfiles = dict()
+            self.completedProfiles = dict()
+            self.profiling = mode == PROFILE_MODE_CPROFILE
+
+        samplerThread = threading.Thread(target=self.sample, args=(dict(threads), durationSeconds, mode, outputFolder), name='TRV_Profiler')
+        samplerThread.daemon = True
+        samplerThread.start()
+        return True
+
+    def sample(self, threads, durationSeconds, mode, outputFolder):
+
+        try:
+            threadNames = {thread.ident: threadName for threadName, thread in threads.items() if thread is not None and thread.ident is not None}
+            collapsedStacks = collections.Counter()
+            sampleCount = 0
+
+            while time.time() < self.endTime:
+                currentFrames = sys._current_frames()  # noqa [Access to a protected member] - The only way to see other threads' stacks
+                for threadIdent, threadName in threadNames.items():
+                    frame = currentFrames.get(threadIdent, None)
+                    if frame is not None:
+                        collapsedStacks[collapseStack(threadName, frame)] += 1
+                del currentFrames
+                sampleCount += 1
+                time.sleep(PROFILE_SAMPLE_INTERVAL_SECONDS)
+
+            fileNamePrefix = f'{outputFolder}/profile_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}'
+            filesWritten = list()
+
+            with open(f'{fileNamePrefix}_collapsed.txt', 'w') as collapsedFile:
+                for stack, count in sorted(collapsedStacks.items()):
+                    collapsedFile.write(f'{stack} {count}\n')
+            filesWritten.append(f'{fileNamePrefix}_collapsed.txt')
+
+            with open(f'{fileNamePrefix}_samples.txt', 'w') as samplesFile:
+                samplesFile.write(sampleSummary(collapsedStacks, sampleCount, durationSeconds))
+            filesWritten.append(f'{fileNamePrefix}_samples.txt')
+
+            if mode == PROFILE_MODE_CPROFILE:
+                stopTimeout = time.time() + PROFILE_CPROFILE_STOP_TIMEOUT_SECONDS
+                while time.time() < stopTimeout:
+                    with self.lock:
+                        if not self.threadProfiles:
+                            break
+                    time.sleep(0.1)
+
+                with self.lock:
+                    self.profiling = False
+                    completedProfiles = dict(self.completedProfiles)
+                    unstoppedThreadNames = list(self.threadProfiles.keys())
+
+                if unstoppedThreadNames:
+                    self.logger.warning(f'Profile of thread(s) {", ".join(unstoppedThreadNames)} not stopped within {PROFILE_CPROFILE_STOP_TIMEOUT_SECONDS:.0f} seconds and not included')
+
+                if completedProfiles:
+                    profileStats = None
+                    for threadProfile in completedProfiles.values():
+                        if profileStats is None:
+                            profileStats = pstats.Stats(threadProfile)
+                        else:
+                            profileStats.add(threadProfile)
+                    profileStats.dump_stats(f'{fileNamePrefix}.pstats')
+                    filesWritten.append(f'{fileNamePrefix}.pstats')
+
+                    statsOutput = io.StringIO()
+                    profileStats.stream = statsOutput
+                    statsOutput.write(f'cProfile of thread(s) {", ".join(sorted(completedProfiles.keys()))} for {durationSeconds} seconds\n')
+                    profileStats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TOP_FUNCTIONS)
+                    profileStats.sort_stats(pstats.SortKey.TIME).print_stats(PROFILE_TOP_FUNCTIONS)
+                    with open(f'{fileNamePrefix}_pstats.txt', 'w') as pstatsFile:
+                        pstatsFile.write(statsOutput.getvalue())
+                    filesWritten.append(f'{fileNamePrefix}_pstats.txt')
+
+            filesWrittenUi = '\n'.join([f'  {os.path.basename(fileWritten)}' for fileWritten in filesWritten])
+            self.logger.info(f'Profile of handler threads completed: {sampleCount} samples over {durationSeconds} seconds. Files written to \'{outputFolder}\':\n{filesWrittenUi}')
+
+        except Exception as exception_error:
+            self.logger.error(f'Profile of handler threads failed: {exception_error}')
+
+        finally:
+            with self.lock:
+                self.profiling = False
+                self.threadProfiles = dict()
+                self.completedProfiles = dict()
+                self.active = False
+
+
+# noinspection PyPep8Naming
+def collapseStack(threadName, frame):
+    # 'threadName;file:function;file:function ...' from outermost to innermost frame
+
+    frames = list()
+    while frame is not None:
+        frames.append(f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}')
+        frame = frame.f_back
+    frames.append(threadName)
+    return ';'.join(reversed(frames)).replace(' ', '_')
+
+
+# noinspection PyPep8Naming
+def sampleSummary(collapsedStacks, sampleCount, durationSeconds):
+    # Functions ranked by the number of samples in which they were running (self) or on the stack (inclusive)
+
+    selfSamples = collections.Counter()
+    inclusiveSamples = collections.Counter()
+    for stack, count in collapsedStacks.items():
+        frames = stack.split(';')
+        selfSamples[frames[-1]] += count
+        for frame in set(frames[1:]):
+            inclusiveSamples[frame] += count
+
+    totalSamples = max(sum(collapsedStacks.values()), 1)
+    summary = f'{sampleCount} samples of handler thread stacks over {durationSeconds} seconds (every {PROFILE_SAMPLE_INTERVAL_SECONDS * 1000:.0f} ms)\n'
+    summary = summary + f'\nTop {PROFILE_TOP_FUNCTIONS} functions by self samples:\n'
+    for frame, count in selfSamples.most_common(PROFILE_TOP_FUNCTIONS):
+        summary = summary + f'  {count:>8} {count * 100.0 / totalSamples:>6.1f}%  {frame}\n'
+    summary = summary + f'\nTop {PROFILE_TOP_FUNCTIONS} functions by inclusive samples:\n'
+    for frame, count in inclusiveSamples.most_common(PROFILE_TOP_FUNCTIONS):
+        summary = summary + f'  {count:>8} {count * 100.0 / totalSamples:>6.1f}%  {frame}\n'
+    return summary
@@ -0,0 +1,178 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Queue Metrics © Autolog 2022
+#
+
+import queue
+import threading
+import time
+
+# Histogram bucket upper bounds in milliseconds - the final bucket catches everything above the last bound
+HISTOGRAM_BUCKET_BOUNDS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+
+# noinspection PyPep8Naming
+class Histogram:
+
+    # Fixed bucket histogram of durations (recorded in seconds, bucketed in milliseconds)
+
+    def __init__(self):
+        self.buckets = [0] * (len(HISTOGRAM_BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.totalSeconds = 0.0
+        self.maximumSeconds = 0.0
+
+    def record(self, seconds):
+        milliseconds = seconds * 1000.0
+        bucketIndex = len(HISTOGRAM_BUCKET_BOUNDS_MS)
+        for index, bound in enumerate(HISTOGRAM_BUCKET_BOUNDS_MS):
+            if milliseconds <= bound:
+                bucketIndex = index
+                break
+        self.buckets[bucketIndex] += 1
+        self.count += 1
+        self.totalSeconds += seconds
+        if seconds > self.maximumSeconds:
+            self.maximumSeconds = seconds
+
+    def meanMilliseconds(self):
+        return (self.totalSeconds * 1000.0 / self.count) if self.count > 0 else 0.0
+
+    def percentileMilliseconds(self, percentile):
+        # Upper bound of the bucket containing the requested percentile, but never more than the maximum observed (which it is if in the overflow bucket)
+        if self.count == 0:
+            return 0.0
+        target = self.count * percentile / 100.0
+        runningCount = 0
+        for index, bucketCount in enumerate(self.buckets):
+            runningCount += bucketCount
+            if runningCount >= target:
+                if index < len(HISTOGRAM_BUCKET_BOUNDS_MS):
+                    return min(float(HISTOGRAM_BUCKET_BOUNDS_MS[index]), self.maximumSeconds * 1000.0)
+                break
+        return self.maximumSeconds * 1000.0
+
+    def summary(self):
+        return {'count': self.count,
+                'meanMs': round(self.meanMilliseconds(), 3),
+                'p95Ms': self.percentileMilliseconds(95),
+                'maxMs': round(self.maximumSeconds * 1000.0, 3),
+                'buckets': dict(zip([f'<={bound}' for bound in HISTOGRAM_BUCKET_BOUNDS_MS] + [f'>{HISTOGRAM_BUCKET_BOUNDS_MS[-1]}'], self.buckets))}
+
+
+# noinspection PyPep8Naming
+class QueueMetrics:
+
+    # Wait / execution histograms per command type, depth per priority and throughput for a handler queue
+
+    def __init__(self, queueName):
+        self.queueName = queueName
+        self.lock = threading.Lock()
+        self.startTime = time.time()
+        self.enqueuedCount = 0
+        self.completedCount = 0
+        self.discardedCount = 0  # Entries removed from the queue without being run (shed or coalesced)
+        self.discardedByReason = dict()  # e.g. {'shed': {command: count}, 'coalesced': {command: count}}
+        self.depthByPriority = dict()
+        self.waitHistograms = dict()
+        self.executeHistograms = dict()
+
+    def enqueued(self, priority):
+        with self.lock:
+            self.enqueuedCount += 1
+            self.depthByPriority[priority] = self.depthByPriority.get(priority, 0) + 1
+
+    def dequeued(self, priority, command, waitSeconds):
+        with self.lock:
+            self.depthByPriority[priority] = self.depthByPriority.get(priority, 1) - 1
+            if command not in self.waitHistograms:
+                self.waitHistograms[command] = Histogram()
+            self.waitHistograms[command].record(waitSeconds)
+
+    def discarded(self, priority, command, reason):
+        with self.lock:
+            self.discardedCount += 1
+            self.depthByPriority[priority] = self.depthByPriority.get(priority, 1) - 1
+            if reason not in self.discardedByReason:
+                self.discardedByReason[reason] = dict()
+            self.discardedByReason[reason][command] = self.discardedByReason[reason].get(command, 0) + 1
+
+    def outstanding(self):
+        # Entries enqueued but not yet run or discarded (includes an entry being run)
+        with self.lock:
+            return self.enqueuedCount - self.completedCount - self.discardedCount
+
+    def executed(self, command, executeSeconds):
+        with self.lock:
+            self.completedCount += 1
+            if command not in self.executeHistograms:
+                self.executeHistograms[command] = Histogram()
+            self.executeHistograms[command].record(executeSeconds)
+
+    def throughputPerMinute(self):
+        elapsedSeconds = time.time() - self.startTime
+        return (self.completedCount * 60.0 / elapsedSeconds) if elapsedSeconds > 0.0 else 0.0
+
+    def snapshot(self, commandTranslation=None):
+        # Point in time copy of the metrics - command types are translated to names if a translation table is supplied
+
+        def commandName(command):
+            if commandTranslation is not None and command in commandTranslation:
+                return commandTranslation[command]
+            return str(command)
+
+        with self.lock:
+            return {'queue': self.queueName,
+                    'time': time.time(),
+                    'uptimeSeconds': round(time.time() - self.startTime, 1),
+                    'enqueued': self.enqueuedCount,
+                    'completed': self.completedCount,
+                    'discarded': self.discardedCount,
+                    'depth': sum(self.depthByPriority.values()),
+                    'depthByPriority': {str(priority): depth for priority, depth in sorted(self.depthByPriority.items()) if depth > 0},
+                    'throughputPerMinute': round(self.throughputPerMinute(), 2),
+                    'wait': {commandName(command): histogram.summary() for command, histogram in self.waitHistograms.items()},
+                    'execute': {commandName(command): histogram.summary() for command, histogram in self.executeHistograms.items()},
+                    'discardedByReason': {reason: {commandName(command): count for command, count in counts.items()} for reason, counts in self.discardedByReason.items()}}
+
+
+# noinspection PyPep8Naming
+class InstrumentedQueueMixin:
+
+    # Stamps every entry at enqueue and records its queue wait at dequeue. Entries are left unchanged, so existing producers and consumers
+    # are unaffected. _put / _get are always called with the queue mutex held.
+
+    def initialiseMetrics(self, queueName, commandIndex, priorityIndex):
+        self.metrics = QueueMetrics(queueName)
+        self.commandIndex = commandIndex
+        self.priorityIndex = priorityIndex
+        self.enqueueTimes = dict()
+
+    def entryPriority(self, item):
+        return item[self.priorityIndex] if self.priorityIndex is not None else 0
+
+    def _put(self, item):
+        self.enqueueTimes[id(item)] = time.time()
+        self.metrics.enqueued(self.entryPriority(item))
+        super()._put(item)
+
+    def discardEntry(self, item, reason):
+        # For queues that drop entries without them being dequeued e.g. shedding or coalescing
+        self.enqueueTimes.pop(id(item), None)
+        self.metrics.discarded(self.entryPriority(item), item[self.commandIndex], reason)
+
+    def _get(self):
+        item = super()._get()
+        enqueueTime = self.enqueueTimes.pop(id(item), None)
+        waitSeconds = (time.time() - enqueueTime) if enqueueTime is not None else 0.0
+        self.metrics.dequeued(self.entryPriority(item), item[self.commandIndex], waitSeconds)
+        return item
+
+
+# noinspection PyPep8Naming
+class InstrumentedQueue(InstrumentedQueueMixin, queue.Queue):
+
+    def __init__(self, queueName, commandIndex, priorityIndex=None):
+        queue.Queue.__init__(self)
+        self.initialiseMetrics(queueName, commandIndex, priorityIndex)
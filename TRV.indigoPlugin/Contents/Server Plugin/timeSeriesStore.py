@@ -0,0 +1,390 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Time Series Store © Autolog 2022
+#
+
+import mmap
+import os
+import shutil
+import struct
+import sys
+import threading
+import time
+
+TIME_SERIES_FILE_EXTENSION = 'ring'
+TIME_SERIES_RECORDS_PER_HOUR = 360  # Ring capacity per hour of retention - an average of one change every 10 seconds
+TIME_SERIES_MINIMUM_RECORDS = 1024
+TIME_SERIES_EXPORT_MAXIMUM_POINTS = 2000  # Exports use the finest resolution that gives no more than this many points per state
+
+# Rollup resolutions as (seconds, minimum retention hours). A rollup is kept for its minimum retention or the TRV Controller's retention
+# period if longer.
+TIME_SERIES_ROLLUPS = ((60, 48), (900, 35 * 24), (3600, 400 * 24))
+TIME_SERIES_RAW = 0  # Resolution of the raw (unrolled) records
+
+# File layout: RING_HEADER, then 'capacity' records. Records are in time order from the oldest, at physical index (head - count) % capacity.
+# The first field of every record is its timestamp.
+RING_MAGIC = b'TRVTSR\x01\x00'
+RING_HEADER = struct.Struct('<8sQQQ')  # magic, capacity, head (next physical index to write), count
+RING_POSITION = struct.Struct('<QQ')  # head, count - the part of the header updated by each append
+RING_POSITION_OFFSET = 16
+RECORD = struct.Struct('<dd')  # timestamp (seconds since the epoch), value
+ROLLUP_RECORD = struct.Struct('<dffffI')  # bucket start time, minimum, maximum, mean, last, sample count
+RECORD_TIMESTAMP = struct.Struct('<d')
+RING_MMAP_OPTIONS = {'trackfd': False} if sys.version_info >= (3, 13) else dict()  # mmap otherwise keeps a duplicate of the file descriptor
+
+# Rollup record fields
+ROLLUP_MINIMUM = 1
+ROLLUP_MAXIMUM = 2
+ROLLUP_MEAN = 3
+ROLLUP_LAST = 4
+ROLLUP_COUNT = 5
+
+
+# noinspection PyPep8Naming
+class RingFile:
+
+    # Fixed-width records (by default (timestamp, value)) in a memory-mapped ring file. Appends are O(1): the record is written at the head
+    # and the head / count in the header updated. Once full, each append overwrites the oldest record. Timestamps never go backwards (an
+    # earlier timestamp is recorded as the latest one), so a time range can be found by binary search.
+
+    def __init__(self, filePath, capacity, record=RECORD):
+        self.lock = threading.Lock()
+        self.filePath = filePath
+        self.capacity = capacity
+        self.record = record
+        self.head = 0
+        self.count = 0
+        self.ringMap = None
+
+        if os.path.exists(filePath) and self.existingCapacity(filePath, record) == capacity:
+            self.map()
+            return
+
+        existingRecords = self.readExisting(filePath, record) if os.path.exists(filePath) else None
+
+        # New file (or a resize) - records kept from a previous file are written back, newest last
+        with open(filePath, 'wb') as newFile:
+            newFile.truncate(RING_HEADER.size + capacity * record.size)
+        self.map()
+        self.ringMap[0:RING_HEADER.size] = RING_HEADER.pack(RING_MAGIC, capacity, 0, 0)
+        if existingRecords is not None:
+            for existingRecord in existingRecords[1][-capacity:]:
+                self.append(existingRecord)
+
+    @staticmethod
+    def existingCapacity(filePath, record):
+        # Capacity of an existing, complete ring file from its header alone, or None if it isn't one
+        try:
+            with open(filePath, 'rb') as existingFile:
+                magic, capacity, head, count = RING_HEADER.unpack(existingFile.read(RING_HEADER.size))
+            if magic != RING_MAGIC or head >= max(capacity, 1) or count > capacity or os.path.getsize(filePath) < RING_HEADER.size + capacity * record.size:
+                return None
+            return capacity
+        except (OSError, struct.error):
+            return None
+
+    @staticmethod
+    def readExisting(filePath, record):
+        # (capacity, [record, ...]) of an existing ring file, or None if it isn't one
+        try:
+            with open(filePath, 'rb') as existingFile:
+                magic, capacity, head, count = RING_HEADER.unpack(existingFile.read(RING_HEADER.size))
+                if magic != RING_MAGIC or head >= max(capacity, 1) or count > capacity:
+                    return None
+                records = existingFile.read(capacity * record.size)
+            if len(records) < capacity * record.size:
+                return None
+            oldest = (head - count) % capacity if capacity > 0 else 0
+            return capacity, [record.unpack_from(records, ((oldest + index) % capacity) * record.size) for index in range(count)]
+        except (OSError, struct.error):
+            return None
+
+    def map(self):
+        # The mapping outlives the file object, so the file is closed straight away rather than holding a descriptor for the life of the ring
+        with open(self.filePath, 'r+b') as ringFile:
+            self.ringMap = mmap.mmap(ringFile.fileno(), 0, **RING_MMAP_OPTIONS)
+        magic, capacity, self.head, self.count = RING_HEADER.unpack_from(self.ringMap, 0)
+
+    def close(self):
+        with self.lock:
+            if self.ringMap is not None:
+                self.ringMap.flush()
+                self.ringMap.close()
+                self.ringMap = None
+
+    def append(self, record, retentionCutoff=None):
+        # Returns False if the ring has been closed
+        with self.lock:
+            if self.ringMap is None:
+                return False
+            self.appendRecord(record, retentionCutoff)
+            return True
+
+    def read(self, startTime, endTime, includePrevious=False):
+        # [record, ...] from startTime up to and including endTime. includePrevious adds the latest record before startTime (if any), which
+        # gives the value in force at startTime.
+        with self.lock:
+            if self.ringMap is None:
+                return list()
+            firstIndex = self.firstIndexFrom(startTime)
+            if includePrevious and firstIndex > 0:
+                firstIndex -= 1
+            records = list()
+            for index in range(firstIndex, self.count):
+                record = self.record.unpack_from(self.ringMap, self.recordOffset(index))
+                if record[0] > endTime:
+                    break
+                records.append(record)
+            return records
+
+    def countBetween(self, startTime, endTime):
+        with self.lock:
+            if self.ringMap is None:
+                return 0
+            return self.firstIndexFrom(endTime + 1e-6) - self.firstIndexFrom(startTime)
+
+    def latest(self):
+        with self.lock:
+            return self.record.unpack_from(self.ringMap, self.recordOffset(self.count - 1)) if self.ringMap is not None and self.count > 0 else None
+
+    # Following methods are called with self.lock held. Indexes are logical: 0 is the oldest record.
+
+    def appendRecord(self, record, retentionCutoff):
+        if self.count > 0 and record[0] < self.timestampAt(self.count - 1):
+            record = (self.timestampAt(self.count - 1), ) + tuple(record[1:])
+        self.record.pack_into(self.ringMap, RING_HEADER.size + self.head * self.record.size, *record)
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        if retentionCutoff is not None and self.timestampAt(0) < retentionCutoff:
+            # Drop expired records but keep the latest one before the cutoff: it gives the value at the start of the retention period
+            self.count -= max(self.firstIndexFrom(retentionCutoff) - 1, 0)
+        RING_POSITION.pack_into(self.ringMap, RING_POSITION_OFFSET, self.head, self.count)
+
+    def recordOffset(self, index):
+        return RING_HEADER.size + ((self.head - self.count + index) % self.capacity) * self.record.size
+
+    def timestampAt(self, index):
+        return RECORD_TIMESTAMP.unpack_from(self.ringMap, self.recordOffset(index))[0]
+
+    def firstIndexFrom(self, timestamp):
+        # Index of the first record at or after timestamp (self.count if there is none)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestampAt(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+
+# noinspection PyPep8Naming
+class RollupRingFile(RingFile):
+
+    # Ring of ROLLUP_RECORDs, one per bucket of 'resolution' seconds. A rollup for the latest bucket is merged into that record in place.
+
+    def __init__(self, filePath, capacity, resolution):
+        self.resolution = resolution
+        RingFile.__init__(self, filePath, capacity, ROLLUP_RECORD)
+
+    def add(self, rollup, retentionCutoff=None):
+        # Returns False if the ring has been closed
+        with self.lock:
+            if self.ringMap is None:
+                return False
+            if self.count > 0:
+                latestOffset = self.recordOffset(self.count - 1)
+                latest = ROLLUP_RECORD.unpack_from(self.ringMap, latestOffset)
+                if rollup[0] <= latest[0]:  # The latest bucket (or a rollup from before it, which is merged into it)
+                    ROLLUP_RECORD.pack_into(self.ringMap, latestOffset, *mergeRollup(latest, rollup))
+                    return True
+            self.appendRecord(rollup, retentionCutoff)
+            return True
+
+
+# noinspection PyPep8Naming
+def sampleRollup(timestamp, value, resolution):
+    # The rollup record of a single sample
+    return timestamp - (timestamp % resolution), value, value, value, value, 1
+
+
+# noinspection PyPep8Naming
+def mergeRollup(rollup, laterRollup):
+    # The rollup record of the samples of both, in rollup's bucket
+    count = rollup[ROLLUP_COUNT] + laterRollup[ROLLUP_COUNT]
+    mean = rollup[ROLLUP_MEAN] + (laterRollup[ROLLUP_MEAN] - rollup[ROLLUP_MEAN]) * laterRollup[ROLLUP_COUNT] / count
+    return (rollup[0], min(rollup[ROLLUP_MINIMUM], laterRollup[ROLLUP_MINIMUM]), max(rollup[ROLLUP_MAXIMUM], laterRollup[ROLLUP_MAXIMUM]), mean,
+            laterRollup[ROLLUP_LAST], count)
+
+
+# noinspection PyPep8Naming
+def rollupResolution(periodSeconds, maximumPoints=TIME_SERIES_EXPORT_MAXIMUM_POINTS):
+    # The finest rollup resolution that covers the period in no more than maximumPoints buckets (the coarsest if none does)
+    for resolution, minimumRetentionHours in TIME_SERIES_ROLLUPS:
+        if periodSeconds / resolution <= maximumPoints:
+            return resolution
+    return TIME_SERIES_ROLLUPS[-1][0]
+
+
+# noinspection PyPep8Naming
+class TimeSeriesStore:
+
+    # Per TRV Controller history of numeric states: one ring file per state in '<folder>/<TRV Controller id>/<state>.ring'. Ring files are
+    # opened on first use and sized from the controller's retention period, records older than the retention period are dropped as new
+    # ones are appended. A ring that fills before the retention period is reached overwrites its oldest records.
+    #
+    # Each sample also updates the state's rollups ('<state>.<seconds>.ring'): the minimum, maximum, mean, last value and count of the
+    # samples in each 1 minute, 15 minute and hourly bucket. Exports of long periods read a rollup rather than every sample. The latest bucket
+    # of each rollup is held in memory and written when the next bucket starts, when the rollup is read and on close. Rollup rings are only
+    # open while being written or read, so a TRV Controller keeps one open ring (and mapping) per state.
+
+    def __init__(self, folderPath, stateNames, averagedStateNames=()):
+        self.lock = threading.Lock()
+        self.folderPath = folderPath
+        self.stateNames = frozenset(stateNames)
+        self.averagedStateNames = frozenset(averagedStateNames)  # States read from a rollup as the bucket mean - others as the last value
+        self.enabled = True
+        self.retentionHours = dict()  # trvCtlrDevId -> retention hours
+        self.rings = dict()  # (trvCtlrDevId, stateName) -> raw RingFile
+        self.rollupLock = threading.Lock()  # Serialises the pending rollups and rollup ring files
+        self.pendingRollups = dict()  # (trvCtlrDevId, stateName, resolution) -> rollup record of the latest bucket, not yet written
+        self.appendCount = 0
+
+    def configure(self, trvCtlrDevId, retentionHours):
+        # Called when a TRV Controller is started - a changed retention period resizes its open rings when they are next used
+        with self.lock:
+            if self.retentionHours.get(trvCtlrDevId, None) != retentionHours:
+                self.retentionHours[trvCtlrDevId] = retentionHours
+                self.closeRings(trvCtlrDevId)
+
+    def append(self, trvCtlrDevId, stateName, value, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        value = float(value)
+        retentionHours = self.retentionHours.get(trvCtlrDevId, 24)
+        retentionCutoff = timestamp - retentionHours * 3600.0
+        if not self.ring(trvCtlrDevId, stateName).append((timestamp, value), retentionCutoff):
+            self.ring(trvCtlrDevId, stateName).append((timestamp, value), retentionCutoff)  # Ring was closed by a re-configure - reopened
+        with self.rollupLock:
+            for resolution, minimumRetentionHours in TIME_SERIES_ROLLUPS:
+                rollup = sampleRollup(timestamp, value, resolution)
+                pendingRollup = self.pendingRollups.get((trvCtlrDevId, stateName, resolution), None)
+                if pendingRollup is not None and rollup[0] <= pendingRollup[0]:
+                    rollup = mergeRollup(pendingRollup, rollup)
+                elif pendingRollup is not None:
+                    self.writeRollup(trvCtlrDevId, stateName, resolution, pendingRollup)  # Its bucket is complete
+                self.pendingRollups[(trvCtlrDevId, stateName, resolution)] = rollup
+        self.appendCount += 1
+
+    def recordStates(self, trvCtlrDevId, keyValueList, timestamp=None):
+        # Append the values of the recorded states in an Indigo key / value list e.g. as written by updateStatesOnServer
+        if not self.enabled:
+            return
+        for keyValue in keyValueList:
+            if keyValue['key'] in self.stateNames:
+                try:
+                    self.append(trvCtlrDevId, keyValue['key'], float(keyValue['value']), timestamp)
+                except (TypeError, ValueError):
+                    pass  # Not a number e.g. a state not yet set
+
+    def read(self, trvCtlrDevId, stateName, startTime, endTime, includePrevious=False, resolution=TIME_SERIES_RAW):
+        # Raw records are (timestamp, value), rollup records (bucket start, minimum, maximum, mean, last, count)
+        if resolution == TIME_SERIES_RAW:
+            if not os.path.exists(self.ringPath(trvCtlrDevId, stateName)):
+                return list()
+            return self.ring(trvCtlrDevId, stateName).read(startTime, endTime, includePrevious)
+        with self.rollupLock:
+            self.writePendingRollups(lambda key: key == (trvCtlrDevId, stateName, resolution))
+            if not os.path.exists(self.ringPath(trvCtlrDevId, stateName, resolution)):
+                return list()
+            rollupRing = self.rollupRing(trvCtlrDevId, stateName, resolution)
+            try:
+                return rollupRing.read(startTime, endTime, includePrevious)
+            finally:
+                rollupRing.close()
+
+    def exportResolution(self, trvCtlrDevId, stateName, startTime, endTime, maximumPoints=TIME_SERIES_EXPORT_MAXIMUM_POINTS):
+        # Raw records if the period is within the retention period and has no more than maximumPoints of them, otherwise the finest rollup
+        # with no more than maximumPoints buckets
+        if endTime - startTime <= self.retentionHours.get(trvCtlrDevId, 24) * 3600.0:
+            if not os.path.exists(self.ringPath(trvCtlrDevId, stateName)) or self.ring(trvCtlrDevId, stateName).countBetween(startTime, endTime) <= maximumPoints:
+                return TIME_SERIES_RAW
+        return rollupResolution(endTime - startTime, maximumPoints)
+
+    def stateRows(self, trvCtlrDevId, stateName, startTime, endTime):
+        # [(timestamp, value), ...] of a state from the latest record before startTime up to endTime, from the raw records or the rollup
+        # chosen by exportResolution (a bucket's start time and its mean or last value)
+        resolution = self.exportResolution(trvCtlrDevId, stateName, startTime, endTime)
+        records = self.read(trvCtlrDevId, stateName, startTime, endTime, includePrevious=True, resolution=resolution)
+        if resolution == TIME_SERIES_RAW:
+            return records
+        valueIndex = ROLLUP_MEAN if stateName in self.averagedStateNames else ROLLUP_LAST
+        return [(rollup[0], rollup[valueIndex]) for rollup in records]
+
+    def close(self, trvCtlrDevId=None):
+        # Close the rings of a TRV Controller, or all rings, first writing their pending rollups
+        with self.rollupLock:
+            self.writePendingRollups(lambda key: trvCtlrDevId is None or key[0] == trvCtlrDevId)
+        with self.lock:
+            for ringDevId in list(set([key[0] for key in self.rings])):
+                if trvCtlrDevId is None or ringDevId == trvCtlrDevId:
+                    self.closeRings(ringDevId)
+
+    def delete(self, trvCtlrDevId):
+        with self.rollupLock:
+            for key in [key for key in self.pendingRollups if key[0] == trvCtlrDevId]:
+                del self.pendingRollups[key]
+        with self.lock:
+            self.closeRings(trvCtlrDevId)
+            self.retentionHours.pop(trvCtlrDevId, None)
+            shutil.rmtree(os.path.join(self.folderPath, str(trvCtlrDevId)), ignore_errors=True)
+
+    def statistics(self):
+        with self.lock:
+            rings = list(self.rings.values())
+        return {'rings': len(rings), 'records': sum([ring.count for ring in rings]), 'bytes': sum([RING_HEADER.size + ring.capacity * ring.record.size for ring in rings]),
+                'appends': self.appendCount}
+
+    def ring(self, trvCtlrDevId, stateName):
+        # The state's raw ring, opened on first use and kept open
+        ring = self.rings.get((trvCtlrDevId, stateName), None)
+        if ring is None:
+            with self.lock:
+                ring = self.rings.get((trvCtlrDevId, stateName), None)
+                if ring is None:
+                    os.makedirs(os.path.join(self.folderPath, str(trvCtlrDevId)), exist_ok=True)
+                    capacity = max(int(self.retentionHours.get(trvCtlrDevId, 24) * TIME_SERIES_RECORDS_PER_HOUR), TIME_SERIES_MINIMUM_RECORDS)
+                    ring = RingFile(self.ringPath(trvCtlrDevId, stateName), capacity)
+                    self.rings[(trvCtlrDevId, stateName)] = ring
+        return ring
+
+    def rollupRing(self, trvCtlrDevId, stateName, resolution):
+        # A newly opened rollup ring, which the caller closes. Called with self.rollupLock held.
+        os.makedirs(os.path.join(self.folderPath, str(trvCtlrDevId)), exist_ok=True)
+        retentionHours = max(self.retentionHours.get(trvCtlrDevId, 24), dict(TIME_SERIES_ROLLUPS)[resolution])
+        return RollupRingFile(self.ringPath(trvCtlrDevId, stateName, resolution), int(retentionHours * 3600 / resolution) + 1, resolution)
+
+    def writeRollup(self, trvCtlrDevId, stateName, resolution, rollup):
+        # Called with self.rollupLock held. Buckets older than the rollup's retention period, counted back from the end of this bucket, are dropped.
+        retentionHours = max(self.retentionHours.get(trvCtlrDevId, 24), dict(TIME_SERIES_ROLLUPS)[resolution])
+        rollupRing = self.rollupRing(trvCtlrDevId, stateName, resolution)
+        try:
+            rollupRing.add(rollup, rollup[0] + resolution - retentionHours * 3600.0)
+        finally:
+            rollupRing.close()
+
+    def writePendingRollups(self, selected):
+        # Called with self.rollupLock held. Writes (and forgets) the pending rollups whose key is selected - later samples in the same
+        # bucket are merged into the written record.
+        for key in [key for key in self.pendingRollups if selected(key)]:
+            self.writeRollup(key[0], key[1], key[2], self.pendingRollups.pop(key))
+
+    def ringPath(self, trvCtlrDevId, stateName, resolution=TIME_SERIES_RAW):
+        if resolution == TIME_SERIES_RAW:
+            return os.path.join(self.folderPath, str(trvCtlrDevId), f'{stateName}.{TIME_SERIES_FILE_EXTENSION}')
+        return os.path.join(self.folderPath, str(trvCtlrDevId), f'{stateName}.{resolution}.{TIME_SERIES_FILE_EXTENSION}')
+
+    def closeRings(self, trvCtlrDevId):
+        # Called with self.lock held
+        for key in [key for key in self.rings if key[0] == trvCtlrDevId]:
+            self.rings.pop(key).close()
@@ -11,7 +11,9 @@ except ImportError:
     pass
 
 import collections
+import contextlib
 import datetime
+import os
 import postgresql
 import queue
 import subprocess
@@ -21,6 +23,9 @@ import time
 import traceback
 
 from constants import *
+from datagraphRenderCache import datagraphInputDigest
+from historyQuery import history, historyBucketSeconds, BucketedHistory, BUCKET_LAST, BUCKET_MAXIMUM, BUCKET_MEAN, BUCKET_MINIMUM, HISTORY_COPY_BUFFER_BYTES, HISTORY_FILL_NONE, \
+    PostgresqlHistory
 
 
 # noinspection PyPep8Naming
@@ -64,6 +69,25 @@ def calculateSecondsSinceMidnight():
     return seconds_since_midnight
 
 
+# noinspection PyPep8Naming
+@contextlib.contextmanager
+def replacedOnClose(filename, mode, **openArguments):
+    # Open a temporary file that replaces filename when closed, so a reader (e.g. DataGraph) never sees a partly written file. The temporary
+    # file is unique to the thread, so the TRV Handler and export job workers exporting the same TRV Controller don't write into each other's
+    # file - the last to finish wins. If writing fails, the temporary file is removed and filename is left as it was.
+    temporaryFilename = f'{filename}.{threading.get_ident()}.tmp'
+    try:
+        with open(temporaryFilename, mode, **openArguments) as fileOut:
+            yield fileOut
+    except BaseException:
+        try:
+            os.remove(temporaryFilename)
+        except OSError:
+            pass
+        raise
+    os.replace(temporaryFilename, filename)
+
+
 # noinspection PyUnresolvedReferences, PyPep8Naming
 class ThreadTrvHandler(threading.Thread):
 
@@ -80,6 +104,10 @@ class ThreadTrvHandler(threading.Thread):
 
         self.threadStop = event
 
+        self.pendingStates = dict()  # Write-behind buffer of TRV Controller state changes: {trvCtlrDevId: {stateKey: keyValue}}
+        self.pendingStatesTime = 0.0  # When the oldest buffered state change was made
+        self.stateWriteLock = threading.RLock()  # Serialises the buffer, state writes (from any thread) and the 'stateWrites' counters
+
     def exception_handler(self, exception_error_message, log_failing_statement):
         filename, line_number, method, statement = traceback.extract_tb(sys.exc_info()[2])[-1]
         module = filename.split('/')
@@ -98,6 +126,8 @@ class ThreadTrvHandler(threading.Thread):
 
             while not self.threadStop.is_set():
                 try:
+                    self.globals['profiler'].checkpoint('trvHandler')  # Starts / stops cProfile for this thread when profiling is requested
+
                     trvQueuedEntry = self.globals['queues']['trvHandler'].get(True, 5)
 
                     # trvQueuedEntry format:
@@ -124,113 +154,17 @@ class ThreadTrvHandler(threading.Thread):
                     else:
                         self.trvHandlerLogger.debug(f'\nTRVHANDLER: DEQUEUED COMMAND \'{CMD_TRANSLATION[trvCommand]}\'')
 
-                    if trvCommand == CMD_ACTION_POLL:
-                        self.pollSpiritActioned(trvCommandDevId)
-                        continue
-
-                    if trvCommand == CMD_TRIGGER_POLL:
-                        self.pollSpiritTriggered(trvCommandDevId)
-                        continue
-
-                    if trvCommand in (CMD_UPDATE_TRV_CONTROLLER_STATES, CMD_UPDATE_TRV_STATES, CMD_UPDATE_REMOTE_STATES, CMD_UPDATE_VALVE_STATES, CMD_UPDATE_RADIATOR_STATES):
-                        updateList = trvCommandPackage[0]
-                        self.updateDeviceStates(trvCommandDevId, trvCommand, updateList, trvQueueSequence)
-                        continue
-
-                    if trvCommand == CMD_CONTROL_HEATING_SOURCE:
-                        heatingDevId = trvCommandPackage[0]
-                        heatingVarId = trvCommandPackage[1]
-                        self.controlHeatingSource(trvCommandDevId, heatingDevId, heatingVarId)  # Device IDs: TRV Controller ID, Device Heating Source ID and Variable Heating Source ID
-                        continue
-
-                    if trvCommand == CMD_KEEP_HEAT_SOURCE_CONTROLLER_ALIVE:
-                        heatingDevId = trvCommandPackage[0]
-                        self.keepHeatSourceControllerAlive(heatingDevId)  # Device ID is for Heating Source device
-                        continue
-
-                    if trvCommand == CMD_CONTROL_TRV:
-                        self.controlTrv(trvCommandDevId)  # Device ID is for TRV Controller
-                        continue
-
-                    if trvCommand == CMD_DELAY_COMMAND:
-                        trvDelayedCommand = trvCommandPackage[0]
-                        trvDelayedSeconds = trvCommandPackage[1]
-                        trvDelayedCommandPackage = trvCommandPackage[2]
-                        self.delayCommand(trvDelayedCommand, trvCommandDevId, trvDelayedSeconds, trvDelayedCommandPackage)
-                        continue
-
-                    if trvCommand == CMD_PROCESS_HEATING_SCHEDULE:
-                        self.processHeatingSchedule(trvCommandDevId)
-                        continue
-
-                    if trvCommand == CMD_RESTATE_SCHEDULES:
-                        self.restateSchedules()
-                        continue
-
-                    if trvCommand == CMD_RESET_SCHEDULE_TO_DEVICE_DEFAULTS:
-                        self.resetScheduleToDeviceDefaults(trvCommandDevId)
-                        continue
-
-                    if trvCommand == CMD_BOOST:
-                        boostMode = trvCommandPackage[0]
-                        boostDeltaT = trvCommandPackage[1]
-                        boostSetpoint = trvCommandPackage[2]
-                        boostMinutes = trvCommandPackage[3]
-                        self.processBoost(trvCommandDevId, boostMode, boostDeltaT, boostSetpoint, boostMinutes)
-                        continue
-
-                    if trvCommand == CMD_BOOST_CANCEL:
-                        invokeProcessHeatingSchedule = trvCommandPackage[0]  # True or False
-                        self.boostCancelTriggered(trvCommandDevId, invokeProcessHeatingSchedule)
-                        continue
-
-                    if trvCommand == CMD_ADVANCE:
-                        advanceType = trvCommandPackage[0]
-                        self.processAdvance(trvCommandDevId, advanceType)
-                        continue
-
-                    if trvCommand == CMD_ADVANCE_CANCEL:
-                        invokeProcessHeatingSchedule = trvCommandPackage[0]
-                        self.processAdvanceCancel(trvCommandDevId, invokeProcessHeatingSchedule)
-                        continue
-
-                    if trvCommand == CMD_EXTEND:
-                        extendIncrementMinutes = trvCommandPackage[0]
-                        extendMaximumMinutes = trvCommandPackage[1]
-                        self.processExtend(trvCommandDevId, extendIncrementMinutes, extendMaximumMinutes)
-                        continue
-
-                    if trvCommand == CMD_EXTEND_CANCEL:
-                        invokeProcessHeatingSchedule = trvCommandPackage[0]
-                        self.processExtendCancel(trvCommandDevId, invokeProcessHeatingSchedule)
-                        continue
-
-                    if trvCommand == CMD_UPDATE_CSV_FILE:
-                        stateName = trvCommandPackage[0]
-                        updateValue = trvCommandPackage[1]
-                        self.updateCsvFile(trvCommandDevId, stateName, updateValue)
-                        continue
-
-                    if trvCommand == CMD_UPDATE_ALL_CSV_FILES:
-                        self.updateAllCsvFiles(trvCommandDevId)
-                        continue
-
-                    if trvCommand == CMD_UPDATE_ALL_CSV_FILES_VIA_POSTGRESQL:
-                        overrideDefaultRetentionHours = trvCommandPackage[0]
-                        overrideCsvFilePrefix = trvCommandPackage[1]
-                        self.updateAllCsvFilesViaPostgreSQL(trvCommandDevId, overrideDefaultRetentionHours, overrideCsvFilePrefix)
-                        continue
-
-                    if trvCommand == CMD_INVOKE_DATAGRAPH_USING_POSTGRESQL_TO_CSV:
-                        overrideDefaultRetentionHours = trvCommandPackage[0]
-                        overrideCsvFilePrefix = trvCommandPackage[1]
-                        self.updateDatagraphCsvFileViaPostgreSQL(trvCommandDevId, overrideDefaultRetentionHours, overrideCsvFilePrefix)
-                        continue
-
-                    self.trvHandlerLogger.error(f'TRVHandler: \'{CMD_TRANSLATION[trvCommand]}\' command cannot be processed')
+                    executeStartTime = time.time()
+                    self.globals['watchdog']['trvHandler'].commandStarted(trvCommand, trvCommandDevId)
+                    try:
+                        self.processCommand(trvCommand, trvCommandDevId, trvCommandPackage, trvQueueSequence)
+                        self.flushControllerStates()  # Write the command's state changes in one call per TRV Controller
+                    finally:
+                        self.globals['watchdog']['trvHandler'].commandFinished()
+                        self.globals['queues']['trvHandler'].metrics.executed(trvCommand, time.time() - executeStartTime)
 
                 except queue.Empty:
-                    pass
+                    self.globals['historyDatabase'].flush()  # Idle - insert any buffered history rows
                 except Exception as exception_error:
                     self.exception_handler(exception_error, True)  # Log error and display failing statement
 
@@ -239,73 +173,300 @@ class ThreadTrvHandler(threading.Thread):
 
         self.trvHandlerLogger.debug('TRV Handler Thread ended.')
 
+    def processCommand(self, trvCommand, trvCommandDevId, trvCommandPackage, trvQueueSequence):
+
+        try:
+            if trvCommand == CMD_ACTION_POLL:
+                self.pollSpiritActioned(trvCommandDevId)
+                return
+
+            if trvCommand == CMD_TRIGGER_POLL:
+                self.pollSpiritTriggered(trvCommandDevId)
+                return
+
+            if trvCommand in (CMD_UPDATE_TRV_CONTROLLER_STATES, CMD_UPDATE_TRV_STATES, CMD_UPDATE_REMOTE_STATES, CMD_UPDATE_VALVE_STATES, CMD_UPDATE_RADIATOR_STATES):
+                updateList = trvCommandPackage[0]
+                self.updateDeviceStates(trvCommandDevId, trvCommand, updateList, trvQueueSequence)
+                return
+
+            if trvCommand == CMD_CONTROL_HEATING_SOURCE:
+                heatingDevId = trvCommandPackage[0]
+                heatingVarId = trvCommandPackage[1]
+                self.controlHeatingSource(trvCommandDevId, heatingDevId, heatingVarId)  # Device IDs: TRV Controller ID, Device Heating Source ID and Variable Heating Source ID
+                return
+
+            if trvCommand == CMD_KEEP_HEAT_SOURCE_CONTROLLER_ALIVE:
+                heatingDevId = trvCommandPackage[0]
+                self.keepHeatSourceControllerAlive(heatingDevId)  # Device ID is for Heating Source device
+                return
+
+            if trvCommand == CMD_CONTROL_TRV:
+                self.controlTrv(trvCommandDevId)  # Device ID is for TRV Controller
+                return
+
+            if trvCommand == CMD_DELAY_COMMAND:
+                trvDelayedCommand = trvCommandPackage[0]
+                trvDelayedSeconds = trvCommandPackage[1]
+                trvDelayedCommandPackage = trvCommandPackage[2]
+                self.delayCommand(trvDelayedCommand, trvCommandDevId, trvDelayedSeconds, trvDelayedCommandPackage)
+                return
+
+            if trvCommand == CMD_PROCESS_HEATING_SCHEDULE:
+                self.processHeatingSchedule(trvCommandDevId)
+                return
+
+            if trvCommand == CMD_RESTATE_SCHEDULES:
+                self.restateSchedules()
+                return
+
+            if trvCommand == CMD_RESET_SCHEDULE_TO_DEVICE_DEFAULTS:
+                self.resetScheduleToDeviceDefaults(trvCommandDevId)
+                return
+
+            if trvCommand == CMD_BOOST:
+                boostMode = trvCommandPackage[0]
+                boostDeltaT = trvCommandPackage[1]
+                boostSetpoint = trvCommandPackage[2]
+                boostMinutes = trvCommandPackage[3]
+                self.processBoost(trvCommandDevId, boostMode, boostDeltaT, boostSetpoint, boostMinutes)
+                return
+
+            if trvCommand == CMD_BOOST_CANCEL:
+                invokeProcessHeatingSchedule = trvCommandPackage[0]  # True or False
+                self.boostCancelTriggered(trvCommandDevId, invokeProcessHeatingSchedule)
+                return
+
+            if trvCommand == CMD_ADVANCE:
+                advanceType = trvCommandPackage[0]
+                self.processAdvance(trvCommandDevId, advanceType)
+                return
+
+            if trvCommand == CMD_ADVANCE_CANCEL:
+                invokeProcessHeatingSchedule = trvCommandPackage[0]
+                self.processAdvanceCancel(trvCommandDevId, invokeProcessHeatingSchedule)
+                return
+
+            if trvCommand == CMD_EXTEND:
+                extendIncrementMinutes = trvCommandPackage[0]
+                extendMaximumMinutes = trvCommandPackage[1]
+                self.processExtend(trvCommandDevId, extendIncrementMinutes, extendMaximumMinutes)
+                return
+
+            if trvCommand == CMD_EXTEND_CANCEL:
+                invokeProcessHeatingSchedule = trvCommandPackage[0]
+                self.processExtendCancel(trvCommandDevId, invokeProcessHeatingSchedule)
+                return
+
+            if trvCommand == CMD_UPDATE_ALL_CSV_FILES:
+                self.updateAllCsvFiles(trvCommandDevId)
+                return
+
+            if trvCommand == CMD_UPDATE_ALL_CSV_FILES_VIA_POSTGRESQL:
+                overrideDefaultRetentionHours = trvCommandPackage[0]
+                overrideCsvFilePrefix = trvCommandPackage[1]
+                self.updateAllCsvFilesViaPostgreSQL(trvCommandDevId, overrideDefaultRetentionHours, overrideCsvFilePrefix)
+                return
+
+            if trvCommand == CMD_INVOKE_DATAGRAPH_USING_POSTGRESQL_TO_CSV:
+                overrideDefaultRetentionHours = trvCommandPackage[0]
+                overrideCsvFilePrefix = trvCommandPackage[1]
+                self.updateDatagraphCsvFileViaPostgreSQL(trvCommandDevId, overrideDefaultRetentionHours, overrideCsvFilePrefix)
+                return
+
+            self.trvHandlerLogger.error(f'TRVHandler: \'{CMD_TRANSLATION[trvCommand]}\' command cannot be processed')
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+
+    def updateControllerStates(self, trvCtlrDevId, keyValueList):
+
+        # Write-behind: on the TRV Handler thread, state changes are buffered per TRV Controller (a later value for a state replaces an
+        # earlier one) and written by flushControllerStates at the end of the command - or sooner if the command is long running.
+        # Calls from other threads (timers, the Delay Handler) are written straight through as they aren't followed by a flush - any
+        # buffered value of the same state is dropped first, so it can't be flushed later over the newer value.
+
+        with self.stateWriteLock:
+            self.globals['stateWrites']['requested'] += 1
+            self.globals['stateWrites']['keysRequested'] += len(keyValueList)
+
+            if threading.current_thread() is not self:
+                pendingKeyValues = self.pendingStates.get(trvCtlrDevId, None)
+                if pendingKeyValues is not None:
+                    for keyValue in keyValueList:
+                        pendingKeyValues.pop(keyValue['key'], None)
+                self.globals['stateWrites']['roundTrips'] += 1
+                self.globals['stateWrites']['keysWritten'] += len(keyValueList)
+                indigo.devices[trvCtlrDevId].updateStatesOnServer(keyValueList)
+                self.globals['timeSeries'].recordStates(trvCtlrDevId, keyValueList)
+                self.globals['historyDatabase'].recordStates(trvCtlrDevId, keyValueList)
+                return
+
+            if not self.pendingStates:
+                self.pendingStatesTime = time.time()
+            pendingKeyValues = self.pendingStates.setdefault(trvCtlrDevId, dict())
+            for keyValue in keyValueList:
+                pendingKeyValues[keyValue['key']] = keyValue
+
+            if time.time() - self.pendingStatesTime >= STATE_WRITE_BEHIND_SECONDS:
+                self.flushControllerStates()
+
+    def flushControllerStates(self):
+
+        # Write buffered state changes, dropping any that match the value already held by Indigo. The lock is held while writing, so a
+        # direct write from another thread can't be made between taking the buffer and writing it.
+
+        with self.stateWriteLock:
+            pendingStates = self.pendingStates
+            self.pendingStates = dict()
+
+            for trvCtlrDevId, pendingKeyValues in pendingStates.items():
+                try:
+                    trvcDev = indigo.devices[trvCtlrDevId]
+                    keyValueList = list()
+                    for stateKey, keyValue in pendingKeyValues.items():
+                        if 'uiValue' not in keyValue and stateKey in trvcDev.states and trvcDev.states[stateKey] == keyValue['value']:
+                            self.globals['stateWrites']['keysUnchanged'] += 1
+                        else:
+                            keyValueList.append(keyValue)
+
+                    if len(keyValueList) > 0:
+                        self.globals['stateWrites']['roundTrips'] += 1
+                        self.globals['stateWrites']['keysWritten'] += len(keyValueList)
+                        trvcDev.updateStatesOnServer(keyValueList)
+                        self.globals['timeSeries'].recordStates(trvCtlrDevId, keyValueList)
+                        self.globals['historyDatabase'].recordStates(trvCtlrDevId, keyValueList)
+
+                except Exception as exception_error:
+                    self.exception_handler(exception_error, True)  # Log error and display failing statement
+
     def controlHeatingSource(self, trvCtlrDevId, heatingId, heatingVarId):  # noqa - trvCtlrDevId not used
 
         # Determine if heating should be started / ended
+        # Only a change in demand (none <-> some thermostats calling for heat) results in a command being sent to the heat source
+        # and then only once the heat source has been in its current state for the configured minimum on / off time
 
         if heatingId == 0 and heatingVarId == 0:
             return
 
-        self.globals['lock'].acquire()
-
         try:
             if heatingId != 0:
-                if len(self.globals['heaterDevices'][heatingId]['thermostatsCallingForHeat']) == 0:
-                    callingForHeatUi = 'None'
-                else:
-                    callingForHeatUi = '\n'
-                    for callingForHeatTrvCtlrDevId in self.globals['heaterDevices'][heatingId]['thermostatsCallingForHeat']:
-                        callingForHeatUi = callingForHeatUi + f'  > {indigo.devices[callingForHeatTrvCtlrDevId].name}\n'
+                heaterDevice = self.globals['heaterDevices'][heatingId]
+                demand = len(heaterDevice['thermostatsCallingForHeat'])
 
-                self.trvHandlerLogger.debug(
-                    f'Control Heating Source: {len(self.globals["heaterDevices"][heatingId]["thermostatsCallingForHeat"])} Thermostats calling for heat from Device \'{indigo.devices[heatingId].name}\': {callingForHeatUi}')
-                if len(self.globals['heaterDevices'][heatingId]['thermostatsCallingForHeat']) > 0:
-                    # if there are thermostats calling for heat, the heating needs to be 'on'
-                    # indigo.variable.updateValue(self.variableId, value="true")  # Variable indicator to show that heating is being requested
-                    if self.globals['heaterDevices'][heatingId]['onState'] != HEAT_SOURCE_ON:
-                        self.globals['heaterDevices'][heatingId]['onState'] = HEAT_SOURCE_ON
-                        if self.globals['heaterDevices'][heatingId]['heaterControlType'] == HEAT_SOURCE_CONTROL_HVAC:
+                if self.trvHandlerLogger.isEnabledFor(logging.DEBUG):
+                    if demand == 0:
+                        callingForHeatUi = 'None'
+                    else:
+                        callingForHeatUi = '\n'
+                        for callingForHeatTrvCtlrDevId in heaterDevice['thermostatsCallingForHeat']:
+                            callingForHeatUi = callingForHeatUi + f'  > {indigo.devices[callingForHeatTrvCtlrDevId].name}\n'
+                    self.trvHandlerLogger.debug(f'Control Heating Source: {demand} Thermostats calling for heat from Device \'{indigo.devices[heatingId].name}\': {callingForHeatUi}')
+
+                requiredOnState = HEAT_SOURCE_ON if demand > 0 else HEAT_SOURCE_OFF
+                if heaterDevice['onState'] != requiredOnState and self.heatSourceDwellCheck(heaterDevice, heatingId, heatingId, 0):
+                    heaterDevice['onState'] = requiredOnState
+                    heaterDevice['onStateChangedTime'] = time.time()
+                    heaterDevice['demandTransitions'] += 1
+                    if requiredOnState == HEAT_SOURCE_ON:
+                        # if there are thermostats calling for heat, the heating needs to be 'on'
+                        if heaterDevice['heaterControlType'] == HEAT_SOURCE_CONTROL_HVAC:
                             if indigo.devices[heatingId].states['hvacOperationMode'] != HVAC_HEAT:
                                 indigo.thermostat.setHvacMode(heatingId, value=HVAC_HEAT)  # Turn heating 'on'
-                        elif self.globals['heaterDevices'][heatingId]['heaterControlType'] == HEAT_SOURCE_CONTROL_RELAY:
+                                self.heatSourceCommandIssued(heaterDevice)
+                            else:
+                                heaterDevice['commandsSuppressed'] += 1  # Already 'on'
+                        elif heaterDevice['heaterControlType'] == HEAT_SOURCE_CONTROL_RELAY:
                             if not indigo.devices[heatingId].onState:
                                 indigo.device.turnOn(heatingId)  # Turn heating 'on'
+                                self.heatSourceCommandIssued(heaterDevice)
+                            else:
+                                heaterDevice['commandsSuppressed'] += 1  # Already 'on'
                         else:
                             pass  # ERROR SITUATION
-                else:
-                    # if no thermostats are calling for heat, then the heating needs to be 'off'
-                    # indigo.variable.updateValue(self.variableId, value="false")  # Variable indicator to show that heating is NOT being requested
-                    if self.globals['heaterDevices'][heatingId]['onState'] != HEAT_SOURCE_OFF:
-                        self.globals['heaterDevices'][heatingId]['onState'] = HEAT_SOURCE_OFF
-                        if self.globals['heaterDevices'][heatingId]['heaterControlType'] == HEAT_SOURCE_CONTROL_HVAC:
+                    else:
+                        # if no thermostats are calling for heat, then the heating needs to be 'off'
+                        if heaterDevice['heaterControlType'] == HEAT_SOURCE_CONTROL_HVAC:
                             if indigo.devices[heatingId].states['hvacOperationMode'] != HVAC_OFF:
                                 indigo.thermostat.setHvacMode(heatingId, value=HVAC_OFF)  # Turn heating 'off'
-                        elif self.globals['heaterDevices'][heatingId]['heaterControlType'] == HEAT_SOURCE_CONTROL_RELAY:
+                                self.heatSourceCommandIssued(heaterDevice)
+                            else:
+                                heaterDevice['commandsSuppressed'] += 1  # Already 'off'
+                        elif heaterDevice['heaterControlType'] == HEAT_SOURCE_CONTROL_RELAY:
                             if indigo.devices[heatingId].onState:
                                 indigo.device.turnOff(heatingId)  # Turn heating 'off'
+                                self.heatSourceCommandIssued(heaterDevice)
+                            else:
+                                heaterDevice['commandsSuppressed'] += 1  # Already 'off'
                         else:
                             pass  # ERROR SITUATION
 
             if heatingVarId != 0:
-                if len(self.globals['heaterVariables'][heatingVarId]['thermostatsCallingForHeat']) == 0:
-                    callingForHeatUi = 'None'
-                else:
-                    callingForHeatUi = '\n'
-                    for callingForHeatTrvCtlrDevId in self.globals['heaterVariables'][heatingVarId]['thermostatsCallingForHeat']:
-                        callingForHeatUi = callingForHeatUi + f'  > {indigo.devices[callingForHeatTrvCtlrDevId].name}\n'
+                heaterVariable = self.globals['heaterVariables'][heatingVarId]
+                demand = len(heaterVariable['thermostatsCallingForHeat'])
 
-                self.trvHandlerLogger.debug(f'Control Heating Source: Thermostats calling for heat from Variable \'{indigo.variables[heatingVarId].name}\': {callingForHeatUi}')
-                if len(self.globals['heaterVariables'][heatingVarId]['thermostatsCallingForHeat']) > 0:
-                    # if there are thermostats calling for heat, the heating needs to be 'on'
-                    indigo.variable.updateValue(heatingVarId, value="true")  # Variable indicator to show that heating is being requested
-                else:
-                    # if no thermostats are calling for heat, then the heating needs to be 'off'
-                    indigo.variable.updateValue(heatingVarId, value="false")  # Variable indicator to show that heating is NOT being requested
+                if self.trvHandlerLogger.isEnabledFor(logging.DEBUG):
+                    if demand == 0:
+                        callingForHeatUi = 'None'
+                    else:
+                        callingForHeatUi = '\n'
+                        for callingForHeatTrvCtlrDevId in heaterVariable['thermostatsCallingForHeat']:
+                            callingForHeatUi = callingForHeatUi + f'  > {indigo.devices[callingForHeatTrvCtlrDevId].name}\n'
+                    self.trvHandlerLogger.debug(f'Control Heating Source: Thermostats calling for heat from Variable \'{indigo.variables[heatingVarId].name}\': {callingForHeatUi}')
+
+                requiredOnState = HEAT_SOURCE_ON if demand > 0 else HEAT_SOURCE_OFF
+                if heaterVariable['onState'] != requiredOnState and self.heatSourceDwellCheck(heaterVariable, heatingVarId, 0, heatingVarId):
+                    heaterVariable['onState'] = requiredOnState
+                    heaterVariable['onStateChangedTime'] = time.time()
+                    heaterVariable['demandTransitions'] += 1
+                    if requiredOnState == HEAT_SOURCE_ON:
+                        indigo.variable.updateValue(heatingVarId, value="true")  # Variable indicator to show that heating is being requested
+                    else:
+                        indigo.variable.updateValue(heatingVarId, value="false")  # Variable indicator to show that heating is NOT being requested
+                    self.heatSourceCommandIssued(heaterVariable)
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+
+    def heatSourceCommandIssued(self, heatSource):
+        heatSource['commandsIssued'] += 1
+        heatSource['lastCommandTime'] = time.time()
+
+    def heatSourceDwellCheck(self, heatSource, heatSourceId, heatingId, heatingVarId):
+
+        # Returns True if the heat source can be switched now. Otherwise the switch is suppressed and a re-evaluation is scheduled for when the
+        # minimum on / off time will have elapsed; if demand has reverted by then, nothing gets sent at all.
+
+        try:
+            if heatSource['onState'] == HEAT_SOURCE_ON:
+                minimumSeconds = self.globals['config'].get('heatSourceMinimumOnMinutes', 0) * 60
+            elif heatSource['onState'] == HEAT_SOURCE_OFF:
+                minimumSeconds = self.globals['config'].get('heatSourceMinimumOffMinutes', 0) * 60
+            else:
+                return True  # Still initialising - always allowed
+
+            remainingSeconds = (heatSource['onStateChangedTime'] + minimumSeconds) - time.time()
+            if remainingSeconds <= 0.0:
+                return True
+
+            heatSource['commandsSuppressed'] += 1
+            if heatSourceId not in self.globals['timers']['heatSourceDwell'] or not self.globals['timers']['heatSourceDwell'][heatSourceId].is_alive():
+                self.trvHandlerLogger.debug(f'Heat Source switch deferred for {remainingSeconds:.0f} seconds to honour minimum on / off time')
+                self.globals['timers']['heatSourceDwell'][heatSourceId] = threading.Timer(remainingSeconds + 1.0, self.heatSourceDwellTimerTriggered, [heatingId, heatingVarId])
+                self.globals['timers']['heatSourceDwell'][heatSourceId].setDaemon(True)
+                self.globals['timers']['heatSourceDwell'][heatSourceId].start()
+            return False
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+            return True
+
+    def heatSourceDwellTimerTriggered(self, heatingId, heatingVarId):
+
+        try:
+            self.globals['queues']['trvHandler'].put([QUEUE_PRIORITY_STATUS_MEDIUM, 0, CMD_CONTROL_HEATING_SOURCE, None, [heatingId, heatingVarId]])
 
         except Exception as exception_error:
             self.exception_handler(exception_error, True)  # Log error and display failing statement
-        finally:
-            self.globals['lock'].release()
 
     def controlTrv(self, trvCtlrDevId):
 
@@ -340,6 +501,26 @@ class ThreadTrvHandler(threading.Thread):
             self.trvHandlerLogger.debug(
                 f'controlTrv: \'{indigo.devices[trvCtlrDevId].name}\' internal states [2] are: controllerMode = {self.globals["trvc"][trvCtlrDevId]["controllerMode"]}, setpointHeat = {self.globals["trvc"][trvCtlrDevId]["setpointHeat"]}, setPointTrv =  {self.globals["trvc"][trvCtlrDevId]["setpointHeatTrv"]}')
 
+            hvacFullPower = False
+            if trvDev.model == 'Thermostat (Spirit)' and 'zwaveHvacOperationModeID' in trvDev.states and trvDev.states['zwaveHvacOperationModeID'] == HVAC_FULL_POWER:
+                hvacFullPower = True
+
+            # Skip the evaluation (and any resulting outbound commands) if none of the control inputs have changed since the last evaluation
+            # and the TRV and remote thermostat report the setpoints last commanded - a command the device hasn't applied (e.g. it is asleep
+            # or the command was lost) is re-sent on every evaluation until it has
+
+            self.globals['trvc'][trvCtlrDevId]['controlEvaluations'] += 1
+            remoteSetpointControlled = (remoteDevId != 0 and self.globals['trvc'][trvCtlrDevId]['remoteSetpointHeatControl']
+                                        and self.globals['trvc'][trvCtlrDevId]['controllerMode'] in (CONTROLLER_MODE_AUTO, CONTROLLER_MODE_UI, CONTROLLER_MODE_TRV_HARDWARE, CONTROLLER_MODE_TRV_UI))
+            remoteSetpointHeat = float(indigo.devices[remoteDevId].heatSetpoint) if remoteDevId != 0 and self.globals['trvc'][trvCtlrDevId]['remoteSetpointHeatControl'] else None
+            setpointsApplied = (float(trvDev.heatSetpoint) == float(self.globals['trvc'][trvCtlrDevId]['setpointHeatTrv'])
+                                and (not remoteSetpointControlled or remoteSetpointHeat == float(self.globals['trvc'][trvCtlrDevId]['setpointHeat'])))
+            if setpointsApplied and self.controlInputsFingerprint(trvCtlrDevId, float(trvDev.heatSetpoint), remoteSetpointHeat, hvacFullPower) == self.globals['trvc'][trvCtlrDevId]['controlInputsFingerprint']:
+                self.globals['trvc'][trvCtlrDevId]['controlSkips'] += 1
+                self.trvHandlerLogger.debug(f'controlTrv: \'{indigo.devices[trvCtlrDevId].name}\' control inputs unchanged - evaluation skipped')
+                return
+            self.globals['trvc'][trvCtlrDevId]['controlInputsFingerprint'] = None  # Not stored until the evaluation completes - an evaluation that fails is retried
+
             # Set the Remote Thermostat setpoint if not invoked by remote, and it exists and, setpoint adjustment is enabled
 
             if self.globals['trvc'][trvCtlrDevId]['controllerMode'] == CONTROLLER_MODE_AUTO or self.globals['trvc'][trvCtlrDevId]['controllerMode'] == CONTROLLER_MODE_UI or self.globals['trvc'][trvCtlrDevId]['controllerMode'] == CONTROLLER_MODE_TRV_HARDWARE or self.globals['trvc'][trvCtlrDevId]['controllerMode'] == CONTROLLER_MODE_TRV_UI:
@@ -352,11 +533,7 @@ class ThreadTrvHandler(threading.Thread):
                         indigo.thermostat.setHeatSetpoint(remoteDevId, value=float(self.globals['trvc'][trvCtlrDevId]['setpointHeat']))  # Set Remote Heat Setpoint to Target Temperature
                         self.trvHandlerLogger.debug(
                             f'controlTrv: Adjusting Remote Setpoint Heat from {float(indigo.devices[remoteDevId].heatSetpoint)} to Target Temperature of {float(self.globals["trvc"][trvCtlrDevId]["setpointHeat"])}')
-                        indigo.devices[trvCtlrDevId].updateStateOnServer(key='setpointHeatRemote', value=float(self.globals['trvc'][trvCtlrDevId]['setpointHeatRemote']))
-
-            hvacFullPower = False
-            if trvDev.model == 'Thermostat (Spirit)' and 'zwaveHvacOperationModeID' in trvDev.states and trvDev.states['zwaveHvacOperationModeID'] == HVAC_FULL_POWER:
-                hvacFullPower = True
+                        self.updateControllerStates(trvCtlrDevId, [{'key': 'setpointHeatRemote', 'value': float(self.globals['trvc'][trvCtlrDevId]['setpointHeatRemote'])}])
 
             self.trvHandlerLogger.debug(f'controlTrv: \'{indigo.devices[trvCtlrDevId].name}\' internal states [3] are: HVAC_FULL_POWER = {hvacFullPower}')
 
@@ -382,7 +559,7 @@ class ThreadTrvHandler(threading.Thread):
                         self.trvHandlerLogger.debug(
                             f'controlTrv: Turning OFF and adjusting TRV Setpoint Heat to \'{float(self.globals["trvc"][trvCtlrDevId]["setpointHeatTrv"])}\'. Z-Wave Pending = {self.globals["trvc"][trvCtlrDevId]["zwavePendingTrvSetpointFlag"]}, Setpoint = \'{self.globals["trvc"][trvCtlrDevId]["zwavePendingTrvSetpointValue"]}\', Sequence = \'{self.globals["trvc"][trvCtlrDevId]["zwavePendingTrvSetpointSequence"]}\'.')
 
-                        indigo.devices[trvCtlrDevId].updateStateOnServer(key='setpointHeatTrv', value=float(self.globals['trvc'][trvCtlrDevId]['setpointHeatTrv']))
+                        self.updateControllerStates(trvCtlrDevId, [{'key': 'setpointHeatTrv', 'value': float(self.globals['trvc'][trvCtlrDevId]['setpointHeatTrv'])}])
 
                         if self.globals['trvc'][trvCtlrDevId]['valveDevId'] != 0:  # e.g. EUROTronic Spirit Thermostat
                             if self.globals['trvc'][trvCtlrDevId]['advancedOption'] == ADVANCED_OPTION_FIRMWARE_WORKAROUND:
@@ -441,7 +618,7 @@ class ThreadTrvHandler(threading.Thread):
                         self.trvHandlerLogger.debug(
                             f'controlTrv: Turning ON and adjusting TRV Setpoint Heat to \'{float(self.globals["trvc"][trvCtlrDevId]["setpointHeatTrv"])}\'. Z-Wave Pending = {self.globals["trvc"][trvCtlrDevId]["zwavePendingTrvSetpointFlag"]}, Setpoint = \'{self.globals["trvc"][trvCtlrDevId]["zwavePendingTrvSetpointValue"]}\', Sequence = \'{self.globals["trvc"][trvCtlrDevId]["zwavePendingTrvSetpointSequence"]}\'.')
 
-                        indigo.devices[trvCtlrDevId].updateStateOnServer(key='setpointHeatTrv', value=float(self.globals['trvc'][trvCtlrDevId]['setpointHeatTrv']))
+                        self.updateControllerStates(trvCtlrDevId, [{'key': 'setpointHeatTrv', 'value': float(self.globals['trvc'][trvCtlrDevId]['setpointHeatTrv'])}])
 
                         if self.globals['trvc'][trvCtlrDevId]['enableTrvOnOff'] or self.globals['trvc'][trvCtlrDevId]['hvacOperationModeTrv'] == HVAC_OFF:
                             indigo.thermostat.setHvacMode(trvDevId, value=HVAC_HEAT)
@@ -463,24 +640,59 @@ class ThreadTrvHandler(threading.Thread):
                                 # zwaveRawCommandSequence.append((1, self.globals['trvc'][trvCtlrDevId]['trvDevId'], [0x40, 0x01, 0x01], 'Thermostat Mode Control - Heat'))
                                 self.controlTrvSpiritValveCommandsQueued(trvCtlrDevId, zwaveRawCommandSequence)
 
+            # The fingerprint is taken after the evaluation, as the evaluation itself updates setpointHeatTrv, hvacOperationModeTrv and
+            # the heat source demand - taken before, the next (unchanged) call would never match it. The device setpoints in it are those
+            # just commanded (trvDev was fetched before the commands), which is what the devices report once they have applied them.
+            if remoteSetpointControlled:
+                remoteSetpointHeat = float(self.globals['trvc'][trvCtlrDevId]['setpointHeat'])
+            self.globals['trvc'][trvCtlrDevId]['controlInputsFingerprint'] = self.controlInputsFingerprint(trvCtlrDevId, float(self.globals['trvc'][trvCtlrDevId]['setpointHeatTrv']),
+                                                                                                        remoteSetpointHeat, hvacFullPower)
+
         except Exception as exception_error:
             self.exception_handler(exception_error, True)  # Log error and display failing statement
 
+    def controlInputsFingerprint(self, trvCtlrDevId, trvSetpointHeat, remoteSetpointHeat, hvacFullPower):
+
+        # The inputs of a controlTrv evaluation: the TRV Controller's internal states, the setpoints of the TRV and remote thermostat
+        # devices (which can be changed outside the plugin - remoteSetpointHeat is None unless the remote controls the setpoint) and its
+        # heat sources' demand and on / off state
+
+        trvc = self.globals['trvc'][trvCtlrDevId]
+        heatSourcesDemand = list()
+        if trvc['heatingId'] > 0:
+            heaterDevice = self.globals['heaterDevices'][trvc['heatingId']]
+            heatSourcesDemand.append((trvCtlrDevId in heaterDevice['thermostatsCallingForHeat'], heaterDevice['onState']))
+        if trvc['heatingVarId'] > 0:
+            heaterVariable = self.globals['heaterVariables'][trvc['heatingVarId']]
+            heatSourcesDemand.append((trvCtlrDevId in heaterVariable['thermostatsCallingForHeat'], heaterVariable['onState']))
+
+        return (trvc['controllerMode'],
+                float(trvc['setpointHeat']),
+                float(trvc['setpointHeatTrv']),
+                float(trvc['setpointHeatRemote']),
+                float(trvc['temperature']),
+                trvc['hvacOperationMode'],
+                trvc['hvacOperationModeTrv'],
+                hvacFullPower,
+                float(trvc['setpointHeatMinimum']),
+                float(trvc['setpointHeatMaximum']),
+                float(trvc.get('remoteDeltaMax', 0.0)),
+                trvc['remoteSetpointHeatControl'],
+                trvc['enableTrvOnOff'],
+                trvc['advancedOption'],
+                trvSetpointHeat,
+                remoteSetpointHeat,
+                tuple(heatSourcesDemand))
+
     def controlTrvHeatingOff(self, trvCtlrDevId):
 
         try:
             try:
-                self.globals['lock'].acquire()
-                if self.globals['trvc'][trvCtlrDevId]['heatingId'] > 0:
-                    self.globals['heaterDevices'][self.globals['trvc'][trvCtlrDevId]['heatingId']]['thermostatsCallingForHeat'].discard(trvCtlrDevId)  # Remove TRV Controller from the SET thermostatsCallingForHeat
-                if self.globals['trvc'][trvCtlrDevId]['heatingVarId'] > 0:
-                    self.globals['heaterVariables'][self.globals['trvc'][trvCtlrDevId]['heatingVarId']]['thermostatsCallingForHeat'].discard(trvCtlrDevId)  # Remove TRV Controller from the SET thermostatsCallingForHeat
+                self.updateHeatSourceDemand(trvCtlrDevId, False)  # Remove TRV Controller from the SET thermostatsCallingForHeat
             except Exception as exception_error:
                 self.exception_handler(exception_error, True)  # Log error and display failing statement
             finally:
-                self.globals['lock'].release()
-
-                indigo.devices[trvCtlrDevId].updateStateOnServer(key='hvacHeaterIsOn', value=False)
+                self.updateControllerStates(trvCtlrDevId, [{'key': 'hvacHeaterIsOn', 'value': False}])
                 indigo.devices[trvCtlrDevId].updateStateImageOnServer(indigo.kStateImageSel.HvacHeatMode)  # HvacOff - HvacHeatMode - HvacHeating - HvacAutoMode
 
         except Exception as exception_error:
@@ -490,18 +702,12 @@ class ThreadTrvHandler(threading.Thread):
 
         try:
             try:
-                self.globals['lock'].acquire()
-                if self.globals['trvc'][trvCtlrDevId]['heatingId'] > 0:
-                    self.globals['heaterDevices'][self.globals['trvc'][trvCtlrDevId]['heatingId']]['thermostatsCallingForHeat'].add(trvCtlrDevId)  # Add TRV Controller to the SET thermostatsCallingForHeat
-                if self.globals['trvc'][trvCtlrDevId]['heatingVarId'] > 0:
-                    self.globals['heaterVariables'][self.globals['trvc'][trvCtlrDevId]['heatingVarId']]['thermostatsCallingForHeat'].add(trvCtlrDevId)  # Add TRV Controller to the SET thermostatsCallingForHeat
+                self.updateHeatSourceDemand(trvCtlrDevId, True)  # Add TRV Controller to the SET thermostatsCallingForHeat
                 self.globals['trvc'][trvCtlrDevId]['hvacOperationModeTrv'] = HVAC_HEAT
             except Exception as exception_error:
                 self.exception_handler(exception_error, True)  # Log error and display failing statement
             finally:
-                self.globals['lock'].release()
-
-                indigo.devices[trvCtlrDevId].updateStateOnServer(key='hvacHeaterIsOn', value=True)
+                self.updateControllerStates(trvCtlrDevId, [{'key': 'hvacHeaterIsOn', 'value': True}])
                 indigo.devices[trvCtlrDevId].updateStateImageOnServer(indigo.kStateImageSel.HvacHeatMode)  # HvacOff - HvacHeatMode - HvacHeating - HvacAutoMode
 
         except Exception as exception_error:
@@ -587,21 +793,30 @@ class ThreadTrvHandler(threading.Thread):
             if indigo.devices[heatingId].model == "1 Channel Boiler Actuator (SSR303 / ASR-ZW)" or indigo.devices[heatingId].model == "2 Channel Boiler Actuator (SSR302)":
                 self.trvHandlerLogger.debug(
                     f'\'keepHeatSourceControllerAlive\' invoked for:  {indigo.devices[heatingId].name} - Number of TRVs calling for heat = {len(self.globals["heaterDevices"][heatingId]["thermostatsCallingForHeat"])}')
-                self.globals['lock'].acquire()
+                heaterDevice = self.globals['heaterDevices'][heatingId]
+                keepAliveSeconds = HEAT_SOURCE_KEEP_ALIVE_SECONDS
                 try:
+                    secondsSinceLastCommand = time.time() - heaterDevice['lastCommandTime']
+                    if secondsSinceLastCommand < HEAT_SOURCE_KEEP_ALIVE_SECONDS:
+                        # A command has been sent recently which has already reset the controller's timeout - no need for a reminder yet
+                        heaterDevice['keepAlivesSkipped'] += 1
+                        keepAliveSeconds = HEAT_SOURCE_KEEP_ALIVE_SECONDS - secondsSinceLastCommand
+                        self.trvHandlerLogger.debug(f'\'keepHeatSourceControllerAlive\':  Reminder for Heat Source Controller {indigo.devices[heatingId].name} not needed for another {int(keepAliveSeconds)} seconds')
                     # if there are thermostats calling for heat, the heating needs to be 'on'
-                    if len(self.globals['heaterDevices'][heatingId]['thermostatsCallingForHeat']) > 0:
+                    elif len(heaterDevice['thermostatsCallingForHeat']) > 0:
                         indigo.thermostat.setHvacMode(heatingId, value=HVAC_HEAT)  # remind Heat Source Controller to stay 'on'
+                        self.heatSourceCommandIssued(heaterDevice)
                         self.trvHandlerLogger.debug(f'\'keepHeatSourceControllerAlive\':  Reminding Heat Source Controller {indigo.devices[heatingId].name} to stay \'ON\'')
                     else:
                         indigo.thermostat.setHvacMode(heatingId, value=HVAC_OFF)  # remind Heat Source Controller to stay 'off'
+                        self.heatSourceCommandIssued(heaterDevice)
                         self.trvHandlerLogger.debug(f'\'keepHeatSourceControllerAlive\':  Reminding Heat Source Controller {indigo.devices[heatingId].name} to stay \'OFF\'')
                 except Exception as exception_error:
                     self.exception_handler(exception_error, True)  # Log error and display failing statement
-                finally:
-                    self.globals['lock'].release()
 
-                self.globals['timers']['heaters'][heatingId] = threading.Timer(3300.0, self.keepHeatSourceControllerAliveTimerTriggered, [heatingId])  # 3,300 seconds = 55 minutes :)
+                if heatingId in self.globals['timers']['heaters']:
+                    self.globals['timers']['heaters'][heatingId].cancel()  # Only ever one keep alive timer per Heat Source Controller
+                self.globals['timers']['heaters'][heatingId] = threading.Timer(keepAliveSeconds, self.keepHeatSourceControllerAliveTimerTriggered, [heatingId])
                 self.globals['timers']['heaters'][heatingId].setDaemon(True)
                 self.globals['timers']['heaters'][heatingId].start()
             else:
@@ -780,7 +995,7 @@ class ThreadTrvHandler(threading.Thread):
                     {'key': 'advanceActivatedTime', 'value': self.globals['trvc'][trvCtlrDevId]['advanceActivatedTime']},
                     {'key': 'advanceToScheduleTime', 'value': self.globals['trvc'][trvCtlrDevId]['advanceToScheduleTime']}
                 ]
-            indigo.devices[trvCtlrDevId].updateStatesOnServer(keyValueList)
+            self.updateControllerStates(trvCtlrDevId, keyValueList)
 
             self.trvHandlerLogger.info(f'TRV Controller \'{trvcDev.name}\' - {self.globals["trvc"][trvCtlrDevId]["advanceStatusUi"]}')
 
@@ -826,7 +1041,7 @@ class ThreadTrvHandler(threading.Thread):
                         {'key': 'advanceActivatedTime', 'value': self.globals['trvc'][trvCtlrDevId]['advanceActivatedTime']},
                         {'key': 'advanceToScheduleTime', 'value': self.globals['trvc'][trvCtlrDevId]['advanceToScheduleTime']}
                     ]
-                indigo.devices[trvCtlrDevId].updateStatesOnServer(keyValueList)
+                self.updateControllerStates(trvCtlrDevId, keyValueList)
 
                 if invokeProcessHeatingSchedule:
                     self.processHeatingSchedule(trvCtlrDevId)
@@ -879,7 +1094,7 @@ class ThreadTrvHandler(threading.Thread):
                             {'key': 'controllerMode', 'value': CONTROLLER_MODE_UI},
                             {'key': 'controllerModeUi', 'value':  CONTROLLER_MODE_TRANSLATION[CONTROLLER_MODE_UI]},
                             {'key': 'setpointHeat', 'value': newSetpoint}]
-            indigo.devices[trvCtlrDevId].updateStatesOnServer(keyValueList)
+            self.updateControllerStates(trvCtlrDevId, keyValueList)
 
             self.globals['timers']['boost'][trvCtlrDevId] = threading.Timer(float(boostMinutes * 60), self.boostCancelTriggered, [trvCtlrDevId, True])
             self.globals['timers']['boost'][trvCtlrDevId].setDaemon(True)
@@ -931,7 +1146,7 @@ class ThreadTrvHandler(threading.Thread):
                                 {'key': 'boostMinutes', 'value': int(self.globals['trvc'][trvCtlrDevId]['boostMinutes'])},
                                 {'key': 'boostTimeStart', 'value': self.globals['trvc'][trvCtlrDevId]['boostTimeStart']},
                                 {'key': 'boostTimeEnd', 'value': self.globals['trvc'][trvCtlrDevId]['boostTimeEnd']}]
-                indigo.devices[trvCtlrDevId].updateStatesOnServer(keyValueList)
+                self.updateControllerStates(trvCtlrDevId, keyValueList)
 
                 if invokeProcessHeatingSchedule:
                     self.globals['trvc'][trvCtlrDevId]['boostSetpointInvokeRestore'] = True
@@ -1070,7 +1285,7 @@ class ThreadTrvHandler(threading.Thread):
                     {'key': 'extendScheduleNewTime', 'value': self.globals['trvc'][trvCtlrDevId]['extendScheduleNewTime']},
                     {'key': 'extendLimitReached', 'value': self.globals['trvc'][trvCtlrDevId]['extendLimitReached']}
                 ]
-            indigo.devices[trvCtlrDevId].updateStatesOnServer(keyValueList)
+            self.updateControllerStates(trvCtlrDevId, keyValueList)
 
             self.trvHandlerLogger.info(
                 f'Extending current \'{currentScheduleActiveUi}\' schedule for \'{indigo.devices[trvCtlrDevId].name}\': Next \'{extendedNextScheduleScheduleActiveUi}\' Schedule Time of \'{self.globals["trvc"][trvCtlrDevId]["extendScheduleOriginalTime"]}\' altered to \'{self.globals["trvc"][trvCtlrDevId]["extendScheduleNewTime"]}\'')
@@ -1110,7 +1325,7 @@ class ThreadTrvHandler(threading.Thread):
                         {'key': 'extendScheduleNewTime', 'value': self.globals['trvc'][trvCtlrDevId]['extendScheduleNewTime']},
                         {'key': 'extendLimitReached', 'value': self.globals['trvc'][trvCtlrDevId]['extendLimitReached']}
                     ]
-                indigo.devices[trvCtlrDevId].updateStatesOnServer(keyValueList)
+                self.updateControllerStates(trvCtlrDevId, keyValueList)
 
                 self.trvHandlerLogger.info(f'Extend schedule cancelled for \'{indigo.devices[trvCtlrDevId].name}\'')
 
@@ -1187,7 +1402,7 @@ class ThreadTrvHandler(threading.Thread):
                             {'key': 'controllerModeUi', 'value': CONTROLLER_MODE_TRANSLATION[CONTROLLER_MODE_AUTO]},
                             {'key': 'setpointHeat', 'value': self.globals['trvc'][trvCtlrDevId]['setpointHeat']}
                         ]
-                    trvcDev.updateStatesOnServer(keyValueList)
+                    self.updateControllerStates(trvCtlrDevId, keyValueList)
                     self.trvHandlerLogger.debug(f'processHeatingSchedule: Adjusting TRV Controller \'{trvcDev.name}\' Setpoint Heat to {self.globals["trvc"][trvCtlrDevId]["setpointHeat"]}')
 
                 else:
@@ -1219,7 +1434,7 @@ class ThreadTrvHandler(threading.Thread):
                             {'key': 'controllerModeUi', 'value': CONTROLLER_MODE_TRANSLATION[CONTROLLER_MODE_AUTO]},
                             {'key': 'setpointHeat', 'value': self.globals['trvc'][trvCtlrDevId]['setpointHeat']}
                         ]
-                    trvcDev.updateStatesOnServer(keyValueList)
+                    self.updateControllerStates(trvCtlrDevId, keyValueList)
                     self.trvHandlerLogger.debug(f'processHeatingSchedule: Adjusting TRV Controller \'{trvcDev.name}\' Setpoint Heat to {self.globals["trvc"][trvCtlrDevId]["setpointHeat"]}')
 
                 schedule = scheduleList[nextSchedule]
@@ -1238,7 +1453,7 @@ class ThreadTrvHandler(threading.Thread):
                 nsetUi = f'{nsetTemp[0:2]}:{nsetTemp[2:4]}'  # e.g. 09:10
 
                 self.globals['trvc'][trvCtlrDevId]['nextScheduleExecutionTime'] = nsetUi
-                trvcDev.updateStateOnServer(key='nextScheduleExecutionTime', value=self.globals['trvc'][trvCtlrDevId]['nextScheduleExecutionTime'])
+                self.updateControllerStates(trvCtlrDevId, [{'key': 'nextScheduleExecutionTime', 'value': self.globals['trvc'][trvCtlrDevId]['nextScheduleExecutionTime']}])
 
             else:
 
@@ -1273,7 +1488,7 @@ class ThreadTrvHandler(threading.Thread):
                 keyValueList.append({'key': 'schedule3Active', 'value': schedule3Active})
                 keyValueList.append({'key': 'schedule4Active', 'value': schedule4Active})
                 keyValueList.append({'key': 'nextScheduleExecutionTime', 'value': self.globals['trvc'][trvCtlrDevId]['nextScheduleExecutionTime']})
-                trvcDev.updateStatesOnServer(keyValueList)
+                self.updateControllerStates(trvCtlrDevId, keyValueList)
 
                 initialiseHeatingScheduleLog = initialiseHeatingScheduleLog + f'\n@@  Current Time = {ct}, No schedule active or pending'
 
@@ -1303,7 +1518,8 @@ class ThreadTrvHandler(threading.Thread):
     def heatingScheduleTriggered(self, trvCtlrDevId):
 
         try:
-            time.sleep(2)  # wait 2 seconds
+            if self.threadStop.wait(2):  # wait 2 seconds (unless shutting down)
+                return
 
             self.trvHandlerLogger.info(f'Schedule Change Triggered for \'{indigo.devices[trvCtlrDevId].name}\'')
 
@@ -1320,7 +1536,7 @@ class ThreadTrvHandler(threading.Thread):
             if trvcDev.enabled:
                 self.trvHandlerLogger.info(f'Resetting schedules to default values for TRV Controller \'{trvcDev.name}\'')
                 indigo.device.enable(trvcDev.id, value=False)  # disable
-                time.sleep(5)
+                self.threadStop.wait(5)
                 indigo.device.enable(trvcDev.id, value=True)  # enable
 
         except Exception as exception_error:
@@ -1329,43 +1545,123 @@ class ThreadTrvHandler(threading.Thread):
     def restateSchedules(self):
         try:
             for trvcDev in indigo.devices.iter('self'):
+                if self.threadStop.is_set():
+                    break  # Shutting down
                 if trvcDev.enabled:
                     self.trvHandlerLogger.info(f'Forcing restatement of schedules to default values for TRV Controller \'{trvcDev.name}\'')
                     indigo.device.enable(trvcDev.id, value=False)  # disable
-                    time.sleep(5)
+                    self.threadStop.wait(5)
                     indigo.device.enable(trvcDev.id, value=True)  # enable
-                    time.sleep(2)
+                    self.threadStop.wait(2)
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+
+    def updateHeatSourceDemand(self, trvCtlrDevId, callingForHeat):
+
+        # Add / remove the TRV Controller from the set of thermostats calling for heat of its heat source device and / or variable.
+        # No lock is needed: a heat source's demand and on / off state are only changed on the TRV Handler thread (controlTrv, the
+        # heat source commands and keep alive are all queued to it) - the plugin thread only reads them for reports.
+
+        try:
+            heatSources = list()
+            if self.globals['trvc'][trvCtlrDevId]['heatingId'] > 0:
+                heatSources.append(self.globals['heaterDevices'][self.globals['trvc'][trvCtlrDevId]['heatingId']])
+            if self.globals['trvc'][trvCtlrDevId]['heatingVarId'] > 0:
+                heatSources.append(self.globals['heaterVariables'][self.globals['trvc'][trvCtlrDevId]['heatingVarId']])
+
+            for heatSource in heatSources:
+                if callingForHeat:
+                    heatSource['thermostatsCallingForHeat'].add(trvCtlrDevId)
+                else:
+                    heatSource['thermostatsCallingForHeat'].discard(trvCtlrDevId)
 
         except Exception as exception_error:
             self.exception_handler(exception_error, True)  # Log error and display failing statement
 
     # noinspection PyUnusedLocal
-    def updateAllCsvFilesViaPostgreSQL(self, trvCtlrDevId, overrideDefaultRetentionHours, overrideCsvFilePrefix):
+    def updateAllCsvFilesViaPostgreSQL(self, trvCtlrDevId, overrideDefaultRetentionHours, overrideCsvFilePrefix, database=None):
+
+        # Write the CSV file of each of the TRV Controller's states, all from one history database connection. The database is opened and
+        # closed here unless one is passed in e.g. by the export job. Returns the number of CSV files written.
 
+        csvFilesWritten = 0
         try:
             # if not self.globals['config']['csvPostgresqlEnabled'] or not self.psycopg2_imported or not self.globals['trvc'][trvCtlrDevId]['updateAllCsvFilesViaPostgreSQL']:
             if not self.globals['config']['csvPostgresqlEnabled'] or not self.globals['trvc'][trvCtlrDevId]['updateAllCsvFilesViaPostgreSQL']:
-                return
+                return csvFilesWritten
 
-            self._updateCsvFileViaPostgreSQL(trvCtlrDevId, overrideDefaultRetentionHours, overrideCsvFilePrefix, 'setpointHeat')                
-            self._updateCsvFileViaPostgreSQL(trvCtlrDevId, overrideDefaultRetentionHours, overrideCsvFilePrefix, 'temperatureTrv')                
-            self._updateCsvFileViaPostgreSQL(trvCtlrDevId, overrideDefaultRetentionHours, overrideCsvFilePrefix, 'setpointHeatTrv')                
+            stateNames = ['setpointHeat', 'temperatureTrv', 'setpointHeatTrv']
             if self.globals['trvc'][trvCtlrDevId]['valveDevId'] != 0:
-                self._updateCsvFileViaPostgreSQL(trvCtlrDevId, overrideDefaultRetentionHours, overrideCsvFilePrefix, 'valvePercentageOpen')                
+                stateNames.append('valvePercentageOpen')
             if self.globals['trvc'][trvCtlrDevId]['remoteDevId'] != 0:
-                self._updateCsvFileViaPostgreSQL(trvCtlrDevId, overrideDefaultRetentionHours, overrideCsvFilePrefix, 'temperatureRemote')                
+                stateNames.append('temperatureRemote')
                 if self.globals['trvc'][trvCtlrDevId]['remoteSetpointHeatControl']:
-                    self._updateCsvFileViaPostgreSQL(trvCtlrDevId, overrideDefaultRetentionHours, overrideCsvFilePrefix, 'setpointHeatRemote')                
+                    stateNames.append('setpointHeatRemote')
+
+            historyDatabase = self.openHistoryDatabase() if database is None else database
+            if historyDatabase is None:
+                return csvFilesWritten
+            try:
+                for stateName in stateNames:
+                    if self._updateCsvFileViaPostgreSQL(trvCtlrDevId, overrideDefaultRetentionHours, overrideCsvFilePrefix, stateName, historyDatabase):
+                        csvFilesWritten += 1
+            finally:
+                if database is None and historyDatabase is not self.globals['historyDatabase']:
+                    historyDatabase.close()
 
         except Exception as exception_error:
             self.exception_handler(exception_error, True)  # Log error and display failing statement
 
+        return csvFilesWritten
+
+    def _updateCsvFileViaPostgreSQL(self, trvCtlrDevId, overrideDefaultRetentionHours, overrideCsvFilePrefix, stateName, database):
+
+        # Write a state's CSV file (in the same layout as a Standard CSV file) from the history database for the retention period. Returns True if written.
+
+        try:
+            if overrideDefaultRetentionHours > 0:
+                csvRetentionPeriodHours = overrideDefaultRetentionHours
+            else:
+                csvRetentionPeriodHours = self.globals['trvc'][trvCtlrDevId]['csvRetentionPeriodHours']
+
+            dateTimeNow = datetime.datetime.now()
+            startTime = dateTimeNow - datetime.timedelta(hours=csvRetentionPeriodHours)
+
+            csvShortName = self.globals['trvc'][trvCtlrDevId]['csvShortName']
+            csvFilePrefix = overrideCsvFilePrefix if overrideCsvFilePrefix != '' else self.globals['config']['csvPrefix']
+            csvFilename = f'{self.globals["config"]["csvPath"]}/{csvFilePrefix}_{csvShortName}_{stateName}.csv'
+
+            headerName = f'{indigo.devices[trvCtlrDevId].name} - {stateName}'.replace(',', '_')  # Replace any commas with underscore to avoid CSV file problems
+
+            self.trvHandlerLogger.debug(f'CSV FILE NAME = \'{csvFilename}\', Time = \'{startTime}\', State = \'{stateName}\'')
+
+            if isinstance(database, PostgresqlHistory):
+                # Streamed by the server straight into the file
+                with replacedOnClose(csvFilename, 'wb', buffering=HISTORY_COPY_BUFFER_BYTES) as csvFileOut:
+                    csvFileOut.write(f'Timestamp,{headerName}\n'.encode('utf-8'))
+                    copiedLines, copiedBytes = database.copyStateCsv(trvCtlrDevId, stateName, startTime.timestamp(), dateTimeNow.timestamp(), csvFileOut)
+                self.trvHandlerLogger.debug(f'CSV FILE NAME = \'{csvFilename}\': {copiedLines} rows, {copiedBytes} bytes copied')
+            else:
+                with replacedOnClose(csvFilename, 'w') as csvFileOut:
+                    csvFileOut.write(f'Timestamp,{headerName}\n')
+                    for rowTime, rowValues in history(database, trvCtlrDevId, [stateName], startTime.timestamp(), dateTimeNow.timestamp()):
+                        if rowValues[0] is not None:  # No value before the state's first change
+                            csvFileOut.write(f'{datetime.datetime.fromtimestamp(rowTime).strftime("%Y-%m-%d %H:%M:%S.%f")},{rowValues[0]}\n')
+            return True
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+            return False
+
     # noinspection PyUnusedLocal
-    def updateDatagraphCsvFileViaPostgreSQL(self, trvCtlrDevId, overrideDefaultRetentionHours, overrideCsvFilePrefix):
+    def updateDatagraphCsvFileViaPostgreSQL(self, trvCtlrDevId, overrideDefaultRetentionHours, overrideCsvFilePrefix, database=None, render=True):
+
+        # Returns the DataGraph CSV file name, or None if it wasn't written
 
         try:
             if not self.globals['config']['csvPostgresqlEnabled'] or not self.globals['trvc'][trvCtlrDevId]['updateDatagraphCsvFileViaPostgreSQL']:
-                return
+                return None
 
             state_names_list = list()
             state_names_list.append('setpointHeat')
@@ -1380,12 +1676,13 @@ class ThreadTrvHandler(threading.Thread):
             if self.globals['trvc'][trvCtlrDevId]['valveDevId'] != 0:
                 state_names_list.append('valvePercentageOpen')
 
-            self._invokeDatagraphUsingPostgresqlToCsv(trvCtlrDevId, overrideDefaultRetentionHours, overrideCsvFilePrefix, state_names_list)
+            return self._invokeDatagraphUsingPostgresqlToCsv(trvCtlrDevId, overrideDefaultRetentionHours, overrideCsvFilePrefix, state_names_list, database, render)
 
             # TODO: ???
 
         except Exception as exception_error:
             self.exception_handler(exception_error, True)  # Log error and display failing statement
+            return None
 
     def updateAllCsvFiles(self, trvCtlrDevId):
 
@@ -1408,63 +1705,10 @@ class ThreadTrvHandler(threading.Thread):
 
     def updateCsvFile(self, trvCtlrDevId, stateName, updateValue):
 
-        try:
-            if not self.globals['config']['csvStandardEnabled'] or self.globals['trvc'][trvCtlrDevId]['csvCreationMethod'] != 1:  # Standard CSV Output
-                return
-
-            dateTimeNow = datetime.datetime.now()
-            dateTimeNowStr = dateTimeNow.strftime("%Y-%m-%d %H:%M:%S.%f")
-
-            checkTime = dateTimeNow - datetime.timedelta(hours=self.globals['trvc'][trvCtlrDevId]['csvRetentionPeriodHours'])
-            checkTimeStr = checkTime.strftime("%Y-%m-%d %H:%M:%S.%f")
-
-            csvShortName = self.globals['trvc'][trvCtlrDevId]['csvShortName']
-            csvFileNamePathPrefix = f'{self.globals["config"]["csvPath"]}/{self.globals["config"]["csvPrefix"]}'
+        # Add the state's new value to its Standard CSV file - written by the CSV Writer thread
 
-            csvFilename = f'{csvFileNamePathPrefix}_{csvShortName}_{stateName}.csv'
-
-            headerName = f'{indigo.devices[trvCtlrDevId].name} - {stateName}'
-
-            dataIn = []
-            try:
-                with open(csvFilename) as csvFileIn:
-                    for line in csvFileIn:
-                        line = line.strip()  # or some other pre-processing
-                        dataIn.append(line)
-                if len(dataIn) > 0:
-                    dataIn.pop(0)  # Remove header
-            except IOError:
-                pass  # IO Error can validly occur if file hasn't yet been created
-
-            csvFileOut = open(csvFilename, 'w')
-
-            self.trvHandlerLogger.debug(f'CSV FILE NAME = \'{csvFilename}\', Time = \'{checkTimeStr}\', State = \'{stateName}\', Value = \'{updateValue}\'')
-
-            headerName = headerName.replace(',', '_')  # Replace any commas with underscore to avoid CSV file problems
-            csvFileOut.write(f'Timestamp,{headerName}\n')  # Write out header
-
-            # droppedRowsFlag = False
-            droppedRow = ''
-            # writtenRowCount = 0
-            firstRowWrittenFlag = False 
-            for row in dataIn:
-                if row[0:26] < checkTimeStr:  # e.g. 2017-04-09 17:26:13.956000
-                    # droppedRowsFlag = True
-                    droppedRow = row
-                    continue
-                elif row[0:26] == checkTimeStr:
-                    pass
-                else:
-                    if not firstRowWrittenFlag:
-                        firstRowWrittenFlag = True
-                        if droppedRow != '':
-                            firstRow = checkTimeStr + droppedRow[26:]
-                        else:
-                            firstRow = checkTimeStr + row[26:]
-                        csvFileOut.write(f'{firstRow}\n')  # Output modified CSV data line
-                csvFileOut.write(f'{row}\n')  # Output CSV data line as not older than retention limit
-            csvFileOut.write(f'{dateTimeNowStr},{updateValue}\n')
-            csvFileOut.close()
+        try:
+            self.globals['threads']['csvWriter']['thread'].addRow(trvCtlrDevId, stateName, updateValue)
 
         except Exception as exception_error:
             self.exception_handler(exception_error, True)  # Log error and display failing statement
@@ -1692,7 +1936,7 @@ class ThreadTrvHandler(threading.Thread):
                     updateDeviceStatesLog = updateDeviceStatesLog + '\nXX  States to be updated in the TRV Controller device:'
                     for itemToUpdate in updateKeyValueList:
                         updateDeviceStatesLog = updateDeviceStatesLog + f'\nXX    > {itemToUpdate}'
-                    dev.updateStatesOnServer(updateKeyValueList)
+                    self.updateControllerStates(trvCtlrDevId, updateKeyValueList)
                 else:
                     updateDeviceStatesLog = updateDeviceStatesLog + '\nXX  No States to be updated in the TRV Controller device:'
 
@@ -1712,32 +1956,37 @@ class ThreadTrvHandler(threading.Thread):
         # except:
             # self.trvHandlerLogger.error(f'Unexpected Exception detected in TRV Handler Thread [updateDeviceStates]. Line \'{sys.exc_traceback.tb_lineno}\' has error=\'{sys.exc_info()[0]}\'')
 
-    def _invokeDatagraphUsingPostgresqlToCsv(self, trvCtlrDevId, overrideDefaultRetentionHours, overrideCsvFilePrefix, state_name_list):
-        try:
-            # Dynamically create CSV files from SQL Logger
+    def openHistoryDatabase(self):
+        # The history backend database CSV exports read from: the plugin's SQLite history database or a PostgresqlHistory connected to the
+        # SQL Logger's database, which the caller closes. Returns None (having logged why) if the PostgreSQL database can't be opened.
 
-            postgreSQLSupported = False
-            database = None
-            user = 'UNKNOWN'  # Suppress PyCharm warning
-            try:
-                user = self.globals['config']['postgresqlUser']
-                password = self.globals['config']['postgresqlPassword']
+        if self.globals['config']['csvDatabase'] == 'sqlite':
+            return self.globals['historyDatabase']
 
-                database_open_string = f"pq://{user}:{password}@127.0.0.1:5432/indigo_history"
+        user = self.globals['config']['postgresqlUser']
+        try:
+            password = self.globals['config']['postgresqlPassword']
 
-                database = postgresql.open(database_open_string)
+            database_open_string = f"pq://{user}:{password}@127.0.0.1:5432/indigo_history"
 
-                postgreSQLSupported = True
+            return PostgresqlHistory(postgresql.open(database_open_string))
 
-            except Exception as error_detail:  # TODO: Make sure this works using Python 3
-                errString = f'{error_detail}'
-                if errString.find('role') != -1 and errString.find('does not exist') != -1:
-                    self.trvHandlerLogger.error(f'PostgreSQL user \'{user}\' (specified in plugin config) is invalid')
-                else:
-                    self.trvHandlerLogger.error(f'PostgreSQL not supported or connection attempt invalid. Reason: {error_detail}')
+        except Exception as error_detail:  # TODO: Make sure this works using Python 3
+            errString = f'{error_detail}'
+            if errString.find('role') != -1 and errString.find('does not exist') != -1:
+                self.trvHandlerLogger.error(f'PostgreSQL user \'{user}\' (specified in plugin config) is invalid')
+            else:
+                self.trvHandlerLogger.error(f'PostgreSQL not supported or connection attempt invalid. Reason: {error_detail}')
+            return None
 
-            if not postgreSQLSupported:
-                return
+    def _invokeDatagraphUsingPostgresqlToCsv(self, trvCtlrDevId, overrideDefaultRetentionHours, overrideCsvFilePrefix, state_name_list, database=None, render=True):
+        try:
+            # Dynamically create CSV files from SQL Logger - from the database passed in (left open) or one opened and closed here - and, if
+            # render is set, the graph from the CSV file. Returns the CSV file name, or None if it wasn't written.
+
+            history_database = self.openHistoryDatabase() if database is None else database
+            if history_database is None:
+                return None
 
             if overrideDefaultRetentionHours > 0:
                 csvRetentionPeriodHours = overrideDefaultRetentionHours
@@ -1746,121 +1995,29 @@ class ThreadTrvHandler(threading.Thread):
 
             end_date_time_now = datetime.datetime.now()
             start_time = end_date_time_now - datetime.timedelta(hours=csvRetentionPeriodHours)
-            start_time_postgres = start_time.strftime("%Y-%m-%d %H:%M:%S.000000")
-            start_time_for_csv = start_time_postgres[0:19]  # e.g. YYY-MM-DD HH:MM:SS
-            end_date_time_now_for_csv = end_date_time_now.strftime("%Y-%m-%d %H:%M:%S")  # e.g. YYY-MM-DD HH:MM:SS
-
-            DT = 0
-            CS = 1
-            TS = 2
-            TT = 3
-            RD = 4
-            RS = 5
-            RT = 6
-            V = 7
-
-            state_names_translation = dict()
-            state_names_translation["setpointHeat"] = CS
-            state_names_translation["setpointHeatTrv"] = TS
-            state_names_translation["temperatureTrv"] = TT
-            state_names_translation["temperatureRadiator"] = RD
-            state_names_translation["setpointHeatRemote"] = RS
-            state_names_translation["temperatureRemote"] = RT
-            state_names_translation["valvePercentageOpen"] = V
-
-            # Determine states passed to this method and create a CSV header record for states passed to this method
-
-            process_state_cs = False
-            process_state_ts = False
-            process_state_tt = False
-            process_state_rd = False
-            process_state_rs = False
-            process_state_rt = False
-            process_state_v = False
-
-            header_states = dict()
-            for state_name in state_name_list:
-                state_name_code = state_names_translation[state_name]
-                header_states[state_name_code] = True
-
-            # 1. Create a CSV header record for states passed to this method
-            # 2. Create a dictionary to record the states events
-            # 3. Create the last (time now) entry based on states passed to this method
-
-            events = dict()
-            events[start_time_for_csv] = dict()  # Store start time entry
-            events[end_date_time_now_for_csv] = dict()  # Store Last (time now) entry
-
-            header_for_csv = "DT"
-            if CS in header_states and header_states[CS]:
-                header_for_csv += ",CS"
-                events[end_date_time_now_for_csv][CS] = 0
-                process_state_cs = True
-            if TS in header_states and header_states[TS]:
-                header_for_csv += ",TS"
-                events[end_date_time_now_for_csv][TS] = 0
-                process_state_ts = True
-            if TT in header_states and header_states[TT]:
-                header_for_csv += ",TT"
-                events[end_date_time_now_for_csv][TT] = 0
-                process_state_tt = True
-            if RD in header_states and header_states[RD]:
-                header_for_csv += ",RD"
-                events[end_date_time_now_for_csv][RD] = 0
-                process_state_rd = True
-            if RS in header_states and header_states[RS]:
-                header_for_csv += ",RS"
-                events[end_date_time_now_for_csv][RS] = 0
-                process_state_rs = True
-            if RT in header_states and header_states[RT]:
-                header_for_csv += ",RT"
-                events[end_date_time_now_for_csv][RT] = 0
-                process_state_rt = True
-            if V in header_states and header_states[V]:
-                header_for_csv += ",V"
-                events[end_date_time_now_for_csv][V] = 0
-                process_state_v = True
-
-            # Now process each state
-            for state_name in state_name_list:
-
-                selectString = f"SELECT ts, {state_name} FROM device_history_{trvCtlrDevId} WHERE ( ts >= '{start_time_postgres}' AND  {state_name} IS NOT NULL) ORDER BY ts"  # NOQA - YYYY-MM-DD HH:MM:SS
-                ps = database.prepare(selectString)
-                rows = ps()
-
-                # At this point the specific state entries have been retrieved for the selected period. They now need to be topped and tailed to be able to create nice graphs
-                # The following select finds the entry just prior to the start of the period to use as the first value
-
-                selectString2 = (f"SELECT ts, {state_name} FROM device_history_{trvCtlrDevId} WHERE ( ts < '{start_time_postgres}' AND {state_name} IS NOT NULL) ORDER BY ts DESC LIMIT 1")    # noqa [suppress no data sources help message] - YYYY-MM-DD HH:MM:SS
-                ps2 = database.prepare(selectString2)
-                droppedRows = ps2()
-                if len(droppedRows) == 0:  # No entries yet available for whole period, so exit  TODO: Double Check this??? 16-April-2022
-                    droppedRow = ["?", 0.0]
-                else:
-                    droppedRow = droppedRows[0]
-
-                def set_event(event_date_time):
-                    if event_date_time not in events:
-                        events[event_date_time] = dict()
-
-                state_name_code = state_names_translation[state_name]
 
-                # Store first entry.
-                dataValue = droppedRow[1]
-                events[start_time_for_csv][state_name_code] = dataValue
-                # Default last entry to equal first entry
-                events[end_date_time_now_for_csv][state_name_code] = dataValue
-
-                # Store entries for the state
-                for row in rows:
-                    # dt = row[0].strftime("%Y-%m-%d %H:%M:%S.%f")
-                    dt = row[0].strftime("%Y-%m-%d %H:%M:%S")  # e.g. YYYY-MM-DD HH:MM:SS
-                    set_event(dt)
-                    dataValue = row[1]
-                    events[dt][state_name_code] = dataValue
-                    events[end_date_time_now_for_csv][state_name_code] = dataValue
-
-            sorted_events = sorted(events.items())
+            # CSV columns (in DataGraph template order) for the states passed to this method
+
+            datagraph_columns = (("setpointHeat", "CS"), ("setpointHeatTrv", "TS"), ("temperatureTrv", "TT"), ("temperatureRadiator", "RD"),
+                                 ("setpointHeatRemote", "RS"), ("temperatureRemote", "RT"), ("valvePercentageOpen", "V"))
+            column_state_names = [state_name for state_name, column_name in datagraph_columns if state_name in state_name_list]
+            header_for_csv = "DT" + "".join([f",{column_name}" for state_name, column_name in datagraph_columns if state_name in state_name_list])
+
+            # Bucketed: the database reduces each state to its minimum / maximum / mean / last value per bucket, with buckets sized to keep the
+            # graph within the point budget. A state's column is its bucket mean (temperatures) or last value, followed by columns of the
+            # minimum and maximum e.g. TT_MIN, TT_MAX. Used if DataGraph bucketing is enabled or, regardless, if the period has more rows than
+            # the point budget - so a long period is never exported row by row.
+
+            bucket_seconds = None
+            point_budget = self.globals['config']['datagraphPointBudget']
+            if self.globals['config']['datagraphBucketingEnabled'] or sum([history_database.rowCount(trvCtlrDevId, state_name, start_time.timestamp(), end_date_time_now.timestamp())
+                                                                           for state_name in column_state_names]) > point_budget:
+                bucket_seconds = historyBucketSeconds(csvRetentionPeriodHours * 3600, point_budget)
+                history_source = BucketedHistory(history_database, bucket_seconds)
+                header_for_csv += "".join([f",{column_name}_MIN,{column_name}_MAX" for state_name, column_name in datagraph_columns if state_name in state_name_list])
+                bucket_value_indexes = [BUCKET_MEAN if state_name in TIME_SERIES_AVERAGED_STATES else BUCKET_LAST for state_name in column_state_names]
+            else:
+                history_source = history_database
 
             csvShortName = self.globals['trvc'][trvCtlrDevId]['csvShortName']
             if overrideCsvFilePrefix != '':
@@ -1870,46 +2027,38 @@ class ThreadTrvHandler(threading.Thread):
             csvFileNamePathPrefix = f'{self.globals["config"]["csvPath"]}/{csvFilePrefix}'
             csvFilename = f'{csvFileNamePathPrefix}_{csvShortName}.csv'
 
-            csvFileOut = open(csvFilename, 'w')
-            self.trvHandlerLogger.debug(f'CSV FILE NAME = \'{csvFilename}\', Time = \'{start_time_for_csv}\'')
-
-            csvFileOut.write(f'{header_for_csv}\n')  # Write out header
-
-            line = ""
-            for key, value in sorted_events:
-                line = f"{key},"
-                if process_state_cs:
-                    if CS in events[key]:
-                        line += f"{events[key][CS]}"
-                    line += ","
-                if process_state_ts:
-                    if TS in events[key]:
-                        line += f"{events[key][TS]}"
-                    line += ","
-                if process_state_tt:
-                    if TT in events[key]:
-                        line += f"{events[key][TT]}"
-                    line += ","
-                if process_state_rd:
-                    if RD in events[key]:
-                        line += f"{events[key][RD]}"
-                    line += ","
-                if process_state_rs:
-                    if RS in events[key]:
-                        line += f"{events[key][RS]}"
-                    line += ","
-                if process_state_rt:
-                    if RT in events[key]:
-                        line += f"{events[key][RT]}"
-                    line += ","
-                if process_state_v:
-                    if V in events[key]:
-                        line += f"{events[key][V]}"
-                csvFileOut.write(f'{line}\n')
-
-            csvFileOut.close()
-
-            # Now create the graph
+            self.trvHandlerLogger.debug(f'CSV FILE NAME = \'{csvFilename}\', Time = \'{start_time.strftime("%Y-%m-%d %H:%M:%S")}\', Bucket Seconds = \'{bucket_seconds}\'')
+
+            # One row at the start of the period and at now with every state's value, in between a row for each change with only the changed states
+
+            try:
+                with replacedOnClose(csvFilename, 'w') as csvFileOut:
+                    csvFileOut.write(f'{header_for_csv}\n')  # Write out header
+                    for row_time, row_values in history(history_source, trvCtlrDevId, column_state_names, start_time.timestamp(), end_date_time_now.timestamp(), fill=HISTORY_FILL_NONE):
+                        line = datetime.datetime.fromtimestamp(row_time).strftime("%Y-%m-%d %H:%M:%S")  # e.g. YYYY-MM-DD HH:MM:SS
+                        if bucket_seconds is None:
+                            line += "".join(["," if value is None else f",{value}" for value in row_values])
+                        else:
+                            line += "".join(["," if bucket is None else f",{round(bucket[value_index], 2)}" for bucket, value_index in zip(row_values, bucket_value_indexes)])
+                            line += "".join([",," if bucket is None else f",{bucket[BUCKET_MINIMUM]},{bucket[BUCKET_MAXIMUM]}" for bucket in row_values])
+                        csvFileOut.write(f'{line}\n')
+            finally:
+                if database is None and history_database is not self.globals['historyDatabase']:
+                    history_database.close()
+
+            if render:
+                self.renderDatagraph(trvCtlrDevId, csvFilename)
+
+            return csvFilename
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+            return None
+
+    def renderDatagraph(self, trvCtlrDevId, csvFilename):
+        # Run the DataGraph command line utility on the TRV Controller's DataGraph CSV file. Returns True if DataGraph reported no error. The
+        # render is skipped if nothing it depends on has changed since the TRV Controller's previous render (see datagraphRenderCache.py).
+        try:
             graph_template_filename = indigo.devices[trvCtlrDevId].ownerProps.get("datagraphTemplateFilename", "")
             graph_template_full_path = f"{self.globals['config']['datagraphGraphTemplatesPath']}/{graph_template_filename}"
 
@@ -1919,6 +2068,11 @@ class ThreadTrvHandler(threading.Thread):
             graph_title = indigo.devices[trvCtlrDevId].ownerProps.get("datagraphChartTitle", "NO TITLE")
             graph_full_title = f"Title={graph_title}"
 
+            render_digest = datagraphInputDigest(csvFilename, (self.globals['config']['datagraphCliPath'], graph_template_full_path, graph_output_image_full_path, graph_full_title))
+            if self.globals['datagraphRenders'].unchanged(trvCtlrDevId, render_digest, graph_output_image_full_path):
+                self.trvHandlerLogger.debug(f'DataGraph render of \'{csvFilename}\' skipped as unchanged since the previous render')
+                return True
+
             result = subprocess.run([self.globals['config']['datagraphCliPath'], csvFilename, "-script", graph_template_full_path, "-output", graph_output_image_full_path,
                                      "-v", graph_full_title], capture_output=True, text=True)
 
@@ -1927,8 +2081,13 @@ class ThreadTrvHandler(threading.Thread):
 
             if result.stderr != "":
                 self.trvHandlerLogger.error(f'DataGraph Error: {result.stderr}')
+                return False  # Not cached, so the next export renders again
             elif result.stdout != "":
                 self.trvHandlerLogger.warning(f'DataGraph Warning: {result.stdout}')
 
+            self.globals['datagraphRenders'].rendered(trvCtlrDevId, render_digest)
+            return True
+
         except Exception as exception_error:
-            self.exception_handler(exception_error, True)  # Log error and display failing statement
\ No newline at end of file
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+            return False
\ No newline at end of file
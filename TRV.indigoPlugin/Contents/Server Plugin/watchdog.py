@@ -0,0 +1,164 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Watchdog © Autolog 2022
+#
+
+try:
+    # noinspection PyUnresolvedReferences
+    import indigo
+except ImportError:
+    pass
+
+import datetime
+import sys
+import threading
+import time
+import traceback
+
+from constants import *
+
+
+# noinspection PyPep8Naming
+class HandlerActivity:
+
+    # What a handler thread is doing - updated by the handler thread, read by the watchdog thread
+
+    def __init__(self):
+        self.lastDequeueTime = time.time()
+        self.current = None  # (command, devId, startTime) while a command is being processed - a single attribute so it is read consistently
+
+    def commandStarted(self, command, devId):
+        self.lastDequeueTime = time.time()
+        self.current = (command, devId, self.lastDequeueTime)
+
+    def commandFinished(self):
+        self.current = None
+
+
+# noinspection PyUnresolvedReferences, PyPep8Naming
+class ThreadWatchdog(threading.Thread):
+
+    # Checks the TRV Handler and Delay Handler threads every WATCHDOG_CHECK_SECONDS:
+    #   - a command running for longer than its budget is reported with the handler thread's stack
+    #   - a queue with entries waiting that hasn't been serviced for WATCHDOG_QUEUE_STALL_SECONDS is reported as stalled
+    # Each started TRV Controller shows the TRV Handler status in 'handlerStatus' and, while the TRV Handler is healthy, the time of the
+    # latest check in 'handlerHeartbeat' - a heartbeat that stops advancing means heating control has stopped.
+    # States are written directly, not via the TRV Handler, as the TRV Handler may be the thread that is stuck.
+
+    def __init__(self, pluginGlobals, event):
+
+        threading.Thread.__init__(self, name='TRV_Watchdog')
+
+        self.globals = pluginGlobals
+
+        self.watchdogLogger = logging.getLogger("Plugin.Watchdog")
+
+        self.threadStop = event
+
+        self.reported = dict()  # threadName -> startTime of the command (or 'queue') already reported as stalled
+        self.handlerStatus = WATCHDOG_STATUS_OK
+        self.lastHeartbeatTime = 0.0
+
+    def run(self):
+
+        self.watchdogLogger.debug('Watchdog Thread initialised')
+
+        while not self.threadStop.wait(WATCHDOG_CHECK_SECONDS):
+            try:
+                self.checkHandlers()
+            except Exception as exception_error:
+                self.watchdogLogger.error(f'Watchdog check failed: {exception_error}')
+
+        self.watchdogLogger.debug('Watchdog Thread ended.')
+
+    def checkHandlers(self):
+        now = time.time()
+        handlerStatus = WATCHDOG_STATUS_OK
+
+        for threadName, threadNameUi in (('trvHandler', 'TRV Handler'), ('delayHandler', 'Delay Handler')):
+            activity = self.globals['watchdog'][threadName]
+            handlerThread = self.globals['threads'][threadName].get('thread', None)
+            if handlerThread is None:
+                continue
+
+            if not handlerThread.is_alive():
+                if self.reported.get(threadName, None) != 'ended':
+                    self.reported[threadName] = 'ended'
+                    self.recordStall(threadName, None, None, 0.0, '', f'Watchdog: {threadNameUi} thread has ended - no further commands will be processed')
+                if threadName == 'trvHandler':
+                    handlerStatus = 'Stopped'
+                continue
+
+            current = activity.current
+            if current is not None:
+                command, devId, startTime = current
+                elapsedSeconds = now - startTime
+                budgetSeconds = self.commandBudgetSeconds(command)
+                if elapsedSeconds > budgetSeconds:
+                    if threadName == 'trvHandler':
+                        handlerStatus = f'Stalled: {CMD_TRANSLATION.get(command, command)}'
+                    if self.reported.get(threadName, None) != startTime:
+                        self.reported[threadName] = startTime
+                        stack = self.threadStack(handlerThread)
+                        deviceUi = f' for \'{indigo.devices[devId].name}\'' if devId is not None and devId in indigo.devices else ''
+                        self.recordStall(threadName, command, devId, elapsedSeconds, stack,
+                                         f'Watchdog: {threadNameUi} command \'{CMD_TRANSLATION.get(command, command)}\'{deviceUi} has been running for {elapsedSeconds:.0f} seconds'
+                                         f' [budget {budgetSeconds:.0f} seconds]\n{stack}')
+                    continue
+
+            elif self.globals['queues'][threadName].qsize() > 0 and now - activity.lastDequeueTime > WATCHDOG_QUEUE_STALL_SECONDS:
+                if threadName == 'trvHandler':
+                    handlerStatus = 'Stalled: Queue not serviced'
+                if self.reported.get(threadName, None) != 'queue':
+                    self.reported[threadName] = 'queue'
+                    stack = self.threadStack(handlerThread)
+                    self.recordStall(threadName, None, None, now - activity.lastDequeueTime, stack,
+                                     f'Watchdog: {threadNameUi} queue has {self.globals["queues"][threadName].qsize()} entries waiting but nothing has been dequeued for'
+                                     f' {now - activity.lastDequeueTime:.0f} seconds\n{stack}')
+                continue
+
+            if threadName in self.reported:
+                del self.reported[threadName]
+                self.watchdogLogger.info(f'Watchdog: {threadNameUi} has recovered')
+
+        self.updateControllerHeartbeats(now, handlerStatus)
+
+    def commandBudgetSeconds(self, command):
+        if command == CMD_RESTATE_SCHEDULES:
+            # Restating schedules pauses for several seconds per TRV Controller
+            return WATCHDOG_COMMAND_BUDGET_DEFAULT_SECONDS + (WATCHDOG_RESTATE_SECONDS_PER_CONTROLLER * len(self.globals['trvc']))
+        return WATCHDOG_COMMAND_BUDGETS_SECONDS.get(command, WATCHDOG_COMMAND_BUDGET_DEFAULT_SECONDS)
+
+    @staticmethod
+    def threadStack(handlerThread):
+        frame = sys._current_frames().get(handlerThread.ident, None)  # noqa [Access to a protected member] - The only way to see another thread's stack
+        return ''.join(traceback.format_stack(frame)) if frame is not None else ''
+
+    def recordStall(self, threadName, command, devId, elapsedSeconds, stack, message):
+        self.globals['watchdog']['stalls'].append({'time': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                                                   'thread': threadName,
+                                                   'command': command,
+                                                   'devId': devId,
+                                                   'elapsedSeconds': round(elapsedSeconds, 1),
+                                                   'stack': stack})
+        self.watchdogLogger.error(message)
+
+    def updateControllerHeartbeats(self, now, handlerStatus):
+        statusChanged = handlerStatus != self.handlerStatus
+        heartbeatDue = handlerStatus == WATCHDOG_STATUS_OK and now - self.lastHeartbeatTime >= WATCHDOG_HEARTBEAT_SECONDS
+        if not statusChanged and not heartbeatDue:
+            return
+
+        self.handlerStatus = handlerStatus
+        keyValueList = [{'key': 'handlerStatus', 'value': handlerStatus}]
+        if heartbeatDue:
+            self.lastHeartbeatTime = now
+            keyValueList.append({'key': 'handlerHeartbeat', 'value': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')})
+
+        for trvCtlrDevId, trvc in list(self.globals['trvc'].items()):
+            try:
+                if trvc.get('deviceStarted', False):
+                    indigo.devices[trvCtlrDevId].updateStatesOnServer(keyValueList)
+            except Exception as exception_error:
+                self.watchdogLogger.debug(f'Watchdog: unable to update heartbeat of device id {trvCtlrDevId}: {exception_error}')
@@ -0,0 +1,153 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Z-Wave Capture © Autolog 2022
+#
+
+import math
+import os
+import struct
+import threading
+import time
+
+ZWAVE_CAPTURE_FILE_NAME = 'zwaveCapture.bin'
+ZWAVE_CAPTURE_FILE_MEGABYTES_DEFAULT = 5
+ZWAVE_CAPTURE_FILES_DEFAULT = 5
+ZWAVE_CAPTURE_FLUSH_SECONDS = 1.0
+
+# File layout: FILE_MAGIC, then one record per frame: <length: uint16> <RECORD_HEADER> <frame bytes>, length covering header and frame bytes
+FILE_MAGIC = b'TRVZWCAP\x01'
+RECORD_LENGTH = struct.Struct('<H')
+RECORD_HEADER = struct.Struct('<dBHHbf')  # timestamp, direction, nodeId, endpoint, cmdSuccess, timeDelta
+DIRECTION_SENT = 0
+DIRECTION_RECEIVED = 1
+NONE_NODE = 0xFFFF  # nodeId / endpoint of None
+NONE_SUCCESS = -1  # cmdSuccess of None - timeDelta of None is stored as NaN
+
+
+# noinspection PyPep8Naming
+def encodeFrame(received, zwaveCommand, timestamp):
+    nodeId = zwaveCommand.get('nodeId', None)
+    endpoint = zwaveCommand.get('endpoint', None)
+    cmdSuccess = zwaveCommand.get('cmdSuccess', None)
+    timeDelta = zwaveCommand.get('timeDelta', None)
+    payload = RECORD_HEADER.pack(timestamp,
+                                 DIRECTION_RECEIVED if received else DIRECTION_SENT,
+                                 NONE_NODE if nodeId is None else int(nodeId),
+                                 NONE_NODE if endpoint is None else int(endpoint),
+                                 NONE_SUCCESS if cmdSuccess is None else int(bool(cmdSuccess)),
+                                 math.nan if timeDelta is None else float(timeDelta)) + bytes([int(byte) & 0xFF for byte in zwaveCommand['bytes']])
+    return RECORD_LENGTH.pack(len(payload)) + payload
+
+
+# noinspection PyPep8Naming
+def readCaptureFile(filePath):
+    # Yields (received, timestamp, zwaveCommand) for each frame in a capture file - zwaveCommand is in the form passed to zwaveCommandReceived / zwaveCommandSent.
+    # A record cut short (e.g. the plugin stopped mid-write) ends the file.
+
+    with open(filePath, 'rb') as captureFile:
+        if captureFile.read(len(FILE_MAGIC)) != FILE_MAGIC:
+            raise ValueError(f'\'{filePath}\' is not a Z-Wave capture file')
+        while True:
+            lengthBytes = captureFile.read(RECORD_LENGTH.size)
+            if len(lengthBytes) < RECORD_LENGTH.size:
+                return
+            payload = captureFile.read(RECORD_LENGTH.unpack(lengthBytes)[0])
+            if len(payload) < RECORD_HEADER.size:
+                return
+            timestamp, direction, nodeId, endpoint, cmdSuccess, timeDelta = RECORD_HEADER.unpack_from(payload)
+            zwaveCommand = {'bytes': list(payload[RECORD_HEADER.size:]),
+                            'nodeId': None if nodeId == NONE_NODE else nodeId,
+                            'endpoint': None if endpoint == NONE_NODE else endpoint,
+                            'cmdSuccess': None if cmdSuccess == NONE_SUCCESS else bool(cmdSuccess),
+                            'timeDelta': None if math.isnan(timeDelta) else int(timeDelta)}
+            yield direction == DIRECTION_RECEIVED, timestamp, zwaveCommand
+
+
+# noinspection PyPep8Naming
+def captureFiles(filePath):
+    # The current capture file and its rotated predecessors that exist, oldest first
+    rotatedPaths = [f'{filePath}.{index}' for index in range(1, 1000)]
+    existingPaths = list()
+    for rotatedPath in rotatedPaths:
+        if not os.path.exists(rotatedPath):
+            break
+        existingPaths.append(rotatedPath)
+    existingPaths.reverse()
+    if os.path.exists(filePath):
+        existingPaths.append(filePath)
+    return existingPaths
+
+
+# noinspection PyPep8Naming
+class ZwaveFrameCapture:
+
+    # Appends the raw Z-Wave frames seen by zwaveCommandReceived / zwaveCommandSent to a binary capture file. When the file reaches its
+    # size limit it is rotated like the plugin log: 'zwaveCapture.bin' becomes 'zwaveCapture.bin.1' and so on, the oldest being deleted.
+    # Writes are buffered and flushed at most every ZWAVE_CAPTURE_FLUSH_SECONDS, on rotation and on close. Once closed, frames are ignored -
+    # a frame arriving as the capture is stopped doesn't reopen the file.
+
+    def __init__(self, filePath, maximumBytes, fileCount):
+        self.lock = threading.Lock()
+        self.filePath = filePath
+        self.maximumBytes = maximumBytes
+        self.fileCount = max(fileCount, 1)
+        self.captureFile = None
+        self.closed = False
+        self.fileBytes = 0
+        self.lastFlushTime = 0.0
+        self.framesCaptured = 0
+        self.bytesWritten = 0
+        self.rotations = 0
+
+    def capture(self, received, zwaveCommand):
+        record = encodeFrame(received, zwaveCommand, time.time())
+        with self.lock:
+            if self.closed:
+                return
+            if self.captureFile is None:
+                self.open()
+            elif self.fileBytes + len(record) > self.maximumBytes:
+                self.rotate()
+            self.captureFile.write(record)
+            self.fileBytes += len(record)
+            self.bytesWritten += len(record)
+            self.framesCaptured += 1
+            now = time.time()
+            if now - self.lastFlushTime >= ZWAVE_CAPTURE_FLUSH_SECONDS:
+                self.captureFile.flush()
+                self.lastFlushTime = now
+
+    def close(self):
+        # Returns True if this call closed the capture, False if it was already closed
+        with self.lock:
+            if self.closed:
+                return False
+            self.closed = True
+            if self.captureFile is not None:
+                try:
+                    self.captureFile.close()
+                finally:
+                    self.captureFile = None
+            return True
+
+    # Following methods are called with self.lock held
+
+    def open(self):
+        self.captureFile = open(self.filePath, 'ab')
+        self.fileBytes = self.captureFile.tell()
+        if self.fileBytes == 0:
+            self.captureFile.write(FILE_MAGIC)
+            self.fileBytes = len(FILE_MAGIC)
+
+    def rotate(self):
+        self.captureFile.close()
+        if self.fileCount > 1:
+            for index in range(self.fileCount - 1, 0, -1):
+                sourcePath = self.filePath if index == 1 else f'{self.filePath}.{index - 1}'
+                if os.path.exists(sourcePath):
+                    os.replace(sourcePath, f'{self.filePath}.{index}')
+        else:
+            os.remove(self.filePath)
+        self.rotations += 1
+        self.open()
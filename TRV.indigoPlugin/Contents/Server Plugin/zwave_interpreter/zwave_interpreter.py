@@ -12,6 +12,9 @@ try:
 except ImportError:
     pass
 
+import sys
+import time
+
 from .zwave_constants import *
 from .zwave_constants_command_classes import *
 from .zwave_constants_interpretation import *
@@ -59,49 +62,24 @@ class ZwaveInterpreter:
 
     """
 
-    def __init__(self, exception_handler, logger, indigo_devices):
+    def __init__(self, exception_handler, logger, indigo_devices, indigo_group_list=None):
         try:
             self.exception_handler = exception_handler
             self.logger = logger
 
+            self.indigo_devices = indigo_devices
+            self.indigo_group_list = indigo_group_list if indigo_group_list is not None else indigo.device.getGroupList  # Device id -> ids of its linked (grouped) devices
+
+            # The node map is resolved lazily: a Z-Wave node is only mapped to its Indigo device(s) when the first frame from that node is interpreted.
+            # The address index is a cheap node -> device id list built on first use and then maintained incrementally from the device callbacks.
             self.node_to_indigo_device = dict()
-            if indigo_devices is not None:
-                for dev in indigo_devices.iter("indigo.zwave"):
-                    dev_address = int(dev.address)
-                    if dev_address not in self.node_to_indigo_device:
-                        self.node_to_indigo_device[int(dev.address)] = dict()
-                    end_point = 0
-                    # zwDevSubIndex_present = False
-                    if 'zwDevSubIndex' in dev.ownerProps:
-                        # zwDevSubIndex_present = True
-                        end_point = int(dev.ownerProps['zwDevSubIndex'])
-                    if end_point not in self.node_to_indigo_device[int(dev.address)]:
-                        self.node_to_indigo_device[int(dev.address)][end_point] = dict()
-                        self.node_to_indigo_device[int(dev.address)][end_point][ZW_INDIGO_DEVICE_ID] = dev.id
-                        self.node_to_indigo_device[int(dev.address)][end_point][ZW_INDIGO_DEVICE_NAME] = dev.name
-                        self.node_to_indigo_device[int(dev.address)][end_point][ZW_INDIGO_DEVICE_SUB_MODELS] = dict()
-                        if end_point == 0:
-                            dev_id_list = indigo.device.getGroupList(dev.id)
-                            if len(dev_id_list) > 1:
-                                for linked_dev_id in dev_id_list:
-                                    if linked_dev_id != dev.id:
-                                        linked_dev = indigo.devices[linked_dev_id]
-                                        self.node_to_indigo_device[int(dev.address)][end_point][ZW_INDIGO_DEVICE_SUB_MODELS][linked_dev.subModel] = [linked_dev_id, linked_dev.name]
-
-                        if end_point == 0:
-                            #  zwClassCmdMapStr : 80v1 84v2 85v1 86v1 87v1 8Ev1 55v1 59v1 5Av1 5Ev1 9Fv1 20v1 70v1 71v1 6Cv1 30v1 31v11 72v1 73v1 7Av1 (string)
-                            command_classes_indigo_dict = dev.ownerProps["zwClassCmdMap"]
-                            command_classes_python_dict = convert_to_native(command_classes_indigo_dict)
-
-                            # Copy dictionary replacing key with string format e.g. "c96" with int(96)
-                            command_classes = dict()
-                            for key, value in command_classes_python_dict.items():
-                                new_key = int(key[1:])
-                                command_classes[new_key] = value
-
-                            self.node_to_indigo_device[int(dev.address)][end_point][ZW_INDIGO_DEVICE_COMMAND_CLASSES] = command_classes
-
-                # self.logger.warning(u'ZWAVE NODE TO INDIGO DEVICE:\n{0}\n'.format(self.node_to_indigo_device))
+            self.node_address_index = None
+            self.device_id_to_node = dict()
+            self.node_map_statistics = dict()
+            self.node_map_statistics["nodes_resolved"] = 0
+            self.node_map_statistics["nodes_invalidated"] = 0
+            self.node_map_statistics["resolve_seconds"] = 0.0
+            self.node_map_statistics["index_build_seconds"] = 0.0
 
             self.zw_received_sent = False
             self.zw_interpretation = dict()
@@ -146,16 +124,177 @@ class ZwaveInterpreter:
                 end_point = 0
             if node is not None:
                 self.device_name = u"{0} {1} Unknown Indigo device".format(node, end_point)
+                if node not in self.node_to_indigo_device:
+                    self.resolve_node(node)
                 if node in self.node_to_indigo_device:
                     if end_point in self.node_to_indigo_device[node]:
                         self.device_name = u"{0}".format(self.node_to_indigo_device[node][end_point][ZW_INDIGO_DEVICE_NAME])
                         self.device_id = self.node_to_indigo_device[node][end_point][ZW_INDIGO_DEVICE_ID]
-                        if end_point == 0:
+                        if end_point == 0 and ZW_INDIGO_DEVICE_COMMAND_CLASSES in self.node_to_indigo_device[node][end_point]:
                             self.device_command_classes = self.node_to_indigo_device[node][end_point][ZW_INDIGO_DEVICE_COMMAND_CLASSES]
 
         except Exception as exception_error:
             self.exception_handler(exception_error, True)  # Log error and display failing statement
 
+    def build_node_address_index(self):
+        try:
+            start_time = time.time()
+
+            self.node_address_index = dict()
+            self.device_id_to_node = dict()
+            if self.indigo_devices is not None:
+                for dev in self.indigo_devices.iter("indigo.zwave"):
+                    self.add_device_to_node_address_index(dev)
+
+            self.node_map_statistics["index_build_seconds"] = time.time() - start_time
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+
+    def add_device_to_node_address_index(self, dev):
+        try:
+            node = int(dev.address)
+            if node not in self.node_address_index:
+                self.node_address_index[node] = list()
+            if dev.id not in self.node_address_index[node]:
+                self.node_address_index[node].append(dev.id)
+            self.device_id_to_node[dev.id] = node
+
+        except (ValueError, TypeError):
+            pass  # Z-Wave device without a valid node address e.g. not yet included
+
+    def remove_device_from_node_address_index(self, dev_id):
+        try:
+            node = self.device_id_to_node.pop(dev_id, None)
+            if node is not None and node in self.node_address_index:
+                if dev_id in self.node_address_index[node]:
+                    self.node_address_index[node].remove(dev_id)
+                if len(self.node_address_index[node]) == 0:
+                    del self.node_address_index[node]
+            return node
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+
+    def resolve_node(self, node):
+        try:
+            start_time = time.time()
+
+            if self.node_address_index is None:
+                self.build_node_address_index()
+
+            node_entry = dict()  # An empty entry is cached for nodes with no Indigo device so that frames from them don't trigger repeat lookups
+            for dev_id in self.node_address_index.get(node, list()):
+                try:
+                    dev = self.indigo_devices[dev_id]
+                except KeyError:
+                    continue
+                end_point = 0
+                if 'zwDevSubIndex' in dev.ownerProps:
+                    end_point = int(dev.ownerProps['zwDevSubIndex'])
+                if end_point in node_entry:
+                    continue
+                node_entry[end_point] = dict()
+                node_entry[end_point][ZW_INDIGO_DEVICE_ID] = dev.id
+                node_entry[end_point][ZW_INDIGO_DEVICE_NAME] = dev.name
+                node_entry[end_point][ZW_INDIGO_DEVICE_SUB_MODELS] = dict()
+                if end_point == 0:
+                    dev_id_list = self.indigo_group_list(dev.id)
+                    if len(dev_id_list) > 1:
+                        for linked_dev_id in dev_id_list:
+                            if linked_dev_id != dev.id:
+                                linked_dev = self.indigo_devices[linked_dev_id]
+                                node_entry[end_point][ZW_INDIGO_DEVICE_SUB_MODELS][linked_dev.subModel] = [linked_dev_id, linked_dev.name]
+
+                    #  zwClassCmdMapStr : 80v1 84v2 85v1 86v1 87v1 8Ev1 55v1 59v1 5Av1 5Ev1 9Fv1 20v1 70v1 71v1 6Cv1 30v1 31v11 72v1 73v1 7Av1 (string)
+                    command_classes = dict()
+                    if "zwClassCmdMap" in dev.ownerProps:
+                        command_classes_python_dict = convert_to_native(dev.ownerProps["zwClassCmdMap"])
+
+                        # Copy dictionary replacing key with string format e.g. "c96" with int(96)
+                        for key, value in command_classes_python_dict.items():
+                            new_key = int(key[1:])
+                            command_classes[new_key] = value
+
+                    node_entry[end_point][ZW_INDIGO_DEVICE_COMMAND_CLASSES] = command_classes
+
+            self.node_to_indigo_device[node] = node_entry
+
+            self.node_map_statistics["nodes_resolved"] += 1
+            self.node_map_statistics["resolve_seconds"] += time.time() - start_time
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+
+    def invalidate_node(self, node):
+        # Drop the cached entry so that it is re-resolved on the next frame from the node
+        if node is not None and node in self.node_to_indigo_device:
+            del self.node_to_indigo_device[node]
+            self.node_map_statistics["nodes_invalidated"] += 1
+
+    def device_created(self, dev):
+        try:
+            if self.node_address_index is None or dev.protocol != indigo.kProtocol.ZWave:
+                return  # Index not yet built (it will include this device when it is) or not a Z-Wave device
+            self.add_device_to_node_address_index(dev)
+            self.invalidate_node(self.device_id_to_node.get(dev.id, None))
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+
+    def device_updated(self, orig_dev, new_dev):
+        try:
+            if self.node_address_index is None or new_dev.protocol != indigo.kProtocol.ZWave:
+                return
+            if orig_dev.address == new_dev.address and orig_dev.name == new_dev.name and orig_dev.subModel == new_dev.subModel:
+                orig_props = orig_dev.ownerProps
+                new_props = new_dev.ownerProps
+                if (orig_props.get("zwDevSubIndex", None) == new_props.get("zwDevSubIndex", None) and
+                        convert_to_native(orig_props.get("zwClassCmdMap", None)) == convert_to_native(new_props.get("zwClassCmdMap", None))):
+                    return  # Nothing that the node map holds has changed (the vast majority of updates are state changes)
+            old_node = self.remove_device_from_node_address_index(new_dev.id)
+            self.invalidate_node(old_node)
+            self.add_device_to_node_address_index(new_dev)
+            self.invalidate_node(self.device_id_to_node.get(new_dev.id, None))
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+
+    def device_deleted(self, dev):
+        try:
+            if self.node_address_index is None:
+                return
+            node = self.remove_device_from_node_address_index(dev.id)
+            self.invalidate_node(node)
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+
+    def node_map_report(self):
+        try:
+            def deep_size(obj):
+                size = sys.getsizeof(obj)
+                if isinstance(obj, dict):
+                    for key, value in obj.items():
+                        size += deep_size(key) + deep_size(value)
+                elif isinstance(obj, (list, tuple, set)):
+                    for item in obj:
+                        size += deep_size(item)
+                return size
+
+            indexed_nodes = 0 if self.node_address_index is None else len(self.node_address_index)
+            report = dict()
+            report["indexed_nodes"] = indexed_nodes
+            report["indexed_devices"] = len(self.device_id_to_node)
+            report["cached_nodes"] = len(self.node_to_indigo_device)
+            report["node_map_bytes"] = deep_size(self.node_to_indigo_device)
+            report["address_index_bytes"] = deep_size(self.node_address_index) + deep_size(self.device_id_to_node)
+            report.update(self.node_map_statistics)
+            return report
+
+        except Exception as exception_error:
+            self.exception_handler(exception_error, True)  # Log error and display failing statement
+
     def interpret_list(self, all_devices, device_list=None):
         try:
             if all_devices:
@@ -327,8 +466,9 @@ class ZwaveInterpreter:
                 if self.zw_interpretation[ZW_ENDPOINT] is None or self.zw_interpretation[ZW_ENDPOINT] == 0:
                     if self.device_id != 0:
                         dev = indigo.devices[self.device_id]
-                        if len(self.node_to_indigo_device[int(dev.address)][0][ZW_INDIGO_DEVICE_SUB_MODELS]) > 0:
-                            for key, value in self.node_to_indigo_device[int(dev.address)][0][ZW_INDIGO_DEVICE_SUB_MODELS].items():
+                        sub_models = self.node_to_indigo_device.get(int(dev.address), dict()).get(0, dict()).get(ZW_INDIGO_DEVICE_SUB_MODELS, dict())
+                        if len(sub_models) > 0:
+                            for key, value in sub_models.items():
                                 if ZW_SENSOR_TYPE_UI in self.zw_interpretation and key == self.zw_interpretation[ZW_SENSOR_TYPE_UI]:
                                     interpreted_device_name = value[1]
                                     break
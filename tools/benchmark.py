@@ -0,0 +1,295 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# TRV Controller Benchmark © Autolog 2022
+#
+# Runs the plugin headless against the fake 'indigo' module in tools/indigo_stub and drives N virtual TRV Controllers through:
+#   - temperature update storms from the remote thermostats,
+#   - raw Z-Wave frames received from the TRVs and
+#   - heating schedule boundaries
+# and reports commands / second, Indigo server calls per event and the trvHandler / delayHandler queue metrics for each phase.
+#
+# Usage: python tools/benchmark.py [--controllers 100] [--storms 5] [--boundaries 2] [--json results.json] [--zwave-capture]
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as eTree
+
+TOOLS_PATH = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_BUNDLE_PATH = os.path.join(os.path.dirname(TOOLS_PATH), 'TRV.indigoPlugin')
+SERVER_PLUGIN_PATH = os.path.join(PLUGIN_BUNDLE_PATH, 'Contents', 'Server Plugin')
+
+sys.path.insert(0, os.path.join(TOOLS_PATH, 'indigo_stub'))
+sys.path.insert(1, SERVER_PLUGIN_PATH)
+
+import indigo  # noqa - the fake indigo module, must be imported before the plugin
+
+PLUGIN_ID = 'com.autologplugin.indigoplugin.trvcontroller'
+TRV_MODEL = 'General Thermostat (v2)'  # Reports temperature, no wakeup, no valve device
+HEAT_SOURCE_MODEL = 'Smart Switch 6 (ZW096)'
+CONTROLLERS_PER_HEAT_SOURCE = 10
+FIRST_ZWAVE_NODE = 2
+
+# Indigo API calls that result in a command being sent to a physical device
+OUTBOUND_COMMAND_CALLS = ('thermostat.setHeatSetpoint', 'thermostat.setHvacMode', 'device.turnOn', 'device.turnOff', 'device.statusRequest', 'zwave.sendRaw')
+
+ZW_THERMOSTAT_SETPOINT = 0x43
+ZW_THERMOSTAT_SETPOINT_REPORT = 0x03
+
+
+def pluginVersion():
+    infoPlist = eTree.parse(os.path.join(PLUGIN_BUNDLE_PATH, 'Contents', 'Info.plist')).getroot().find('dict')
+    elements = list(infoPlist)
+    for index, element in enumerate(elements):
+        if element.tag == 'key' and element.text == 'PluginVersion':
+            return elements[index + 1].text
+    return '0.0'
+
+
+def controllerDefaultStates():
+    # Default value for every state of the TRV Controller device, as Indigo would create them from Devices.xml
+    states = dict()
+    devicesXml = eTree.parse(os.path.join(SERVER_PLUGIN_PATH, 'Devices.xml')).getroot()
+    for deviceXml in devicesXml.findall('Device'):
+        if deviceXml.get('id') != 'trvController':
+            continue
+        for stateXml in deviceXml.iter('State'):
+            valueType = stateXml.find('ValueType')
+            valueTypeText = valueType.text.strip() if valueType is not None and valueType.text is not None else 'String'
+            if valueTypeText == 'Boolean':
+                states[stateXml.get('id')] = False
+            elif valueTypeText == 'Number':
+                states[stateXml.get('id')] = 0
+            else:
+                states[stateXml.get('id')] = ''
+    return states
+
+
+def setupServer(workingFolder):
+    # The plugin reads its resources via '<install folder>/Plugins/TRV.indigoPlugin' - point that at this repository
+    pluginsFolder = os.path.join(workingFolder, 'Plugins')
+    os.makedirs(pluginsFolder, exist_ok=True)
+    os.symlink(PLUGIN_BUNDLE_PATH, os.path.join(pluginsFolder, 'TRV.indigoPlugin'))
+    logsFolder = os.path.join(workingFolder, 'Logs')
+    os.makedirs(logsFolder, exist_ok=True)
+    indigo.server.installFolderPath = workingFolder
+    indigo.server.logsFolderPath = logsFolder
+
+
+def createFleet(numberOfControllers, radiatorSensors=False):
+    # Create heat sources, TRVs, remote thermostats, (optionally) radiator temperature sensors and TRV Controllers
+    #   - returns a list of (trvCtlrDev, trvDev, remoteDev, radiatorDev) - radiatorDev is None if not created
+    fleet = list()
+    states = controllerDefaultStates()
+    node = FIRST_ZWAVE_NODE
+    heatSourceDev = None
+    for index in range(numberOfControllers):
+        if index % CONTROLLERS_PER_HEAT_SOURCE == 0:
+            heatSourceDev = indigo.devices.add(indigo.RelayDevice(f'Boiler {index // CONTROLLERS_PER_HEAT_SOURCE + 1:03d}', address=str(node), model=HEAT_SOURCE_MODEL,
+                                                                  protocol=indigo.kProtocol.ZWave))
+            node += 1
+
+        temperature = round(random.uniform(15.0, 21.0), 1)
+        trvDev = indigo.devices.add(indigo.ThermostatDevice(f'TRV {index + 1:03d}', temperature=temperature, heatSetpoint=18.0, batteryLevel=90, address=str(node), model=TRV_MODEL,
+                                                            protocol=indigo.kProtocol.ZWave))
+        node += 1
+        remoteDev = indigo.devices.add(indigo.SensorDevice(f'Remote {index + 1:03d}', sensorValue=temperature, batteryLevel=80, address=str(node), model='Multisensor',
+                                                           protocol=indigo.kProtocol.ZWave))
+        node += 1
+        radiatorDev = None
+        if radiatorSensors:
+            radiatorDev = indigo.devices.add(indigo.SensorDevice(f'Radiator {index + 1:03d}', sensorValue=temperature, batteryLevel=85, address=str(node), model='Multisensor',
+                                                                 protocol=indigo.kProtocol.ZWave))
+            node += 1
+
+        pluginProps = {'version': pluginVersion(), 'address': trvDev.address, 'trvDevId': trvDev.id, 'supportsHvacOnOff': False, 'supportsManualSetpoint': True,
+                       'supportsTemperatureReporting': True, 'remoteThermostatControlEnabled': True, 'remoteDevId': remoteDev.id, 'remoteSetpointHeatControl': False,
+                       'remoteDeltaMax': 5.0, 'NumTemperatureInputs': 2, 'heatingId': heatSourceDev.id, 'heatingVarId': 0, 'setpointHeatOnDefault': 20.0,
+                       'setpointHeatMinimum': 8.0, 'setpointHeatMaximum': 28.0, 'setpointHeatDeviceStartMethod': 1, 'setpointHeatDeviceStartDefault': 18.0,
+                       'schedule1Enabled': True, 'schedule1TimeOn': '06:30', 'schedule1TimeOff': '08:30', 'schedule1SetpointHeat': 21.0,
+                       'schedule2Enabled': True, 'schedule2TimeOn': '17:00', 'schedule2TimeOff': '22:30', 'schedule2SetpointHeat': 20.5}
+        if radiatorDev is not None:
+            pluginProps['radiatorMonitoringEnabled'] = True
+            pluginProps['radiatorDevId'] = radiatorDev.id
+        trvCtlrDev = indigo.devices.add(indigo.ThermostatDevice(f'TRV Controller {index + 1:03d}', temperature=temperature, heatSetpoint=18.0, address=trvDev.address,
+                                                                deviceTypeId='trvController', pluginProps=pluginProps, states=states))
+        fleet.append((trvCtlrDev, trvDev, remoteDev, radiatorDev))
+    return fleet
+
+
+def waitUntilIdle(plugin, settleSeconds, timeoutSeconds=600.0, pollSeconds=0.005):
+    # Deliver deviceUpdated callbacks until the handler queues are drained and nothing has happened for settleSeconds (covers the plugin's
+    # short delayed commands). Returns the time the last activity was seen.
+    trvHandlerMetrics = plugin.globals['queues']['trvHandler'].metrics
+    lastActivityTime = time.perf_counter()
+    lastCompleted = -1
+    startTime = time.perf_counter()
+    while time.perf_counter() - startTime < timeoutSeconds:
+        delivered = indigo.server.pumpDeviceUpdates(plugin)
+        completed = trvHandlerMetrics.completedCount
+        if delivered > 0 or completed != lastCompleted or trvHandlerMetrics.outstanding() > 0:
+            lastCompleted = completed
+            lastActivityTime = time.perf_counter()
+        elif time.perf_counter() - lastActivityTime >= settleSeconds:
+            break
+        time.sleep(pollSeconds)
+    return lastActivityTime
+
+
+def zwaveSetpointReportFrame(node, setpoint):
+    # Thermostat Setpoint Report (Heating 1, precision 1, scale Celsius, size 2) as received by the plugin's zwaveCommandReceived
+    value = int(round(setpoint * 10))
+    commandBytes = [ZW_THERMOSTAT_SETPOINT, ZW_THERMOSTAT_SETPOINT_REPORT, 0x01, 0x22, (value >> 8) & 0xFF, value & 0xFF]
+    frameBytes = [0x01, len(commandBytes) + 6, 0x00, 0x04, 0x00, len(commandBytes)] + commandBytes + [0x00]
+    return {'nodeId': node, 'bytes': frameBytes, 'endpoint': None, 'cmdSuccess': True, 'timeDelta': 0}
+
+
+class Phase:
+
+    # Captures recorder / queue metric deltas for one benchmark phase
+
+    def __init__(self, name, plugin):
+        self.name = name
+        self.plugin = plugin
+        self.events = 0
+        indigo.recorder.reset()
+        self.completedAtStart = plugin.globals['queues']['trvHandler'].metrics.completedCount
+        self.startTime = time.perf_counter()
+
+    def finish(self, lastActivityTime):
+        elapsedSeconds = max(lastActivityTime - self.startTime, 1e-6)
+        calls = indigo.recorder.summary()
+        serverCalls = indigo.recorder.total()
+        outboundCommands = sum([calls[name]['calls'] for name in OUTBOUND_COMMAND_CALLS if name in calls])
+        handlerCommands = self.plugin.globals['queues']['trvHandler'].metrics.completedCount - self.completedAtStart
+        return {'phase': self.name,
+                'events': self.events,
+                'elapsedSeconds': round(elapsedSeconds, 3),
+                'eventsPerSecond': round(self.events / elapsedSeconds, 1),
+                'handlerCommands': handlerCommands,
+                'handlerCommandsPerSecond': round(handlerCommands / elapsedSeconds, 1),
+                'outboundCommands': outboundCommands,
+                'serverCalls': serverCalls,
+                'serverCallsPerEvent': round(serverCalls / self.events, 2) if self.events > 0 else 0.0,
+                'calls': calls}
+
+
+def runBenchmark(arguments):
+    random.seed(arguments.seed)
+
+    logging.basicConfig(format='%(asctime)s %(levelname)-8s %(name)s %(message)s')
+    logging.getLogger().handlers[0].setLevel(logging.INFO if arguments.verbose else logging.WARNING)
+
+    workingFolder = tempfile.mkdtemp(prefix='trv_benchmark_')
+    setupServer(workingFolder)
+    fleet = createFleet(arguments.controllers)
+
+    from plugin import Plugin  # noqa - imported here as it needs the fake indigo server set-up first
+
+    results = list()
+
+    startupStartTime = time.perf_counter()
+    plugin = Plugin(PLUGIN_ID, 'TRV Controller', pluginVersion(), {'trvVariableFolderName': 'TRV', 'delayQueueSeconds': 0,
+                                                                                 'zwaveCaptureEnabled': arguments.zwaveCapture})
+    plugin.startup()
+    startupSeconds = time.perf_counter() - startupStartTime
+
+    phase = Phase('deviceStartComm', plugin)
+    for trvCtlrDev, trvDev, remoteDev, radiatorDev in fleet:
+        plugin.deviceStartComm(indigo.devices[trvCtlrDev.id])
+        phase.events += 1
+    results.append(phase.finish(waitUntilIdle(plugin, arguments.settle)))
+
+    # Update storm - every remote thermostat reports a new temperature in each round
+    phase = Phase('updateStorm', plugin)
+    for _ in range(arguments.storms):
+        for trvCtlrDev, trvDev, remoteDev, radiatorDev in fleet:
+            temperature = round(indigo.devices.byId[remoteDev.id].states['sensorValue'] + random.choice((-0.5, -0.2, 0.1, 0.3, 0.5)), 1)
+            indigo.devices.applyStates(remoteDev.id, {'sensorValue': temperature})
+            phase.events += 1
+        indigo.server.pumpDeviceUpdates(plugin)
+    results.append(phase.finish(waitUntilIdle(plugin, arguments.settle)))
+
+    # Z-Wave frames - every TRV reports its setpoint
+    phase = Phase('zwaveFrames', plugin)
+    for _ in range(arguments.storms):
+        for trvCtlrDev, trvDev, remoteDev, radiatorDev in fleet:
+            plugin.zwaveCommandReceived(zwaveSetpointReportFrame(int(trvDev.address), indigo.devices.byId[trvDev.id].states['setpointHeat']))
+            phase.events += 1
+    results.append(phase.finish(waitUntilIdle(plugin, arguments.settle)))
+
+    # Schedule boundaries - every controller re-evaluates its heating schedule, as at a schedule on / off time
+    from constants import CMD_PROCESS_HEATING_SCHEDULE, CMD_TRANSLATION, QUEUE_PRIORITY_STATUS_MEDIUM  # noqa
+
+    phase = Phase('scheduleBoundaries', plugin)
+    for _ in range(arguments.boundaries):
+        for trvCtlrDev, trvDev, remoteDev, radiatorDev in fleet:
+            plugin.globals['queues']['trvHandler'].put([QUEUE_PRIORITY_STATUS_MEDIUM, 0, CMD_PROCESS_HEATING_SCHEDULE, trvCtlrDev.id, None])
+            phase.events += 1
+        waitUntilIdle(plugin, 0.05)
+    results.append(phase.finish(waitUntilIdle(plugin, arguments.settle)))
+
+    queueMetrics = {queueName: plugin.globals['queues'][queueName].metrics.snapshot(CMD_TRANSLATION) for queueName in ('trvHandler', 'delayHandler')}
+
+    shutdownSeconds = stopPlugin(plugin)
+
+    return {'controllers': arguments.controllers, 'startupSeconds': round(startupSeconds, 3), 'shutdownSeconds': round(shutdownSeconds, 3), 'phases': results, 'queueMetrics': queueMetrics,
+            'stateWrites': dict(plugin.globals['stateWrites']),
+            'zwaveCaptureFile': os.path.join(indigo.server.logsFolderPath, 'zwaveCapture.bin') if arguments.zwaveCapture else ''}
+
+
+def stopPlugin(plugin):
+    # The plugin's shutdown stops the handler threads and cancels its timers - returns the time it took
+    shutdownStartTime = time.perf_counter()
+    plugin.shutdown()
+    return time.perf_counter() - shutdownStartTime
+
+
+def reportResults(benchmarkResults):
+    print(f'\nTRV Controller benchmark: {benchmarkResults["controllers"]} controllers, plugin start-up {benchmarkResults["startupSeconds"]:.3f} s, shutdown {benchmarkResults["shutdownSeconds"]:.3f} s\n')
+    print(f'{"Phase":<20} {"Events":>8} {"Seconds":>9} {"Events/s":>10} {"Cmds":>8} {"Cmds/s":>9} {"Outbound":>9} {"Calls":>8} {"Calls/Event":>12}')
+    for result in benchmarkResults['phases']:
+        print(f'{result["phase"]:<20} {result["events"]:>8} {result["elapsedSeconds"]:>9.3f} {result["eventsPerSecond"]:>10.1f} {result["handlerCommands"]:>8} '
+              f'{result["handlerCommandsPerSecond"]:>9.1f} {result["outboundCommands"]:>9} {result["serverCalls"]:>8} {result["serverCallsPerEvent"]:>12.2f}')
+    for result in benchmarkResults['phases']:
+        print(f'\n{result["phase"]} - Indigo API calls:')
+        for name, detail in result['calls'].items():
+            print(f'    {name:<40} {detail["calls"]:>8} calls {detail["ms"]:>10.3f} ms')
+    trvHandlerMetrics = benchmarkResults['queueMetrics']['trvHandler']
+    print(f'\ntrvHandler queue: {trvHandlerMetrics["completed"]} commands completed, {trvHandlerMetrics["discarded"]} discarded')
+    for commandName, summary in sorted(trvHandlerMetrics['wait'].items()):
+        print(f'    {commandName:<40} wait mean {summary["meanMs"]:>9.3f} ms, p95 {summary["p95Ms"]:>8.1f} ms, max {summary["maxMs"]:>9.3f} ms [{summary["count"]}]')
+    stateWrites = benchmarkResults['stateWrites']
+    print(f'\nTRV Controller state writes: {stateWrites["requested"]} requested, {stateWrites["roundTrips"]} server round trips, '
+          f'{stateWrites["keysUnchanged"]} unchanged states not written')
+    if benchmarkResults['zwaveCaptureFile']:
+        print(f'\nZ-Wave frames captured to {benchmarkResults["zwaveCaptureFile"]} - replay with tools/replayZwave.py')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless TRV Controller benchmark using a fake indigo module')
+    parser.add_argument('--controllers', type=int, default=50, help='number of virtual TRV Controllers')
+    parser.add_argument('--storms', type=int, default=5, help='rounds of temperature updates / Z-Wave frames per controller')
+    parser.add_argument('--boundaries', type=int, default=2, help='number of schedule boundaries to drive')
+    parser.add_argument('--settle', type=float, default=2.5, help='seconds of inactivity before a phase is considered complete')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    parser.add_argument('--json', default='', help='also write the results to this file')
+    parser.add_argument('--zwave-capture', dest='zwaveCapture', action='store_true', help='capture the Z-Wave frames sent and received by the plugin')
+    parser.add_argument('--verbose', action='store_true', help='show plugin INFO logging')
+    arguments = parser.parse_args()
+
+    benchmarkResults = runBenchmark(arguments)
+    reportResults(benchmarkResults)
+    if arguments.json:
+        with open(arguments.json, 'w') as resultsFile:
+            json.dump(benchmarkResults, resultsFile, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# TRV Controller CSV Export Benchmark © Autolog 2022
+#
+# Compares the two ways a per-state CSV file is written from the SQL Logger's PostgreSQL database:
+#   - rows: rows fetched into Python tuples by PostgresqlHistory and formatted by history() as the DataGraph export does,
+#   - copy: COPY ... TO STDOUT streamed straight into the file by PostgresqlHistory.copyStateCsv.
+# A 'device_history_{id}' table in the SQL Logger layout is filled server-side with --rows rows of a 'temperatureTrv' column (one every
+# 10 seconds up to now) and dropped afterwards unless --keep is given. Needs a PostgreSQL server the user can create tables in.
+#
+# Usage: python tools/benchmarkCsvExport.py --database pq://user:password@127.0.0.1:5432/indigo_history [--rows 1000000] [--repeat 3]
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+
+TOOLS_PATH = os.path.dirname(os.path.abspath(__file__))
+SERVER_PLUGIN_PATH = os.path.join(os.path.dirname(TOOLS_PATH), 'TRV.indigoPlugin', 'Contents', 'Server Plugin')
+sys.path.insert(0, SERVER_PLUGIN_PATH)
+
+import postgresql  # noqa - the plugin's vendored driver, on the path set-up above
+
+from historyQuery import history, PostgresqlHistory, HISTORY_COPY_BUFFER_BYTES  # noqa
+
+STATE_NAME = 'temperatureTrv'
+SAMPLE_SECONDS = 10
+
+
+def createTable(connection, trvCtlrDevId, rowCount):
+    connection.execute(f'DROP TABLE IF EXISTS device_history_{trvCtlrDevId}')
+    connection.execute(f'CREATE TABLE device_history_{trvCtlrDevId} (id SERIAL PRIMARY KEY, ts TIMESTAMP WITHOUT TIME ZONE NOT NULL, {STATE_NAME} DOUBLE PRECISION)')
+    connection.execute(f"INSERT INTO device_history_{trvCtlrDevId} (ts, {STATE_NAME}) SELECT localtimestamp - make_interval(secs => {SAMPLE_SECONDS} * i), 18.0 + (i % 50) / 10.0"
+                       f" FROM generate_series({rowCount}, 1, -1) AS g(i)")
+    connection.execute(f'CREATE INDEX ON device_history_{trvCtlrDevId} (ts)')
+    connection.execute(f'ANALYZE device_history_{trvCtlrDevId}')
+
+
+# noinspection PyPep8Naming
+class UnthinnedHistory:
+
+    # PostgresqlHistory rows without the thinning of long periods, so that both methods export every row
+
+    def __init__(self, database):
+        self.database = database
+
+    def stateRows(self, trvCtlrDevId, stateName, startTime, endTime):
+        return self.database.previousRow(trvCtlrDevId, stateName, startTime) + self.database.rows(trvCtlrDevId, stateName, startTime, endTime)
+
+
+def exportRows(database, trvCtlrDevId, startTime, endTime, csvPath):
+    lineCount = 0
+    with open(csvPath, 'w') as csvFile:
+        csvFile.write(f'Timestamp,{STATE_NAME}\n')
+        for rowTime, rowValues in history(UnthinnedHistory(database), trvCtlrDevId, [STATE_NAME], startTime, endTime):
+            if rowValues[0] is not None:  # No value before the state's first change - as the plugin's export
+                csvFile.write(f'{datetime.datetime.fromtimestamp(rowTime).strftime("%Y-%m-%d %H:%M:%S.%f")},{rowValues[0]}\n')
+                lineCount += 1
+    return lineCount
+
+
+def exportCopy(database, trvCtlrDevId, startTime, endTime, csvPath):
+    with open(csvPath, 'wb', buffering=HISTORY_COPY_BUFFER_BYTES) as csvFile:
+        csvFile.write(f'Timestamp,{STATE_NAME}\n'.encode('utf-8'))
+        lineCount, byteCount = database.copyStateCsv(trvCtlrDevId, STATE_NAME, startTime, endTime, csvFile)
+    return lineCount
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark TRV Controller CSV export from PostgreSQL')
+    parser.add_argument('--database', required=True, help='py-postgresql connection string e.g. pq://user:password@127.0.0.1:5432/indigo_history')
+    parser.add_argument('--rows', type=int, default=1000000, help='rows in the benchmark history table')
+    parser.add_argument('--device-id', dest='deviceId', type=int, default=999999999, help='device id of the benchmark history table')
+    parser.add_argument('--repeat', type=int, default=3, help='exports per method - the fastest is reported')
+    parser.add_argument('--keep', action='store_true', help='keep the benchmark history table')
+    parser.add_argument('--json', default='', help='also write the results to this file')
+    arguments = parser.parse_args()
+
+    database = PostgresqlHistory(postgresql.open(arguments.database))
+    createTable(database.connection, arguments.deviceId, arguments.rows)
+    endTime = time.time()
+    startTime = endTime - (arguments.rows + 1) * SAMPLE_SECONDS
+
+    results = dict()
+    try:
+        for method, export in (('rows', exportRows), ('copy', exportCopy)):
+            csvPath = os.path.join(tempfile.mkdtemp(prefix='trv_csv_export_'), f'{method}.csv')
+            timings = list()
+            lineCount = 0
+            for repeat in range(arguments.repeat):
+                exportStartTime = time.perf_counter()
+                lineCount = export(database, arguments.deviceId, startTime, endTime, csvPath)
+                timings.append(time.perf_counter() - exportStartTime)
+            seconds = min(timings)
+            fileBytes = os.path.getsize(csvPath)
+            results[method] = {'lines': lineCount, 'bytes': fileBytes, 'seconds': round(seconds, 3),
+                               'rowsPerSecond': round(lineCount / seconds), 'megabytesPerSecond': round(fileBytes / seconds / 1048576, 1)}
+            os.remove(csvPath)
+    finally:
+        if not arguments.keep:
+            database.connection.execute(f'DROP TABLE IF EXISTS device_history_{arguments.deviceId}')
+        database.close()
+
+    print(f'\nCSV export of {arguments.rows:,} history rows (fastest of {arguments.repeat}):')
+    for method, result in results.items():
+        print(f'    {method:<5} {result["seconds"]:>8.3f} s  {result["rowsPerSecond"]:>10,} rows/s  {result["megabytesPerSecond"]:>7.1f} MB/s  [{result["lines"]:,} lines, {result["bytes"]:,} bytes]')
+    if results['copy']['seconds'] > 0:
+        print(f'    copy is {results["rows"]["seconds"] / results["copy"]["seconds"]:.1f}x faster than rows')
+
+    if arguments.json:
+        with open(arguments.json, 'w') as resultsFile:
+            json.dump(results, resultsFile, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,573 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Fake 'indigo' module © Autolog 2022
+#
+# Just enough of the Indigo server API, as used by the TRV Controller plugin, to run the plugin headless for benchmarking and simulation.
+# Every API call is counted and timed by 'recorder'. Device state changes are queued as deviceUpdated callbacks which the caller delivers
+# to the plugin with server.pumpDeviceUpdates(plugin) - mirroring Indigo calling back into the plugin's main thread.
+#
+# This is tooling, not a faithful emulation: devices respond to thermostat / relay commands instantly and nothing is persisted. As with
+# Indigo, indigo.devices[id] returns a copy of the device, so a device fetched before a command still shows its state before the command.
+
+import collections
+import copy
+import datetime
+import logging
+import os
+import threading
+import time
+
+
+# ============================================================================
+# Call recording
+# ============================================================================
+
+# noinspection PyPep8Naming
+class CallRecorder:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.calls = collections.Counter()
+            self.seconds = collections.defaultdict(float)
+
+    def record(self, name, seconds):
+        with self.lock:
+            self.calls[name] += 1
+            self.seconds[name] += seconds
+
+    def total(self, prefix=''):
+        with self.lock:
+            return sum([count for name, count in self.calls.items() if name.startswith(prefix)])
+
+    def summary(self):
+        with self.lock:
+            return {name: {'calls': count, 'ms': round(self.seconds[name] * 1000.0, 3)} for name, count in sorted(self.calls.items())}
+
+
+recorder = CallRecorder()
+
+
+class _Recorded:
+
+    # Context manager that records one API call and its latency
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.startTime = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        recorder.record(self.name, time.perf_counter() - self.startTime)
+        return False
+
+
+# ============================================================================
+# Constants
+# ============================================================================
+
+class _Constants:
+
+    def __init__(self, **values):
+        for name, value in values.items():
+            setattr(self, name, value)
+
+
+kHvacMode = _Constants(Off=0, Heat=1, Cool=2, HeatCool=3, ProgramHeat=4, ProgramCool=5, ProgramHeatCool=6)
+kProtocol = _Constants(Plugin='Plugin', ZWave='ZWave', Insteon='Insteon', X10='X10')
+kStateImageSel = _Constants(Auto='Auto', NoImage='NoImage', HvacOff='HvacOff', HvacHeatMode='HvacHeatMode', HvacHeating='HvacHeating', HvacAutoMode='HvacAutoMode', TimerOn='TimerOn')
+kSensorDeviceSubType = _Constants(Temperature='Temperature', Humidity='Humidity')
+kThermostatAction = _Constants(SetHvacMode=1, SetHeatSetpoint=2, IncreaseHeatSetpoint=3, DecreaseHeatSetpoint=4, RequestStatusAll=5, RequestMode=6, RequestEquipmentState=7,
+                               RequestTemperatures=8, RequestHumidities=9, RequestDeadbands=10, RequestSetpoints=11)
+
+Dict = dict
+List = list
+
+ZWAVE_GLOBAL_PROPS = 'com.perceptiveautomation.indigoplugin.zwave'
+
+
+# ============================================================================
+# Devices
+# ============================================================================
+
+# noinspection PyPep8Naming
+class Device:
+
+    def __init__(self, name, address='', model='', subModel='', protocol=kProtocol.Plugin, deviceTypeId='', pluginProps=None, states=None, wakeInterval=0):
+        self.id = 0  # Assigned when added to indigo.devices
+        self.name = name
+        self.address = address
+        self.model = model
+        self.subModel = subModel
+        self.protocol = protocol
+        self.deviceTypeId = deviceTypeId
+        self.pluginProps = dict(pluginProps) if pluginProps is not None else dict()
+        self.ownerProps = self.pluginProps
+        self.globalProps = {ZWAVE_GLOBAL_PROPS: {'zwWakeInterval': wakeInterval}}
+        self.states = dict(states) if states is not None else dict()
+        self.enabled = True
+        self.configured = True
+        self.lastSuccessfulComm = datetime.datetime.now()
+        self.subType = ''
+
+    @property
+    def batteryLevel(self):
+        return self.states.get('batteryLevel', None)
+
+    def snapshot(self):
+        deviceCopy = copy.copy(self)
+        deviceCopy.states = dict(self.states)
+        deviceCopy.pluginProps = dict(self.pluginProps)
+        deviceCopy.ownerProps = deviceCopy.pluginProps
+        return deviceCopy
+
+    def updateStateOnServer(self, key, value, uiValue=None, decimalPlaces=None, clearErrorState=True):  # noqa - same signature as Indigo
+        with _Recorded('dev.updateStateOnServer'):
+            devices.applyStates(self.id, {key: value})
+            self.states[key] = value
+
+    def updateStatesOnServer(self, keyValueList, clearErrorState=True):  # noqa - same signature as Indigo
+        with _Recorded('dev.updateStatesOnServer'):
+            devices.applyStates(self.id, {keyValue['key']: keyValue['value'] for keyValue in keyValueList})
+            self.states.update({keyValue['key']: keyValue['value'] for keyValue in keyValueList})
+
+    def updateStateImageOnServer(self, image):  # noqa - same signature as Indigo
+        with _Recorded('dev.updateStateImageOnServer'):
+            pass
+
+    def replacePluginPropsOnServer(self, pluginProps):
+        with _Recorded('dev.replacePluginPropsOnServer'):
+            devices.byId[self.id].pluginProps = dict(pluginProps)
+            devices.byId[self.id].ownerProps = devices.byId[self.id].pluginProps
+            self.pluginProps = dict(pluginProps)
+            self.ownerProps = self.pluginProps
+
+    def stateListOrDisplayStateIdChanged(self):
+        with _Recorded('dev.stateListOrDisplayStateIdChanged'):
+            pass
+
+    def refreshFromServer(self):
+        with _Recorded('dev.refreshFromServer'):
+            self.__dict__.update(devices.byId[self.id].snapshot().__dict__)
+
+
+# noinspection PyPep8Naming
+class ThermostatDevice(Device):
+
+    supportsHvacOperationMode = True
+
+    def __init__(self, name, temperature=20.0, heatSetpoint=20.0, hvacMode=kHvacMode.Heat, batteryLevel=None, **kwargs):
+        Device.__init__(self, name, **kwargs)
+        self.states.setdefault('temperatureInput1', float(temperature))
+        self.states.setdefault('setpointHeat', float(heatSetpoint))
+        self.states.setdefault('hvacOperationMode', hvacMode)
+        if batteryLevel is not None:
+            self.states.setdefault('batteryLevel', batteryLevel)
+
+    @property
+    def temperatures(self):
+        temperatureKeys = sorted([key for key in self.states if key.startswith('temperatureInput')])
+        return [self.states[key] for key in temperatureKeys]
+
+    @property
+    def heatSetpoint(self):
+        return self.states['setpointHeat']
+
+    @property
+    def hvacMode(self):
+        return self.states['hvacOperationMode']
+
+
+# noinspection PyPep8Naming
+class SensorDevice(Device):
+
+    def __init__(self, name, sensorValue=20.0, batteryLevel=None, **kwargs):
+        Device.__init__(self, name, **kwargs)
+        self.states.setdefault('sensorValue', float(sensorValue))
+        if batteryLevel is not None:
+            self.states.setdefault('batteryLevel', batteryLevel)
+        self.subType = kSensorDeviceSubType.Temperature
+
+    @property
+    def sensorValue(self):
+        return self.states['sensorValue']
+
+
+# noinspection PyPep8Naming
+class RelayDevice(Device):
+
+    def __init__(self, name, onState=False, **kwargs):
+        Device.__init__(self, name, **kwargs)
+        self.states.setdefault('onOffState', bool(onState))
+
+    @property
+    def onState(self):
+        return self.states['onOffState']
+
+
+# noinspection PyPep8Naming
+class DimmerDevice(RelayDevice):
+
+    def __init__(self, name, brightness=0, **kwargs):
+        RelayDevice.__init__(self, name, onState=brightness > 0, **kwargs)
+        self.states.setdefault('brightnessLevel', int(brightness))
+
+    @property
+    def brightness(self):
+        return self.states['brightnessLevel']
+
+
+# noinspection PyPep8Naming
+class _DeviceList:
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.byId = dict()
+        self.nextId = 100000001
+        self.pendingUpdates = collections.deque()  # (origDev, newDev) waiting to be delivered to the plugin
+        self.subscribed = False
+
+    def add(self, dev):
+        # Harness only - add a device as though created in the Indigo UI
+        with self.lock:
+            dev.id = self.nextId
+            self.nextId += 1
+            self.byId[dev.id] = dev
+        return dev
+
+    def applyStates(self, devId, stateUpdates):
+        # Apply state changes and queue a deviceUpdated callback if anything actually changed (as Indigo does)
+        with self.lock:
+            dev = self.byId[devId]
+            changedStates = {key: value for key, value in stateUpdates.items() if dev.states.get(key, None) != value}
+            if not changedStates:
+                return
+            origDev = dev.snapshot()
+            dev.states.update(changedStates)
+            dev.lastSuccessfulComm = datetime.datetime.now()
+            self.pendingUpdates.append((origDev, dev.snapshot()))
+
+    def _lookup(self, key):
+        if isinstance(key, str):
+            for dev in self.byId.values():
+                if dev.name == key:
+                    return dev
+            raise KeyError(key)
+        return self.byId[int(key)]
+
+    def __getitem__(self, key):
+        # A copy, as Indigo returns - it doesn't change when the device does, until refreshFromServer
+        with _Recorded('devices.get'):
+            with self.lock:
+                return self._lookup(key).snapshot()
+
+    def __contains__(self, key):
+        with self.lock:
+            try:
+                self._lookup(key)
+                return True
+            except KeyError:
+                return False
+
+    def __iter__(self):
+        with _Recorded('devices.iter'):
+            with self.lock:
+                return iter(list(self.byId.values()))
+
+    def __len__(self):
+        return len(self.byId)
+
+    def iter(self, indigo_filter=''):
+        with _Recorded('devices.iter'):
+            with self.lock:
+                if indigo_filter == 'self':
+                    return iter([dev for dev in self.byId.values() if dev.deviceTypeId == 'trvController'])
+                if indigo_filter == 'indigo.zwave':
+                    return iter([dev for dev in self.byId.values() if dev.protocol == kProtocol.ZWave])
+                if indigo_filter == 'indigo.thermostat':
+                    return iter([dev for dev in self.byId.values() if isinstance(dev, ThermostatDevice)])
+                return iter(list(self.byId.values()))
+
+    def subscribeToChanges(self):
+        self.subscribed = True
+
+
+devices = _DeviceList()
+
+
+# noinspection PyPep8Naming
+class _DeviceCommands:
+
+    @staticmethod
+    def enable(devId, value=True):
+        with _Recorded('device.enable'):
+            devices.byId[int(devId)].enabled = bool(value)
+
+    @staticmethod
+    def statusRequest(devId):
+        with _Recorded('device.statusRequest'):
+            pass
+
+    @staticmethod
+    def turnOn(devId):
+        with _Recorded('device.turnOn'):
+            devices.applyStates(int(devId), {'onOffState': True})
+
+    @staticmethod
+    def turnOff(devId):
+        with _Recorded('device.turnOff'):
+            devices.applyStates(int(devId), {'onOffState': False})
+
+    @staticmethod
+    def getGroupList(devId):
+        with _Recorded('device.getGroupList'):
+            address = devices.byId[int(devId)].address
+            return [dev.id for dev in devices.byId.values() if dev.address == address and dev.protocol == kProtocol.ZWave]
+
+
+device = _DeviceCommands()
+
+
+# noinspection PyPep8Naming
+class _ThermostatCommands:
+
+    @staticmethod
+    def setHeatSetpoint(devId, value):
+        with _Recorded('thermostat.setHeatSetpoint'):
+            devices.applyStates(int(devId), {'setpointHeat': float(value)})
+
+    @staticmethod
+    def setHvacMode(devId, value):
+        with _Recorded('thermostat.setHvacMode'):
+            devices.applyStates(int(devId), {'hvacOperationMode': value})
+
+
+thermostat = _ThermostatCommands()
+
+
+# ============================================================================
+# Variables
+# ============================================================================
+
+# noinspection PyPep8Naming
+class Variable:
+
+    def __init__(self, variableId, name, value='', folderId=0):
+        self.id = variableId
+        self.name = name
+        self.value = value
+        self.folderId = folderId
+
+
+# noinspection PyPep8Naming
+class _VariableFolders:
+
+    def __init__(self):
+        self.byName = dict()
+        self.nextId = 1
+
+    def __contains__(self, name):
+        return name in self.byName
+
+    def getId(self, name):
+        return self.byName[name]
+
+
+# noinspection PyPep8Naming
+class _VariableFolderCommands:
+
+    @staticmethod
+    def create(name):
+        with _Recorded('variables.folder.create'):
+            variables.folders.byName[name] = variables.folders.nextId
+            variables.folders.nextId += 1
+
+
+# noinspection PyPep8Naming
+class _VariableList:
+
+    def __init__(self):
+        self.byId = dict()
+        self.nextId = 200000001
+        self.folders = _VariableFolders()
+        self.folder = _VariableFolderCommands()
+
+    def add(self, name, value='', folderId=0):
+        variable_ = Variable(self.nextId, name, value, folderId)
+        self.byId[variable_.id] = variable_
+        self.nextId += 1
+        return variable_
+
+    def _lookup(self, key):
+        if isinstance(key, str):
+            for variable_ in self.byId.values():
+                if variable_.name == key:
+                    return variable_
+            raise KeyError(key)
+        return self.byId[int(key)]
+
+    def __getitem__(self, key):
+        with _Recorded('variables.get'):
+            return self._lookup(key)
+
+    def __contains__(self, key):
+        try:
+            self._lookup(key)
+            return True
+        except KeyError:
+            return False
+
+    def __iter__(self):
+        return iter(list(self.byId.values()))
+
+    def iter(self, indigo_filter=''):  # noqa - same signature as Indigo
+        return iter(list(self.byId.values()))
+
+
+variables = _VariableList()
+
+
+# noinspection PyPep8Naming
+class _VariableCommands:
+
+    @staticmethod
+    def updateValue(key, value):
+        with _Recorded('variable.updateValue'):
+            variables._lookup(key).value = value  # noqa - private access is fine within the stub
+
+    @staticmethod
+    def create(name, value='', folder=0):
+        with _Recorded('variable.create'):
+            return variables.add(name, value, folder)
+
+
+variable = _VariableCommands()
+
+
+# ============================================================================
+# Z-Wave
+# ============================================================================
+
+# noinspection PyPep8Naming
+class _ZwaveCommands:
+
+    def __init__(self):
+        self.sent = collections.deque(maxlen=1000)  # Most recent raw commands sent
+
+    def sendRaw(self, device=None, cmdBytes=None, sendMode=1, waitUntilAck=True):  # noqa - same signature as Indigo
+        with _Recorded('zwave.sendRaw'):
+            self.sent.append((getattr(device, 'id', device), list(cmdBytes) if cmdBytes is not None else []))
+
+    def subscribeToIncoming(self):
+        pass
+
+    def subscribeToOutgoing(self):
+        pass
+
+
+zwave = _ZwaveCommands()
+
+
+# ============================================================================
+# Server
+# ============================================================================
+
+# noinspection PyPep8Naming
+class _Server:
+
+    def __init__(self):
+        self.apiVersion = '3.0'
+        self.address = '127.0.0.1'
+        self.version = '2022.1.0 (stub)'
+        self.licenseStatus = 'stub'
+        self.installFolderPath = os.getcwd()
+        self.logsFolderPath = os.getcwd()
+        self.timeSource = datetime.datetime.now  # Replaced by simulators that run faster than real time
+        self.logger = logging.getLogger('Plugin.IndigoStub')
+
+    def getTime(self):
+        with _Recorded('server.getTime'):
+            return self.timeSource()
+
+    def getInstallFolderPath(self):
+        return self.installFolderPath
+
+    def getLogsFolderPath(self, pluginId=None):  # noqa - same signature as Indigo
+        return self.logsFolderPath
+
+    def log(self, message, level=logging.INFO, isError=False, type=''):  # noqa - same signature as Indigo
+        self.logger.log(logging.ERROR if isError else level, message)
+
+    def error(self, message):
+        self.logger.error(message)
+
+    def pumpDeviceUpdates(self, plugin, limit=None):
+        # Deliver queued deviceUpdated callbacks to the plugin (including those generated whilst delivering). Returns the number delivered.
+        delivered = 0
+        while limit is None or delivered < limit:
+            try:
+                origDev, newDev = devices.pendingUpdates.popleft()
+            except IndexError:
+                break
+            plugin.deviceUpdated(origDev, newDev)
+            delivered += 1
+        return delivered
+
+
+server = _Server()
+
+
+# ============================================================================
+# Plugin base class
+# ============================================================================
+
+# noinspection PyPep8Naming
+class PluginBase:
+
+    def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
+        self.pluginId = pluginId
+        self.pluginDisplayName = pluginDisplayName
+        self.pluginVersion = pluginVersion
+        self.pluginPrefs = pluginPrefs
+        self.logger = logging.getLogger('Plugin')
+
+        self.indigo_log_handler = logging.NullHandler()
+        self.plugin_file_handler = logging.NullHandler()
+        pluginLogger = logging.getLogger('Plugin')
+        pluginLogger.addHandler(self.indigo_log_handler)
+        pluginLogger.addHandler(self.plugin_file_handler)
+        pluginLogger.setLevel(logging.INFO)
+
+    def __del__(self):
+        pass
+
+    def deviceCreated(self, dev):
+        pass
+
+    def deviceDeleted(self, dev):
+        pass
+
+    def deviceUpdated(self, origDev, newDev):
+        pass
+
+    def sleep(self, seconds):  # noqa - Method is not declared static
+        time.sleep(seconds)
+
+
+# Indigo adds a 'threaddebug' level below DEBUG
+logging.THREADDEBUG = 5
+logging.addLevelName(logging.THREADDEBUG, 'THREADDEBUG')
+
+
+def _threaddebug(self, message, *args, **kwargs):
+    if self.isEnabledFor(logging.THREADDEBUG):
+        self._log(logging.THREADDEBUG, message, args, **kwargs)  # noqa - private access mirrors logging.Logger.debug
+
+
+logging.Logger.threaddebug = _threaddebug
@@ -0,0 +1,197 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# TRV Controller Z-Wave Replay © Autolog 2022
+#
+# Replays a Z-Wave frame capture (see the plugin's 'Capture Z-Wave Frames' option, or benchmark.py --zwave-capture) to benchmark and
+# regression-test Z-Wave decoding. Frames are fed at maximum speed or, with --speed, at their recorded spacing scaled by the speed factor:
+#   - interpreter mode (default) feeds each frame to a ZwaveInterpreter and times the decode,
+#   - plugin mode starts the plugin headless against the fake 'indigo' module with a benchmark fleet and feeds each frame to
+#     zwaveCommandReceived / zwaveCommandSent. Frames only drive TRV Controllers whose node ids match the fleet's (see benchmark.py).
+#
+# The decoded overview / detail of each frame can be written with --write-expected and later compared with --expected: any difference
+# is reported and the exit status is 1.
+#
+# Usage: python tools/replayZwave.py CAPTURE [CAPTURE ...] [--speed 1.0] [--mode plugin --controllers 50] [--expected decoded.jsonl]
+#   CAPTURE is a capture file; its rotated predecessors (CAPTURE.1, CAPTURE.2 ...) are replayed first, oldest first.
+
+import argparse
+import json
+import logging
+import sys
+import tempfile
+import time
+
+import benchmark
+from benchmark import indigo
+
+from zwaveCapture import captureFiles, readCaptureFile  # noqa - on the path set-up by benchmark
+from zwave_interpreter.zwave_interpreter import ZwaveInterpreter, ZW_COMMAND, ZW_COMMAND_CLASS, ZW_INTERPRETATION_ATTEMPTED, ZW_INTERPRETATION_DETAIL_UI, \
+    ZW_INTERPRETATION_OVERVIEW_UI  # noqa
+
+REPORT_MISMATCHES = 10
+
+
+# noinspection PyPep8Naming
+class InterpreterErrors:
+
+    # Stands in for the plugin's exception_handler so that decode failures are counted rather than only logged
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, exception_error, log_failing_statement):
+        self.count += 1
+        logging.getLogger('Replay').debug(f'Z-Wave interpretation failed: {exception_error}')
+
+
+def decodedSummary(interpretation):
+    # The parts of an interpretation that are compared between runs - interpret_zwave re-uses its result dictionary, so this is a copy
+    if interpretation is None or not interpretation.get(ZW_INTERPRETATION_ATTEMPTED, False):
+        return {'attempted': False}
+    return {'attempted': True,
+            'commandClass': interpretation.get(ZW_COMMAND_CLASS, None),
+            'command': interpretation.get(ZW_COMMAND, None),
+            'overview': interpretation.get(ZW_INTERPRETATION_OVERVIEW_UI, ''),
+            'detail': interpretation.get(ZW_INTERPRETATION_DETAIL_UI, '')}
+
+
+def percentile(sortedValues, fraction):
+    if not sortedValues:
+        return 0.0
+    return sortedValues[min(int(len(sortedValues) * fraction), len(sortedValues) - 1)]
+
+
+def replay(arguments):
+    logging.basicConfig(format='%(asctime)s %(levelname)-8s %(name)s %(message)s')
+    logging.getLogger().handlers[0].setLevel(logging.INFO if arguments.verbose else logging.WARNING)
+
+    capturePaths = list()
+    for capturePath in arguments.captures:
+        capturePaths.extend(captureFiles(capturePath) or [capturePath])
+
+    plugin = None
+    errors = InterpreterErrors()
+    if arguments.mode == 'plugin':
+        benchmark.setupServer(tempfile.mkdtemp(prefix='trv_replay_'))
+        fleet = benchmark.createFleet(arguments.controllers)
+        from plugin import Plugin  # noqa - imported here as it needs the fake indigo server set-up first
+        plugin = Plugin(benchmark.PLUGIN_ID, 'TRV Controller', benchmark.pluginVersion(), {'trvVariableFolderName': 'TRV', 'delayQueueSeconds': 0})
+        plugin.startup()
+        for trvCtlrDev, trvDev, remoteDev, radiatorDev in fleet:
+            plugin.deviceStartComm(indigo.devices[trvCtlrDev.id])
+        benchmark.waitUntilIdle(plugin, arguments.settle)
+        interpreter = None
+    else:
+        interpreter = ZwaveInterpreter(errors, logging.getLogger('Replay.Interpreter'), indigo.devices, indigo.device.getGroupList)
+
+    decodeSeconds = list()
+    decoded = list()
+    framesByDirection = {'received': 0, 'sent': 0}
+    firstTimestamp = None
+    replayStartTime = time.perf_counter()
+
+    for capturePath in capturePaths:
+        for received, timestamp, zwaveCommand in readCaptureFile(capturePath):
+            if arguments.speed > 0.0:
+                if firstTimestamp is None:
+                    firstTimestamp = timestamp
+                delaySeconds = (timestamp - firstTimestamp) / arguments.speed - (time.perf_counter() - replayStartTime)
+                if delaySeconds > 0.0:
+                    time.sleep(delaySeconds)
+
+            frameStartTime = time.perf_counter()
+            if plugin is not None:
+                if received:
+                    plugin.zwaveCommandReceived(zwaveCommand)
+                else:
+                    plugin.zwaveCommandSent(zwaveCommand)
+                decodeSeconds.append(time.perf_counter() - frameStartTime)
+                indigo.server.pumpDeviceUpdates(plugin)
+            else:
+                interpretation = interpreter.interpret_zwave(received, zwaveCommand)
+                decodeSeconds.append(time.perf_counter() - frameStartTime)
+                decoded.append(decodedSummary(interpretation))
+            framesByDirection['received' if received else 'sent'] += 1
+
+    replaySeconds = max(time.perf_counter() - replayStartTime, 1e-6)
+    if plugin is not None:
+        benchmark.waitUntilIdle(plugin, arguments.settle)
+        benchmark.stopPlugin(plugin)
+
+    sortedMs = sorted([seconds * 1000.0 for seconds in decodeSeconds])
+    return {'captures': capturePaths,
+            'mode': arguments.mode,
+            'frames': len(decodeSeconds),
+            'received': framesByDirection['received'],
+            'sent': framesByDirection['sent'],
+            'replaySeconds': round(replaySeconds, 3),
+            'framesPerSecond': round(len(decodeSeconds) / replaySeconds, 1),
+            'frameMeanMs': round(sum(sortedMs) / len(sortedMs), 4) if sortedMs else 0.0,
+            'frameP95Ms': round(percentile(sortedMs, 0.95), 4),
+            'frameMaxMs': round(sortedMs[-1], 4) if sortedMs else 0.0,
+            'interpretationErrors': errors.count,
+            'decoded': decoded}
+
+
+def compareDecoded(decoded, expectedPath):
+    # Returns a list of (frame number, expected, actual) for frames that decode differently to the expected file
+    with open(expectedPath) as expectedFile:
+        expected = [json.loads(line) for line in expectedFile if line.strip()]
+    mismatches = [(frameNumber, expectedSummary, actualSummary) for frameNumber, (expectedSummary, actualSummary) in enumerate(zip(expected, decoded), start=1)
+                  if expectedSummary != actualSummary]
+    if len(expected) != len(decoded):
+        mismatches.append((min(len(expected), len(decoded)) + 1, f'{len(expected)} frames', f'{len(decoded)} frames'))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a TRV Controller Z-Wave frame capture')
+    parser.add_argument('captures', nargs='+', help='capture file(s) - rotated predecessors are included automatically')
+    parser.add_argument('--speed', type=float, default=0.0, help='replay at the recorded frame spacing divided by this factor (0 = maximum speed)')
+    parser.add_argument('--mode', choices=('interpreter', 'plugin'), default='interpreter', help='feed frames to the Z-Wave interpreter only or through the plugin')
+    parser.add_argument('--controllers', type=int, default=50, help='plugin mode: number of virtual TRV Controllers')
+    parser.add_argument('--settle', type=float, default=1.0, help='plugin mode: seconds of inactivity before the plugin is considered idle')
+    parser.add_argument('--write-expected', dest='writeExpected', default='', help='interpreter mode: write the decoded frames to this file')
+    parser.add_argument('--expected', default='', help='interpreter mode: compare the decoded frames with this file')
+    parser.add_argument('--json', default='', help='also write the results to this file')
+    parser.add_argument('--verbose', action='store_true', help='show plugin / interpreter INFO logging')
+    arguments = parser.parse_args()
+
+    if (arguments.writeExpected or arguments.expected) and arguments.mode != 'interpreter':
+        parser.error('--write-expected and --expected are only available in interpreter mode')
+
+    results = replay(arguments)
+
+    print(f'\nZ-Wave replay ({results["mode"]} mode): {results["frames"]} frames [{results["received"]} received, {results["sent"]} sent] from {len(results["captures"])} file(s)')
+    print(f'    {results["replaySeconds"]:.3f} s, {results["framesPerSecond"]:.1f} frames/s, per frame mean {results["frameMeanMs"]:.4f} ms, '
+          f'p95 {results["frameP95Ms"]:.4f} ms, max {results["frameMaxMs"]:.4f} ms')
+    if results['mode'] == 'interpreter':
+        print(f'    {sum([1 for summary in results["decoded"] if summary["attempted"]])} frames interpreted, {results["interpretationErrors"]} interpretation errors')
+
+    if arguments.writeExpected:
+        with open(arguments.writeExpected, 'w') as expectedFile:
+            for summary in results['decoded']:
+                expectedFile.write(f'{json.dumps(summary, sort_keys=True)}\n')
+        print(f'    Decoded frames written to {arguments.writeExpected}')
+
+    exitStatus = 0
+    if arguments.expected:
+        mismatches = compareDecoded(results['decoded'], arguments.expected)
+        if mismatches:
+            exitStatus = 1
+            print(f'\n{len(mismatches)} frame(s) decode differently to {arguments.expected}:')
+            for frameNumber, expectedSummary, actualSummary in mismatches[:REPORT_MISMATCHES]:
+                print(f'    Frame {frameNumber}:\n        expected {expectedSummary}\n        actual   {actualSummary}')
+        else:
+            print(f'    All frames decode as in {arguments.expected}')
+
+    if arguments.json:
+        with open(arguments.json, 'w') as resultsFile:
+            json.dump(results, resultsFile, indent=2)
+
+    sys.exit(exitStatus)
+
+
+if __name__ == '__main__':
+    main()
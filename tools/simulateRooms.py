@@ -0,0 +1,326 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# TRV Controller Room Simulator © Autolog 2022
+#
+# Soak / sizing load generator: runs the plugin headless against the fake 'indigo' module (see benchmark.py) with every TRV Controller
+# attached to a simulated room. Each room has a heat loss to a daily outside temperature cycle and a radiator whose output follows the
+# TRV valve opening (driven by the TRV's setpoint) and the state of its heat source. The TRVs, remote thermostats and radiator sensors
+# report on their own intervals as device updates and Z-Wave frames, and heating schedule boundaries are driven from the simulated clock.
+#
+# Simulated time runs as fast as the plugin can keep up: each step waits only until the plugin's queues are drained. At the end the
+# simulator reports plugin CPU, queue latency, outbound command counts and heat-source cycling per simulated day.
+#
+# Usage: python tools/simulateRooms.py [--controllers 200] [--days 1] [--step 60] [--json results.json]
+
+import argparse
+import datetime
+import json
+import logging
+import math
+import random
+import tempfile
+import time
+import types
+
+import benchmark
+from benchmark import indigo
+
+ROOM_HEAT_CAPACITY_KJ_PER_C = (2500.0, 6000.0)  # Range of room (air + fabric) heat capacities
+ROOM_HEAT_LOSS_KW_PER_C = (0.04, 0.12)  # Range of room heat loss coefficients
+RADIATOR_OUTPUT_KW = (0.8, 2.5)  # Range of radiator outputs at full flow
+TRV_PROPORTIONAL_BAND_C = 1.5  # Valve is fully open when the TRV reads this far below its setpoint
+TRV_RADIATOR_INFLUENCE_C = 1.0  # The TRV sits on the radiator so reads warmer than the room when the valve is open
+RADIATOR_SURFACE_RISE_C = 45.0  # Radiator surface temperature rise over the room at full output
+OUTSIDE_MEAN_C = 5.0
+OUTSIDE_SWING_C = 4.0  # Daily swing either side of the mean - coldest at 04:00
+
+REMOTE_REPORT_SECONDS = 300  # Remote thermostat reports on this interval or on a change of REMOTE_REPORT_DELTA_C
+REMOTE_REPORT_DELTA_C = 0.2
+TRV_REPORT_SECONDS = 600  # TRV temperature / setpoint report interval
+RADIATOR_REPORT_SECONDS = 300
+
+
+# noinspection PyPep8Naming
+class SimulatedClock:
+
+    # Simulated wall clock, used in place of datetime.datetime.now() / indigo.server.getTime() by the plugin
+
+    def __init__(self, startTime):
+        self.currentTime = startTime
+
+    def now(self):
+        return self.currentTime
+
+    def advance(self, seconds):
+        self.currentTime += datetime.timedelta(seconds=seconds)
+
+
+def installSimulatedClock(clock, pluginModules):
+    # The plugin reads the time with datetime.datetime.now() / utcnow() - give its modules a datetime whose now() is the simulated clock
+
+    class SimulatedDatetime(datetime.datetime):
+
+        @classmethod
+        def now(cls, tz=None):  # noqa - same signature as datetime.now
+            return clock.now()
+
+        @classmethod
+        def utcnow(cls):
+            return clock.now()
+
+    simulatedDatetimeModule = types.SimpleNamespace(**{name: getattr(datetime, name) for name in dir(datetime) if not name.startswith('__')})
+    simulatedDatetimeModule.datetime = SimulatedDatetime
+    for module in pluginModules:
+        module.datetime = simulatedDatetimeModule
+    indigo.server.timeSource = clock.now
+
+
+# noinspection PyPep8Naming
+class Room:
+
+    def __init__(self, trvCtlrDev, trvDev, remoteDev, radiatorDev, heatingId):
+        self.trvCtlrDevId = trvCtlrDev.id
+        self.trvDevId = trvDev.id
+        self.remoteDevId = remoteDev.id
+        self.radiatorDevId = radiatorDev.id if radiatorDev is not None else 0
+        self.heatingId = heatingId
+        self.node = int(trvDev.address)
+
+        self.heatCapacity = random.uniform(*ROOM_HEAT_CAPACITY_KJ_PER_C)
+        self.heatLoss = random.uniform(*ROOM_HEAT_LOSS_KW_PER_C)
+        self.radiatorOutput = random.uniform(*RADIATOR_OUTPUT_KW)
+        self.temperature = remoteDev.states['sensorValue']
+        self.valveOpening = 0.0  # 0.0 - 1.0
+        self.heatOutput = 0.0  # 0.0 - 1.0 of radiator output (valve opening with the heat source on)
+
+        # Stagger the sensor reports so that the rooms don't all report in the same step
+        self.nextRemoteReport = random.uniform(0, REMOTE_REPORT_SECONDS)
+        self.nextTrvReport = random.uniform(0, TRV_REPORT_SECONDS)
+        self.nextRadiatorReport = random.uniform(0, RADIATOR_REPORT_SECONDS)
+        self.lastReportedTemperature = self.temperature
+
+    def trvTemperature(self):
+        return self.temperature + TRV_RADIATOR_INFLUENCE_C * self.heatOutput
+
+    def radiatorTemperature(self):
+        return self.temperature + RADIATOR_SURFACE_RISE_C * self.heatOutput
+
+    def step(self, seconds, outsideTemperature):
+        trvDev = indigo.devices.byId[self.trvDevId]
+        heatSourceOn = bool(indigo.devices.byId[self.heatingId].states['onOffState']) if self.heatingId != 0 else True
+        trvHeating = trvDev.states['hvacOperationMode'] != indigo.kHvacMode.Off
+        if trvHeating:
+            self.valveOpening = min(max((trvDev.states['setpointHeat'] - self.trvTemperature()) / TRV_PROPORTIONAL_BAND_C, 0.0), 1.0)
+        else:
+            self.valveOpening = 0.0
+        self.heatOutput = self.valveOpening if heatSourceOn else 0.0
+
+        heatInputKw = self.radiatorOutput * self.heatOutput
+        heatLossKw = self.heatLoss * (self.temperature - outsideTemperature)
+        self.temperature += (heatInputKw - heatLossKw) * seconds / self.heatCapacity
+
+
+# noinspection PyPep8Naming
+class RoomSimulator:
+
+    def __init__(self, arguments):
+        self.arguments = arguments
+        self.stepSeconds = arguments.step
+        # Start half a minute after midnight so that steps fall between, rather than on, the whole minute schedule times - the clock doesn't move
+        # whilst the plugin processes a step, so a step landing exactly on a schedule time would have the plugin re-trigger that schedule
+        self.clock = SimulatedClock(datetime.datetime.combine(datetime.date.today(), datetime.time(0, 0, 30)))
+        self.rooms = list()
+        self.plugin = None
+        self.zwaveFrames = 0
+        self.deviceReports = 0
+        self.heatSourceStates = dict()
+        self.heatSourceCycles = dict()
+        self.heatSourceOnSeconds = dict()
+        self.scheduleBoundaries = list()
+
+    def outsideTemperature(self):
+        secondsSinceMidnight = (self.clock.now() - self.clock.now().replace(hour=0, minute=0, second=0, microsecond=0)).total_seconds()
+        return OUTSIDE_MEAN_C - OUTSIDE_SWING_C * math.cos(2.0 * math.pi * (secondsSinceMidnight - 4 * 3600) / 86400.0)
+
+    def start(self):
+        benchmark.setupServer(tempfile.mkdtemp(prefix='trv_simulation_'))
+        fleet = benchmark.createFleet(self.arguments.controllers, radiatorSensors=True)
+
+        import constants
+        import plugin
+        import trvHandler
+        installSimulatedClock(self.clock, (plugin, trvHandler))
+        self.constants = constants
+
+        self.plugin = plugin.Plugin(benchmark.PLUGIN_ID, 'TRV Controller', benchmark.pluginVersion(), {'trvVariableFolderName': 'TRV', 'delayQueueSeconds': 0})
+        self.plugin.startup()
+        for trvCtlrDev, trvDev, remoteDev, radiatorDev in fleet:
+            self.plugin.deviceStartComm(indigo.devices[trvCtlrDev.id])
+            self.rooms.append(Room(trvCtlrDev, trvDev, remoteDev, radiatorDev, int(trvCtlrDev.pluginProps['heatingId'])))
+        benchmark.waitUntilIdle(self.plugin, self.arguments.settle)
+
+        for heatingId in set([room.heatingId for room in self.rooms]):
+            self.heatSourceStates[heatingId] = bool(indigo.devices.byId[heatingId].states['onOffState'])
+            self.heatSourceCycles[heatingId] = 0
+            self.heatSourceOnSeconds[heatingId] = 0.0
+
+        # Schedule on / off times (seconds since midnight) at which the plugin re-evaluates every controller's heating schedule
+        for timeName in ('schedule1TimeOn', 'schedule1TimeOff', 'schedule2TimeOn', 'schedule2TimeOff'):
+            hhmm = fleet[0][0].pluginProps[timeName]
+            self.scheduleBoundaries.append(int(hhmm[0:2]) * 3600 + int(hhmm[3:5]) * 60)
+
+    def crossedSecondsSinceMidnight(self, seconds):
+        # True if the last step crossed the given time of day
+        stepEnd = self.clock.now()
+        stepStart = stepEnd - datetime.timedelta(seconds=self.stepSeconds)
+        boundary = stepEnd.replace(hour=0, minute=0, second=0, microsecond=0) + datetime.timedelta(seconds=seconds)
+        return stepStart < boundary <= stepEnd
+
+    def queueScheduleBoundaries(self):
+        trvHandlerQueue = self.plugin.globals['queues']['trvHandler']
+        if self.arguments.restate and self.crossedSecondsSinceMidnight(0):
+            trvHandlerQueue.put([self.constants.QUEUE_PRIORITY_STATUS_HIGH, 0, self.constants.CMD_RESTATE_SCHEDULES, None, None])
+        for boundary in self.scheduleBoundaries:
+            if self.crossedSecondsSinceMidnight(boundary):
+                for room in self.rooms:
+                    trvHandlerQueue.put([self.constants.QUEUE_PRIORITY_STATUS_MEDIUM, 0, self.constants.CMD_PROCESS_HEATING_SCHEDULE, room.trvCtlrDevId, None])
+
+    def reportSensors(self, room):
+        if room.nextRemoteReport <= 0.0 or abs(room.temperature - room.lastReportedTemperature) >= REMOTE_REPORT_DELTA_C:
+            room.lastReportedTemperature = room.temperature
+            room.nextRemoteReport = REMOTE_REPORT_SECONDS
+            indigo.devices.applyStates(room.remoteDevId, {'sensorValue': round(room.temperature, 1)})
+            self.deviceReports += 1
+
+        if room.nextTrvReport <= 0.0:
+            room.nextTrvReport = TRV_REPORT_SECONDS
+            trvDev = indigo.devices.byId[room.trvDevId]
+            indigo.devices.applyStates(room.trvDevId, {'temperatureInput1': round(room.trvTemperature(), 1)})
+            self.plugin.zwaveCommandReceived(benchmark.zwaveSetpointReportFrame(room.node, trvDev.states['setpointHeat']))
+            self.deviceReports += 1
+            self.zwaveFrames += 1
+
+        if room.radiatorDevId != 0 and room.nextRadiatorReport <= 0.0:
+            room.nextRadiatorReport = RADIATOR_REPORT_SECONDS
+            indigo.devices.applyStates(room.radiatorDevId, {'sensorValue': round(room.radiatorTemperature(), 1)})
+            self.deviceReports += 1
+
+    def trackHeatSources(self):
+        for heatingId, previousOnState in self.heatSourceStates.items():
+            onState = bool(indigo.devices.byId[heatingId].states['onOffState'])
+            if onState:
+                self.heatSourceOnSeconds[heatingId] += self.stepSeconds
+            if onState and not previousOnState:
+                self.heatSourceCycles[heatingId] += 1
+            self.heatSourceStates[heatingId] = onState
+
+    def run(self):
+        self.start()
+
+        indigo.recorder.reset()
+        trvHandlerMetrics = self.plugin.globals['queues']['trvHandler'].metrics
+        completedAtStart = trvHandlerMetrics.completedCount
+        simulatorCpuSeconds = 0.0
+        wallStartTime = time.perf_counter()
+        processCpuStartTime = time.process_time()
+
+        simulatedSeconds = 0
+        totalSeconds = int(self.arguments.days * 86400)
+        while simulatedSeconds < totalSeconds:
+            self.clock.advance(self.stepSeconds)
+            simulatedSeconds += self.stepSeconds
+
+            simulatorStartTime = time.thread_time()
+            outsideTemperature = self.outsideTemperature()
+            for room in self.rooms:
+                room.step(self.stepSeconds, outsideTemperature)
+                room.nextRemoteReport -= self.stepSeconds
+                room.nextTrvReport -= self.stepSeconds
+                room.nextRadiatorReport -= self.stepSeconds
+            simulatorCpuSeconds += time.thread_time() - simulatorStartTime
+
+            for room in self.rooms:
+                self.reportSensors(room)
+            self.queueScheduleBoundaries()
+            benchmark.waitUntilIdle(self.plugin, 0.0, pollSeconds=0.0005)
+            self.trackHeatSources()
+
+        wallSeconds = time.perf_counter() - wallStartTime
+        pluginCpuSeconds = time.process_time() - processCpuStartTime - simulatorCpuSeconds
+
+        queueSnapshot = trvHandlerMetrics.snapshot(self.constants.CMD_TRANSLATION)
+        calls = indigo.recorder.summary()
+        self.stop()
+
+        simulatedDays = simulatedSeconds / 86400.0
+        waitHistograms = queueSnapshot['wait'].values()
+        waitCount = sum([histogram['count'] for histogram in waitHistograms])
+        heatSourceCycles = list(self.heatSourceCycles.values())
+        return {'controllers': len(self.rooms),
+                'simulatedDays': round(simulatedDays, 3),
+                'stepSeconds': self.stepSeconds,
+                'wallSeconds': round(wallSeconds, 3),
+                'speedUp': round(simulatedSeconds / wallSeconds, 1) if wallSeconds > 0 else 0.0,
+                'pluginCpuSeconds': round(pluginCpuSeconds, 3),
+                'pluginCpuSecondsPerDay': round(pluginCpuSeconds / simulatedDays, 3),
+                'pluginCpuMsPerControllerDay': round(pluginCpuSeconds * 1000.0 / simulatedDays / max(len(self.rooms), 1), 3),
+                'deviceReports': self.deviceReports,
+                'zwaveFrames': self.zwaveFrames,
+                'handlerCommands': trvHandlerMetrics.completedCount - completedAtStart,
+                'queueWaitMeanMs': round(sum([histogram['meanMs'] * histogram['count'] for histogram in waitHistograms]) / waitCount, 3) if waitCount > 0 else 0.0,
+                'queueWaitMaxMs': max([histogram['maxMs'] for histogram in waitHistograms], default=0.0),
+                'outboundCommands': {name: calls[name]['calls'] for name in benchmark.OUTBOUND_COMMAND_CALLS if name in calls},
+                'outboundCommandsPerDay': round(sum([calls[name]['calls'] for name in benchmark.OUTBOUND_COMMAND_CALLS if name in calls]) / simulatedDays, 1),
+                'heatSources': len(heatSourceCycles),
+                'heatSourceCyclesPerDay': round(sum(heatSourceCycles) / max(len(heatSourceCycles), 1) / simulatedDays, 2),
+                'heatSourceCyclesPerDayMaximum': round(max(heatSourceCycles, default=0) / simulatedDays, 2),
+                'heatSourceDutyPercent': round(sum(self.heatSourceOnSeconds.values()) * 100.0 / max(len(heatSourceCycles), 1) / simulatedSeconds, 1),
+                'roomTemperatureMean': round(sum([room.temperature for room in self.rooms]) / max(len(self.rooms), 1), 2),
+                'queueWait': queueSnapshot['wait'],
+                'calls': calls}
+
+    def stop(self):
+        benchmark.stopPlugin(self.plugin)
+
+
+def reportResults(results):
+    print(f'\nTRV Controller room simulation: {results["controllers"]} controllers, {results["simulatedDays"]} simulated days in {results["wallSeconds"]:.1f} s '
+          f'({results["speedUp"]:.0f}x real time, {results["stepSeconds"]} s steps)\n')
+    print(f'{"Plugin CPU":<32} {results["pluginCpuSeconds"]:.3f} s ({results["pluginCpuSecondsPerDay"]:.3f} s / day, {results["pluginCpuMsPerControllerDay"]:.3f} ms / controller / day)')
+    print(f'{"Device reports / Z-Wave frames":<32} {results["deviceReports"]} / {results["zwaveFrames"]}')
+    print(f'{"trvHandler commands":<32} {results["handlerCommands"]}')
+    print(f'{"Queue wait":<32} mean {results["queueWaitMeanMs"]:.3f} ms, max {results["queueWaitMaxMs"]:.3f} ms')
+    print(f'{"Outbound commands / day":<32} {results["outboundCommandsPerDay"]:.1f}')
+    for name, count in results['outboundCommands'].items():
+        print(f'    {name:<28} {count}')
+    print(f'{"Heat source cycles / day":<32} mean {results["heatSourceCyclesPerDay"]:.2f}, max {results["heatSourceCyclesPerDayMaximum"]:.2f} '
+          f'[{results["heatSources"]} heat sources, {results["heatSourceDutyPercent"]:.1f}% duty]')
+    print(f'{"Mean room temperature":<32} {results["roomTemperatureMean"]:.2f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Room thermal simulation load generator for the TRV Controller plugin')
+    parser.add_argument('--controllers', type=int, default=200, help='number of simulated rooms / TRV Controllers')
+    parser.add_argument('--days', type=float, default=1.0, help='number of simulated days')
+    parser.add_argument('--step', type=int, default=60, help='simulation step in seconds')
+    parser.add_argument('--restate', action='store_true', help='include the midnight restatement of schedules (runs in real time - 7 seconds per controller)')
+    parser.add_argument('--settle', type=float, default=2.5, help='seconds of inactivity before device start-up is considered complete')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    parser.add_argument('--json', default='', help='also write the results to this file')
+    parser.add_argument('--verbose', action='store_true', help='show plugin INFO logging')
+    arguments = parser.parse_args()
+
+    random.seed(arguments.seed)
+    logging.basicConfig(format='%(asctime)s %(levelname)-8s %(name)s %(message)s')
+    logging.getLogger().handlers[0].setLevel(logging.INFO if arguments.verbose else logging.WARNING)
+
+    results = RoomSimulator(arguments).run()
+    reportResults(results)
+    if arguments.json:
+        with open(arguments.json, 'w') as resultsFile:
+            json.dump(results, resultsFile, indent=2)
+
+
+if __name__ == '__main__':
+    main()